@@ -0,0 +1,115 @@
+"""Compare `LocalFileBackend` with `PackFileBackend` on many small files.
+
+A deterministic synthetic corpus of small files (see `corpus.py`) is
+generated once; then, for each backend, a fresh environment is timed on:
+
+- `store`: `Environment.store_many` of the whole corpus
+- `retrieve_all`: reading every stored file through `retrieve_all`
+- `save`: saving a processed output for every file through `save_async`
+- `reindex`: rebuilding the catalog from the stored files
+
+and the space each environment takes on disk, and the number of files it
+holds, is reported. Results are printed and written as JSON to `--output`.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/backends.py [--files 100000] [--events 50]
+        [--backends local pack] [--output backends.json]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+import common
+import corpus
+from magenta_rapids import backends, environment, mutators
+
+
+def _disk_usage(root: str):
+    """Bytes allocated to, and number of, the files under `root`."""
+    allocated = count = 0
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            allocated += os.stat(os.path.join(directory, filename)).st_blocks * 512
+            count += 1
+    return allocated, count
+
+
+async def _save_all(backend, filenames):
+    for filename in filenames:
+        # Processed outputs about the size of a small stored file
+        await backend.save_async(io.BytesIO(filename.encode() * 40), filename)
+
+
+def _benchmark(name: str, root: str, paths) -> dict:
+    backend = backends.BACKENDS[name](root)
+    env = environment.Environment(backend=backend, mutator=mutators.SimpleMutator())
+    os.makedirs(root)
+    env.initialize()
+    seconds = {}
+    start = time.perf_counter()
+    env.store_many(paths)
+    seconds["store"] = time.perf_counter() - start
+    start = time.perf_counter()
+    filenames = list(asyncio.run(common.retrieve_all(backend)))
+    seconds["retrieve_all"] = time.perf_counter() - start
+    start = time.perf_counter()
+    asyncio.run(_save_all(backend, filenames))
+    seconds["save"] = time.perf_counter() - start
+    start = time.perf_counter()
+    env.reindex()
+    seconds["reindex"] = time.perf_counter() - start
+    allocated, number_files = _disk_usage(root)
+    return {
+        "backend": name,
+        "files": len(filenames),
+        "seconds": seconds,
+        "files_per_s": common.files_per_s(len(filenames), seconds),
+        "disk_bytes": allocated,
+        "disk_files": number_files,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument(
+        "--backends", nargs="+", choices=sorted(backends.BACKENDS),
+        default=sorted(backends.BACKENDS),
+    )
+    parser.add_argument("--output", default="backends-results.json")
+    parser.add_argument(
+        "--workdir", help="Directory in which to keep the generated corpus",
+    )
+    corpus.add_arguments(parser)
+    parser.set_defaults(events=50)
+    arguments = parser.parse_args()
+    spec = corpus.spec_from_arguments(arguments, arguments.files)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = arguments.workdir or tmpdir
+        corpus_path = os.path.join(
+            workdir, "corpus-" + "-".join(str(value) for value in spec[1:])
+        )
+        paths = corpus.generate(corpus_path, spec)
+        results = []
+        for name in arguments.backends:
+            row = _benchmark(name, os.path.join(tmpdir, f"environment-{name}"), paths)
+            results.append(row)
+            print(
+                f"{name:>6} {row['files']:>7} files  "
+                + "  ".join(
+                    f"{stage} {value:8.2f} s ({row['files_per_s'][stage]:9.0f}/s)"
+                    for stage, value in row["seconds"].items()
+                )
+                + f"  disk {row['disk_bytes'] / 2**20:8.1f} MiB"
+                f" in {row['disk_files']} files"
+            )
+    common.write_report(arguments.output, spec, results=results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Helpers shared by the benchmarks: throughputs, reading back a whole
+environment, and writing results as JSON along with what they were measured
+on.
+"""
+
+import datetime
+import json
+import platform
+import typing as t
+
+from corpus import CorpusSpec
+
+
+def files_per_s(number_files: int, seconds: t.Dict[str, float]) -> dict:
+    """Throughput of each stage timed in `seconds`."""
+    return {
+        stage: number_files / max(value, 1e-9) for stage, value in seconds.items()
+    }
+
+
+async def retrieve_all(backend) -> t.Dict[str, int]:
+    """Read every stored file through `backend.retrieve_all`, and return
+    the size of each by filename.
+    """
+    sizes = {}
+    async for file_obj, filename in backend.retrieve_all():
+        sizes[filename] = len(file_obj.read())
+    return sizes
+
+
+def write_report(path: str, spec: CorpusSpec, **sections) -> dict:
+    """Write `sections` as JSON to `path`, with when and on which Python and
+    platform they were measured and the corpus they were measured on, and
+    return the whole report.
+    """
+    report = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": spec._asdict(),
+        **sections,
+    }
+    with open(path, "w", encoding="utf-8") as file_obj:
+        json.dump(report, file_obj, indent=2)
+    print(f"Results written to {path}")
+    return report
@@ -0,0 +1,125 @@
+"""Ratio and throughput of each compression codec and level on MIDI files.
+
+A deterministic synthetic corpus (see `corpus.py`) is generated in memory,
+then every file is compressed and decompressed one at a time, as backends
+do, with each codec at each level. Reported for each setting:
+
+- `ratio`: uncompressed bytes over compressed bytes
+- `compress_mb_s` and `decompress_mb_s`: uncompressed megabytes per second
+
+With `--environments`, each setting is also timed end to end, storing the
+corpus into a fresh `LocalFileBackend` environment compressed with it, then
+reading it back through `retrieve_all`. Results are printed and written as
+JSON to `--output`.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/compression.py [--files 1000] [--codecs zlib lzma]
+        [--levels 0 1 ... 9] [--environments] [--output compression.json]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+import common
+import corpus
+from magenta_rapids import backends, compression
+
+
+def _codec_row(setting: compression.Compression, files) -> dict:
+    size = sum(len(data) for data in files)
+    start = time.perf_counter()
+    compressed = [setting.compress(data) for data in files]
+    compress_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for data in compressed:
+        setting.decompress(data)
+    decompress_seconds = time.perf_counter() - start
+    return {
+        "compression": str(setting),
+        "bytes": size,
+        "compressed_bytes": sum(len(data) for data in compressed),
+        "ratio": size / sum(len(data) for data in compressed),
+        "compress_mb_s": size / 1e6 / compress_seconds,
+        "decompress_mb_s": size / 1e6 / decompress_seconds,
+    }
+
+
+def _environment_row(setting, files, root: str) -> dict:
+    backend = backends.LocalFileBackend(root)
+    os.makedirs(root)
+    backend.initialize(compression=None if setting is None else str(setting))
+    size = sum(len(data) for data in files)
+    start = time.perf_counter()
+    for data in files:
+        backend.store(io.BytesIO(data))
+    store_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    asyncio.run(common.retrieve_all(backend))
+    retrieve_seconds = time.perf_counter() - start
+    return {
+        "compression": str(setting or compression.NONE),
+        "store_mb_s": size / 1e6 / store_seconds,
+        "retrieve_all_mb_s": size / 1e6 / retrieve_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--files", type=int, default=1000)
+    parser.add_argument(
+        "--codecs", nargs="+", choices=compression.CODECS,
+        default=list(compression.CODECS),
+    )
+    parser.add_argument(
+        "--levels", nargs="+", type=int, choices=compression.LEVELS,
+        default=list(compression.LEVELS),
+    )
+    parser.add_argument(
+        "--environments", action="store_true",
+        help="Also time storing and retrieving through an environment",
+    )
+    parser.add_argument("--output", default="compression-results.json")
+    corpus.add_arguments(parser)
+    arguments = parser.parse_args()
+    spec = corpus.spec_from_arguments(arguments, arguments.files)
+    files = [corpus.synthetic_midi(idx, spec) for idx in range(spec.number_files)]
+    settings = [
+        compression.Compression(codec, level)
+        for codec in arguments.codecs
+        for level in arguments.levels
+    ]
+    print(f"{len(files)} files, {sum(map(len, files)) / 1e6:.1f} MB")
+    codec_rows = []
+    for setting in settings:
+        row = _codec_row(setting, files)
+        codec_rows.append(row)
+        print(
+            f"{row['compression']:>7}  ratio {row['ratio']:5.2f}  "
+            f"compress {row['compress_mb_s']:7.1f} MB/s  "
+            f"decompress {row['decompress_mb_s']:7.1f} MB/s"
+        )
+    environment_rows = []
+    if arguments.environments:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for idx, setting in enumerate([None] + settings):
+                row = _environment_row(
+                    setting, files, os.path.join(tmpdir, f"environment-{idx}")
+                )
+                environment_rows.append(row)
+                print(
+                    f"{row['compression']:>7}  "
+                    f"store {row['store_mb_s']:7.1f} MB/s  "
+                    f"retrieve_all {row['retrieve_all_mb_s']:7.1f} MB/s"
+                )
+    common.write_report(
+        arguments.output, spec, codecs=codec_rows, environments=environment_rows
+    )
+
+
+if __name__ == "__main__":
+    main()
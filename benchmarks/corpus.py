@@ -0,0 +1,134 @@
+"""Deterministic synthetic MIDI corpora for benchmarks.
+
+Every file is built directly as Standard MIDI File bytes from a seeded
+random generator, so a corpus is fully determined by its parameters and
+generating a large one is cheap. Each track holds exactly
+`events_per_track` events: note on/off pairs interleaved with meta events
+(text and tempo changes) and sysex messages at the requested densities,
+followed by an end-of-track event.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/corpus.py DIRECTORY [--files N] [--tracks N]
+        [--events N] [--meta-density P] [--sysex-density P] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import struct
+import typing as t
+
+from magenta_rapids import smf
+
+
+class CorpusSpec(t.NamedTuple):
+    number_files: int = 100
+    number_tracks: int = 4
+    events_per_track: int = 1000
+    meta_density: float = 0.01
+    sysex_density: float = 0.005
+    seed: int = 0
+
+    @property
+    def events_per_file(self) -> int:
+        return self.number_tracks * self.events_per_track
+
+
+def _meta_event(rng: random.Random) -> bytes:
+    if rng.random() < 0.5:
+        tempo = rng.randint(300000, 900000)
+        return b"\xff\x51\x03" + tempo.to_bytes(3, "big")
+    text = bytes(rng.choices(b"abcdefghijklmnopqrstuvwxyz ", k=rng.randint(4, 24)))
+    return b"\xff\x01" + smf.encode_variable_int(len(text)) + text
+
+
+def _sysex_event(rng: random.Random) -> bytes:
+    payload = bytes(rng.randint(0, 0x7F) for _ in range(rng.randint(4, 32)))
+    return b"\xf0" + smf.encode_variable_int(len(payload) + 1) + payload + b"\xf7"
+
+
+def _track(rng: random.Random, channel: int, spec: CorpusSpec) -> bytes:
+    events = bytearray()
+    open_notes = []
+    for _ in range(spec.events_per_track):
+        events += smf.encode_variable_int(rng.randint(0, 480))
+        roll = rng.random()
+        if roll < spec.meta_density:
+            events += _meta_event(rng)
+        elif roll < spec.meta_density + spec.sysex_density:
+            events += _sysex_event(rng)
+        elif open_notes and (len(open_notes) > 8 or rng.random() < 0.5):
+            note = open_notes.pop(rng.randrange(len(open_notes)))
+            events += bytes((0x80 | channel, note, 64))
+        else:
+            note = rng.randint(1, 127)
+            open_notes.append(note)
+            events += bytes((0x90 | channel, note, rng.randint(1, 127)))
+    events += b"\x00\xff\x2f\x00"
+    return b"MTrk" + struct.pack(">I", len(events)) + events
+
+
+def synthetic_midi(index: int, spec: CorpusSpec) -> bytes:
+    """Bytes of file number `index` of the corpus described by `spec`."""
+    rng = random.Random(f"{spec.seed}-{index}")
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, spec.number_tracks, 480)
+    return header + b"".join(
+        _track(rng, channel % 16, spec) for channel in range(spec.number_tracks)
+    )
+
+
+def generate(directory: str, spec: CorpusSpec) -> t.List[str]:
+    """Write the corpus described by `spec` to `directory`, and return the
+    paths of its files. Files already present are left untouched, so a
+    corpus can be generated once and reused.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(spec.number_files):
+        path = os.path.join(directory, f"synthetic-{spec.seed}-{index:06d}.mid")
+        if not os.path.exists(path):
+            with open(path, "wb") as file_obj:
+                file_obj.write(synthetic_midi(index, spec))
+        paths.append(path)
+    return paths
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = CorpusSpec()
+    parser.add_argument("--tracks", type=int, default=defaults.number_tracks)
+    parser.add_argument("--events", type=int, default=defaults.events_per_track)
+    parser.add_argument(
+        "--meta-density", type=float, default=defaults.meta_density,
+        help="Probability of each event being a meta event",
+    )
+    parser.add_argument(
+        "--sysex-density", type=float, default=defaults.sysex_density,
+        help="Probability of each event being a sysex message",
+    )
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def spec_from_arguments(arguments, number_files: int) -> CorpusSpec:
+    return CorpusSpec(
+        number_files=number_files,
+        number_tracks=arguments.tracks,
+        events_per_track=arguments.events,
+        meta_density=arguments.meta_density,
+        sysex_density=arguments.sysex_density,
+        seed=arguments.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("directory")
+    parser.add_argument("--files", type=int, default=CorpusSpec().number_files)
+    add_arguments(parser)
+    arguments = parser.parse_args()
+    paths = generate(arguments.directory, spec_from_arguments(arguments, arguments.files))
+    print(f"{len(paths)} file(s) in {arguments.directory}")
+
+
+if __name__ == "__main__":
+    main()
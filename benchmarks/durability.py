@@ -0,0 +1,139 @@
+"""Throughput of each durability policy when writing many small files.
+
+A deterministic synthetic corpus (see `corpus.py`) is generated in memory;
+then, for each backend and durability policy, a fresh environment is timed
+on:
+
+- `store`: storing every file one at a time, then `flush`
+- `save`: saving a processed output for every file through `save_async`,
+  as the write stage of `Environment.mutate` does, then `flush`
+
+Reported for each: files per second, and the number of fsyncs issued.
+Results are printed and written as JSON to `--output`. Run it on the
+filesystem the environments live on, with `--directory`, since the cost of
+an fsync varies widely between filesystems and devices.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/durability.py [--files 2000]
+        [--policies none file group:16 group:64 group:256]
+        [--backends local pack] [--directory DIR] [--output durability.json]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import tempfile
+import time
+
+import common
+import corpus
+from magenta_rapids import backends, durability, metrics
+
+DEFAULT_POLICIES = ["none", "file", "group:16", "group:64", "group:256"]
+
+
+async def _save_all(backend, filenames, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _save(filename):
+        async with semaphore:
+            # Processed outputs about the size of a small stored file
+            await backend.save_async(io.BytesIO(filename.encode() * 40), filename)
+
+    await asyncio.gather(*map(_save, filenames))
+
+
+def _fsyncs() -> int:
+    return metrics.snapshot()["counters"].get("durability.fsyncs", 0)
+
+
+def _benchmark(name: str, policy: str, root: str, files, concurrency: int) -> dict:
+    backend = backends.BACKENDS[name](root, durability=policy)
+    os.makedirs(root)
+    backend.initialize()
+    backend.flush()
+    seconds = {}
+    fsyncs = {}
+    metrics.reset()
+    start = time.perf_counter()
+    filenames = [
+        os.path.basename(backend.store(io.BytesIO(data))) for data in files
+    ]
+    backend.flush()
+    seconds["store"] = time.perf_counter() - start
+    fsyncs["store"] = _fsyncs()
+    metrics.reset()
+    start = time.perf_counter()
+    asyncio.run(_save_all(backend, filenames, concurrency))
+    backend.flush()
+    seconds["save"] = time.perf_counter() - start
+    fsyncs["save"] = _fsyncs()
+    return {
+        "backend": name,
+        "durability": policy,
+        "files": len(filenames),
+        "seconds": seconds,
+        "files_per_s": common.files_per_s(len(filenames), seconds),
+        "fsyncs": fsyncs,
+    }
+
+
+def _policy(value: str) -> str:
+    try:
+        return str(durability.parse(value))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument(
+        "--policies", nargs="+", type=_policy, default=DEFAULT_POLICIES,
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=sorted(backends.BACKENDS),
+        default=sorted(backends.BACKENDS),
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8,
+        help="Number of saves in flight at once",
+    )
+    parser.add_argument(
+        "--directory", help="Directory in which to create the environments",
+    )
+    parser.add_argument("--output", default="durability-results.json")
+    corpus.add_arguments(parser)
+    parser.set_defaults(events=50)
+    arguments = parser.parse_args()
+    spec = corpus.spec_from_arguments(arguments, arguments.files)
+    files = [corpus.synthetic_midi(idx, spec) for idx in range(spec.number_files)]
+    print(f"{len(files)} files, {sum(map(len, files)) / 1e6:.1f} MB")
+    metrics.enable()
+    results = []
+    with tempfile.TemporaryDirectory(dir=arguments.directory) as tmpdir:
+        for name in arguments.backends:
+            for idx, policy in enumerate(arguments.policies):
+                row = _benchmark(
+                    name, policy, os.path.join(tmpdir, f"{name}-{idx}"), files,
+                    arguments.concurrency,
+                )
+                results.append(row)
+                print(
+                    f"{name:>6} {policy:>9}  "
+                    + "  ".join(
+                        f"{stage} {row['files_per_s'][stage]:8.0f} files/s "
+                        f"({row['fsyncs'][stage]:>6} fsyncs)"
+                        for stage in row["seconds"]
+                    )
+                )
+    common.write_report(
+        arguments.output, spec, concurrency=arguments.concurrency,
+        results=results,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Peak memory of `Environment.mutate` as the environment grows.
+
+Each environment size is mutated in a fresh interpreter and the peak resident
+set size of that interpreter is reported, so the numbers are not polluted by
+earlier runs. With the streaming pipeline the peak should stay roughly flat
+while the number of files grows. Files are generated as by `corpus.py`.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/pipeline_memory.py [--files SIZE ...] [--tracks N]
+        [--events N] [--meta-density P] [--sysex-density P] [--seed N]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+
+import corpus
+from magenta_rapids import backends, environment, mutators
+
+DEFAULT_SIZES = [25, 100, 400]
+
+
+def _measure(spec):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = environment.Environment(
+            backend=backends.LocalFileBackend(tmpdir),
+            mutator=mutators.SimpleMutator(),
+        )
+        env.initialize()
+        for index in range(spec.number_files):
+            env.store(io.BytesIO(corpus.synthetic_midi(index, spec)))
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        asyncio.run(env.mutate(1))
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"files": spec.number_files, "baseline_kb": baseline, "peak_kb": peak}
+
+
+def main(arguments):
+    for number_files in arguments.files:
+        spec = corpus.spec_from_arguments(arguments, number_files)
+        output = subprocess.run(
+            [
+                sys.executable, __file__, "--measure", "--files", str(number_files),
+                "--tracks", str(spec.number_tracks),
+                "--events", str(spec.events_per_track),
+                "--meta-density", repr(spec.meta_density),
+                "--sysex-density", repr(spec.sysex_density),
+                "--seed", str(spec.seed),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        print(
+            f"{result['files']:>8} files  "
+            f"peak RSS {result['peak_kb'] / 1024:8.1f} MiB  "
+            f"(+{(result['peak_kb'] - result['baseline_kb']) / 1024:.1f} MiB "
+            "during mutate)"
+        )
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--files", type=int, nargs="+", default=DEFAULT_SIZES,
+        help="Numbers of files to mutate, each in a fresh interpreter",
+    )
+    corpus.add_arguments(parser)
+    # About as many events per file as this benchmark always measured
+    parser.set_defaults(tracks=1, events=4000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    parsed = _parse_arguments()
+    if parsed.measure:
+        spec_measured = corpus.spec_from_arguments(parsed, parsed.files[0])
+        print(json.dumps(_measure(spec_measured)))
+    else:
+        main(parsed)
@@ -0,0 +1,123 @@
+"""Load test for the Magenta Rapids mutation server.
+
+Opens `--connections` connections to a running server and sends `--requests`
+mutation requests over them in total, keeping up to `--pipeline` requests in
+flight per connection. Reports requests per second and latency percentiles,
+measured from sending a request to receiving its full response.
+
+Start a server first, for example:
+
+    magenta_rapids serve -e ENVIRONMENT --port 8765 -j 0
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/server_load.py [--port 8765 | --unix_socket PATH]
+        [--requests 2000] [--connections 8] [--pipeline 4] [--steps 1]
+        [--file FILE.mid]
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import corpus
+
+
+async def _read_response(reader) -> bytes:
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    if status != 200:
+        raise RuntimeError(f"server answered {status}: {body!r}")
+    return body
+
+
+async def _connection(arguments, request, number_requests, latencies):
+    if arguments.unix_socket:
+        reader, writer = await asyncio.open_unix_connection(arguments.unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(arguments.host, arguments.port)
+    sent_at = asyncio.Queue(maxsize=arguments.pipeline)
+
+    async def _send():
+        for _ in range(number_requests):
+            await sent_at.put(time.perf_counter())
+            writer.write(request)
+            await writer.drain()
+
+    sender = asyncio.create_task(_send())
+    for _ in range(number_requests):
+        await _read_response(reader)
+        latencies.append(time.perf_counter() - await sent_at.get())
+    await sender
+    writer.close()
+    await writer.wait_closed()
+
+
+async def _run(arguments) -> dict:
+    if arguments.file:
+        with open(arguments.file, "rb") as file_obj:
+            body = file_obj.read()
+    else:
+        body = corpus.synthetic_midi(0, corpus.CorpusSpec(events_per_track=250))
+    request = (
+        f"POST /mutate?number_steps={arguments.steps} HTTP/1.1\r\n"
+        f"Host: localhost\r\nContent-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+    share, remainder = divmod(arguments.requests, arguments.connections)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _connection(
+                arguments, request, share + (idx < remainder), latencies
+            )
+            for idx in range(arguments.connections)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "seconds": elapsed,
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_p50_ms": cuts[49] * 1000,
+        "latency_p99_ms": cuts[98] * 1000,
+        "latency_max_ms": max(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix_socket")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--pipeline", type=int, default=4)
+    parser.add_argument("--steps", type=int, default=1)
+    parser.add_argument("--file", help="MIDI file to send, a synthetic one by default")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    arguments = parser.parse_args()
+    results = asyncio.run(_run(arguments))
+    if arguments.json:
+        print(json.dumps(results))
+    else:
+        print(
+            f"{results['requests']} requests in {results['seconds']:.2f}s: "
+            f"{results['requests_per_s']:.1f} req/s, "
+            f"p50 {results['latency_p50_ms']:.1f}ms, "
+            f"p99 {results['latency_p99_ms']:.1f}ms, "
+            f"max {results['latency_max_ms']:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
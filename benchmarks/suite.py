@@ -0,0 +1,286 @@
+"""Throughput and peak memory of each Magenta Rapids stage.
+
+A deterministic synthetic corpus (see `corpus.py`) is generated once, sized
+for the largest scale, and every scale uses a prefix of it. For each number
+of files the suite times:
+
+- `store`: `Environment.store_many` into a fresh environment
+- `retrieve_all`: reading every stored file through the backend
+- `mutate`: `Mutator.mutate` on every file held in memory, per number of steps
+- `environment_mutate`: `Environment.mutate(force=True)`, per number of steps
+
+Each measurement runs in a fresh interpreter so that its peak resident set
+size is its own. With `--backend memory` environments are kept in an
+`InMemoryFileBackend`, handed from one measurement to the next as a snapshot
+loaded before the clock starts, which leaves the CPU cost of each stage
+without that of the disk. Results are printed and written as JSON to `--output`;
+passing a previous results file as `--baseline` reports the change in
+throughput of every matching measurement, and exits with status 1 if any
+slowed down by more than `--tolerance`. A baseline recorded with another
+mutator, backend or corpus is refused rather than compared.
+
+Usage, from the repository root with the package importable:
+
+    python benchmarks/suite.py [--files 10 100 1000] [--steps 1 10 100]
+        [--backend local|memory] [--output results.json]
+        [--baseline previous.json]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import common
+import corpus
+from magenta_rapids import backends, environment, mutators
+
+MUTATORS = {
+    "simple": mutators.SimpleMutator,
+    "vectorized": mutators.VectorizedMutator,
+    "memoized": mutators.MemoizedMutator,
+}
+STEP_STAGES = ("mutate", "environment_mutate")
+BACKENDS = ("local", "memory")
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def _time_stage(
+    stage, paths, environment_path, number_steps, mutator_name, backend_name
+):
+    """Run one stage and return its duration, in seconds. Setup which is
+    not part of the stage happens before the clock starts.
+    """
+    if backend_name == "memory":
+        backend = backends.InMemoryFileBackend()
+        if stage != "store":
+            backend.load(environment_path)
+    else:
+        backend = backends.LocalFileBackend(environment_path)
+    env = environment.Environment(
+        backend=backend, mutator=MUTATORS[mutator_name]()
+    )
+    if stage == "store":
+        if backend_name != "memory":
+            os.makedirs(environment_path)
+        env.initialize()
+        start = time.perf_counter()
+        env.store_many(paths)
+        seconds = time.perf_counter() - start
+        if backend_name == "memory":
+            backend.snapshot(environment_path)
+        return seconds
+    if stage == "retrieve_all":
+        start = time.perf_counter()
+        asyncio.run(common.retrieve_all(backend))
+        return time.perf_counter() - start
+    if stage == "mutate":
+        contents = []
+        for path in paths:
+            with open(path, "rb") as file_obj:
+                contents.append(file_obj.read())
+        mutator = MUTATORS[mutator_name]()
+        start = time.perf_counter()
+        for data in contents:
+            mutator.mutate(io.BytesIO(data), number_steps).read()
+        return time.perf_counter() - start
+    if stage == "environment_mutate":
+        start = time.perf_counter()
+        asyncio.run(env.mutate(number_steps, force=True))
+        return time.perf_counter() - start
+    raise ValueError(f"unknown stage {stage}")
+
+
+def _measure(arguments):
+    paths = sorted(
+        os.path.join(arguments.corpus, filename)
+        for filename in os.listdir(arguments.corpus)
+    )[: arguments.files]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    seconds = _time_stage(
+        arguments.measure, paths, arguments.environment, arguments.steps,
+        arguments.mutator, arguments.backend,
+    )
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {"seconds": seconds, "baseline_rss_kb": baseline, "peak_rss_kb": peak}
+        )
+    )
+
+
+# pylint: disable=too-many-arguments
+def _run_stage(
+    stage, spec, corpus_path, environment_path, number_steps, mutator, backend
+):
+    output = subprocess.run(
+        [
+            sys.executable, __file__, "--measure", stage,
+            "--corpus", corpus_path, "--environment", environment_path,
+            "--files", str(spec.number_files), "--steps", str(number_steps),
+            "--mutator", mutator, "--backend", backend,
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+        text=True,
+    ).stdout
+    measured = json.loads(output)
+    seconds = max(measured["seconds"], 1e-9)
+    # Every step of a mutation processes every event again
+    passes = number_steps if stage in STEP_STAGES and number_steps else 1
+    total_bytes = sum(
+        os.path.getsize(os.path.join(corpus_path, filename))
+        for filename in sorted(os.listdir(corpus_path))[: spec.number_files]
+    )
+    return {
+        "stage": stage,
+        "files": spec.number_files,
+        "steps": number_steps if stage in STEP_STAGES else None,
+        "seconds": measured["seconds"],
+        "files_per_s": spec.number_files / seconds,
+        "events_per_s": spec.number_files * spec.events_per_file * passes / seconds,
+        "mb_per_s": total_bytes / 1e6 / seconds,
+        "baseline_rss_kb": measured["baseline_rss_kb"],
+        "peak_rss_kb": measured["peak_rss_kb"],
+    }
+
+
+def _parameters(report) -> dict:
+    """What a run measured besides its numbers of files and steps."""
+    corpus_spec = dict(report["corpus"])
+    # Each row is only compared with one of as many files
+    del corpus_spec["number_files"]
+    return {
+        "mutator": report["mutator"],
+        "backend": report["backend"],
+        "corpus": corpus_spec,
+    }
+
+
+def _compare(report, baseline_path, tolerance) -> bool:
+    """Print the change in throughput against a previous run, and return
+    whether every measurement is within `tolerance` of it. Exits if the
+    previous run measured a different mutator, backend or corpus.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as file_obj:
+        baseline = json.load(file_obj)
+    expected, found = _parameters(report), _parameters(baseline)
+    if expected != found:
+        differences = ", ".join(
+            f"{name} {found[name]} instead of {value}"
+            for name, value in expected.items()
+            if value != found[name]
+        )
+        sys.exit(
+            f"Cannot compare with {baseline_path}, which measured {differences}"
+        )
+    previous = {
+        (row["stage"], row["files"], row["steps"]): row
+        for row in baseline["results"]
+    }
+    within_tolerance = True
+    print(f"\nChange in files/s against {baseline_path}:")
+    for row in report["results"]:
+        before = previous.get((row["stage"], row["files"], row["steps"]))
+        if before is None:
+            continue
+        change = row["files_per_s"] / before["files_per_s"] - 1
+        regressed = change < -tolerance
+        within_tolerance = within_tolerance and not regressed
+        print(
+            f"{row['stage']:>20} {row['files']:>7} files "
+            f"{row['steps'] or '':>5} steps  {change:+7.1%}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return within_tolerance
+
+
+# pylint: disable=too-many-locals
+def main(arguments):
+    largest = max(arguments.files)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = arguments.workdir or tmpdir
+        largest_spec = corpus.spec_from_arguments(arguments, largest)
+        # Corpora with other parameters may share the working directory
+        corpus_path = os.path.join(
+            workdir,
+            "corpus-" + "-".join(str(value) for value in largest_spec[1:]),
+        )
+        corpus.generate(corpus_path, largest_spec)
+        results = []
+        for number_files in sorted(arguments.files):
+            spec = corpus.spec_from_arguments(arguments, number_files)
+            environment_path = os.path.join(
+                tmpdir, f"environment-{number_files}"
+            )
+            runs = [("store", 0), ("retrieve_all", 0)] + [
+                (stage, number_steps)
+                for stage in STEP_STAGES
+                for number_steps in arguments.steps
+            ]
+            for stage, number_steps in runs:
+                row = _run_stage(
+                    stage, spec, corpus_path, environment_path, number_steps,
+                    arguments.mutator, arguments.backend,
+                )
+                results.append(row)
+                print(
+                    f"{stage:>20} {number_files:>7} files "
+                    f"{row['steps'] or '':>5} steps  "
+                    f"{row['seconds']:9.3f} s  {row['files_per_s']:10.1f} files/s  "
+                    f"{row['events_per_s']:12.0f} events/s  "
+                    f"{row['mb_per_s']:8.2f} MB/s  "
+                    f"peak {row['peak_rss_kb'] / 1024:7.1f} MiB"
+                )
+    report = common.write_report(
+        arguments.output, largest_spec, mutator=arguments.mutator,
+        backend=arguments.backend, results=results,
+    )
+    if arguments.baseline and not _compare(
+        report, arguments.baseline, arguments.tolerance
+    ):
+        sys.exit(1)
+
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    parser.add_argument("--environment", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--files", type=int, nargs="+", default=[10, 100, 1000],
+        help="Numbers of files to benchmark, up to 100000",
+    )
+    parser.add_argument(
+        "--steps", type=int, nargs="+", default=[1, 10, 100],
+        help="Numbers of mutation steps to benchmark, up to 1000",
+    )
+    parser.add_argument("--mutator", choices=sorted(MUTATORS), default="simple")
+    parser.add_argument("--backend", choices=BACKENDS, default="local")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Previous results to compare with")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2,
+        help="Largest acceptable relative drop in files/s against --baseline",
+    )
+    parser.add_argument(
+        "--workdir", help="Directory in which to keep the generated corpus",
+    )
+    corpus.add_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    parsed = _parse_arguments()
+    if parsed.measure:
+        parsed.files = parsed.files[0]
+        parsed.steps = parsed.steps[0]
+        _measure(parsed)
+    else:
+        main(parsed)
@@ -1,15 +1,39 @@
 """Backends for Magenta Rapids. A backend is responsible for storing files
 and retrieving them when necessary. Backends must implement the `store` and
 `retrieve_all` methods, as well as several other helpers which abstract
-away the underlying storage mechanism.
+away the underlying storage mechanism. The asynchronous methods, `retrieve_all`
+and `save_async`, must not block the event loop.
 """
+# pylint: disable=too-many-lines
 
 import abc
+import collections
+import concurrent.futures
+import contextlib
 import hashlib
+import io
+import itertools
+import json
 import os
+import re
+import threading
 import typing as t
+import uuid
+import zipfile
+from magenta_rapids import catalog, file_utilities, metrics, packfile, sidecar, smf
+from magenta_rapids import compression as compression_module
+from magenta_rapids import durability as durability_module
+from magenta_rapids.lazy import lazy_import
 
+asyncio = lazy_import("asyncio")
+s3 = lazy_import("magenta_rapids.s3")
 
+_SHA1_PATTERN = re.compile(r"[0-9a-f]{40}")
+# Returned by the `_read` methods for files `retrieve_all` does not yield
+_SKIPPED = object()
+
+
+# pylint: disable=too-many-public-methods
 class AbstractFileBackend(abc.ABC):
     @abc.abstractmethod
     def __init__(self, *args, **kwargs):
@@ -39,16 +63,171 @@ class AbstractFileBackend(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    async def retrieve_all(self):
+    async def retrieve_all(
+        self,
+        exclude: t.Optional[t.Callable[[str], bool]] = None,
+        filenames: t.Optional[t.Iterable[str]] = None,
+        needs_contents: t.Optional[t.Callable[[str], bool]] = None,
+    ):
+        """Yield `(file, filename)` for every stored file, or only for
+        `filenames` when given, skipping those for which `exclude` is true.
+        `needs_contents` is called after `exclude`; files for which it is
+        false may be yielded as `None`, saving the backend from reading
+        them.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save(self, file: t.BinaryIO, filename: str):
+        raise NotImplementedError
+
+    async def save_async(self, file: t.BinaryIO, filename: str):
+        """Save without blocking the event loop. Backends with their own
+        bounded I/O pool or natively asynchronous storage should override
+        this.
+        """
+        await asyncio.to_thread(self.save, file, filename)
+
+    def contains(self, digest: str, extension: str = "mid") -> bool:
+        """Whether a file with SHA1 `digest` is already stored."""
+        raise NotImplementedError
+
+    def retrieve_processed(self, filename: str) -> bytes:
+        """The processed output of the stored file `filename`."""
+        raise NotImplementedError
+
+    def source_digest(self, filename: str) -> str:
+        """SHA1 of the stored file `filename`, used to decide whether its
+        processed output is up to date.
+        """
+        raise NotImplementedError
+
+    # pylint: disable=unused-argument
+    def is_up_to_date(self, filename: str, key: dict) -> bool:
+        """Whether the processed output for `filename` was produced with
+        `key`. Backends without a record of their outputs are never up to
+        date.
+        """
+        return False
+
+    def mark_up_to_date(self, filename: str, key: dict):
+        """Record that the processed output for `filename` was produced
+        with `key`.
+        """
+
+    def flush(self):
+        """Persist any records kept in memory by the backend."""
+
+    def set_durability(self, durability: str):
+        """Choose when writes are flushed to stable storage, see
+        `durability`. Backends whose writes are durable once they return, or
+        which never reach stable storage, ignore it.
+        """
+
+    # pylint: disable=unused-argument
+    def sidecar_source(self, filename: str) -> t.Optional[str]:
+        """Local path of the stored file `filename` if it has an up-to-date
+        sidecar, which mutators can load instead of parsing the file.
+        Backends without sidecars return `None`.
+        """
+        return None
+
+    def list_files(
+        self, processed: t.Optional[bool] = None, limit: t.Optional[int] = None
+    ) -> t.List[dict]:
+        """Describe the stored files, optionally only those which have (or
+        have not) been processed.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Summarize the stored files."""
         raise NotImplementedError
 
+    def reindex(self):
+        """Rebuild any index the backend keeps of its files."""
+
+    def compact(self) -> t.Optional[dict]:
+        """Reclaim the space taken by superseded copies of files. Backends
+        which never keep any have nothing to do.
+        """
+
+    def fsck(self) -> t.List[str]:
+        """Check the stored files, returning a description of every problem
+        found.
+        """
+        raise NotImplementedError
+
+
+def _catalog_contents(
+    file_catalog: catalog.Catalog, filename: str, digest: str, data: bytes
+) -> t.Optional[smf.SMF]:
+    """Catalog a stored file from its contents, returning them decoded
+    unless the `smf` codec rejects them.
+    """
+    try:
+        with metrics.timer("backend.decode"):
+            decoded = smf.decode(data)
+    except smf.SMFError:
+        decoded = None
+        facts = catalog.parse_midi_facts(io.BytesIO(data))
+    else:
+        facts = catalog.decoded_midi_facts(decoded)
+    with metrics.timer("backend.catalog_add"):
+        file_catalog.add(filename, digest, len(data), facts)
+    return decoded
+
+
+def _catalog_differences(
+    file_catalog: catalog.Catalog, stored: t.Set[str]
+) -> t.List[str]:
+    """Differences between `file_catalog` and the `stored` filenames."""
+    catalogued = set(file_catalog.filenames())
+    return [
+        f"{filename} is catalogued but not stored"
+        for filename in sorted(catalogued - stored)
+    ] + [
+        f"{filename} is stored but not catalogued"
+        for filename in sorted(stored - catalogued)
+    ]
+
+
+# pylint: disable=abstract-method
+# pylint: disable=too-many-instance-attributes
+class _DirectoryBackend(AbstractFileBackend):
+    """Parts shared by the backends keeping an environment in a local
+    directory: its configuration file, catalog, manifest of processed
+    outputs and I/O pool.
+    """
 
-class LocalFileBackend(AbstractFileBackend):
     PROCESSED_DIRECTORY_PREFIX = "processed"
     UNPROCESSED_DIRECTORY_PREFIX = "unprocessed"
+    CATALOG_FILENAME = "catalog.sqlite3"
+    CONFIG_FILENAME = "environment.json"
+    MANIFEST_FILENAME = "manifest.json"
+    MANIFEST_VERSION = 1
+    TEMPORARY_FILE_PREFIX = ".tmp-"
 
-    def __init__(self, local_root_path: str):
+    def __init__(
+        self,
+        local_root_path: str,
+        io_concurrency: int = 8,
+        prefetch: int = 16,
+        durability: str = durability_module.NONE,
+    ):
+        """`io_concurrency` bounds the number of reads and writes in flight
+        at once in the asynchronous methods, and `prefetch` the number of
+        files `retrieve_all` reads ahead of its consumer. `durability` is
+        the durability policy, see `set_durability`.
+        """
         self._root_path = local_root_path
+        self._io_concurrency = io_concurrency
+        self._prefetch = max(prefetch, 1)
+        self._syncer = durability_module.Syncer(durability_module.parse(durability))
+        self._io_executor = None
+        self._catalog = None
+        self._config = None
+        self._manifest = None
 
     @property
     def path(self):
@@ -62,47 +241,1269 @@ class LocalFileBackend(AbstractFileBackend):
     def unprocessed_path(self):
         return os.path.join(self._root_path, self.UNPROCESSED_DIRECTORY_PREFIX)
 
+    @property
+    def io_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._io_executor is None:
+            self._io_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._io_concurrency,
+                thread_name_prefix="magenta-rapids-io",
+            )
+        return self._io_executor
+
+    @property
+    def catalog(self) -> catalog.Catalog:
+        """Catalog of the environment's files. Environments created before
+        the catalog existed are indexed the first time it is opened.
+        """
+        if self._catalog is None:
+            catalog_path = os.path.join(self._root_path, self.CATALOG_FILENAME)
+            is_new = not os.path.exists(catalog_path)
+            self._catalog = catalog.Catalog(catalog_path)
+            if is_new:
+                self.reindex()
+        return self._catalog
+
+    def _catalog_data(
+        self, filename: str, digest: str, data: bytes
+    ) -> t.Optional[smf.SMF]:
+        return _catalog_contents(self.catalog, filename, digest, data)
+
+    def _catalog_problems(self, stored: t.Set[str]) -> t.List[str]:
+        return _catalog_differences(self.catalog, stored)
+
+    def list_files(
+        self, processed: t.Optional[bool] = None, limit: t.Optional[int] = None
+    ) -> t.List[dict]:
+        return self.catalog.query(processed=processed, limit=limit)
+
+    def stats(self) -> dict:
+        return self.catalog.stats()
+
+    def _make_directories(self):
+        for directory in (self.processed_path, self.unprocessed_path):
+            if not os.path.isdir(directory):
+                os.mkdir(directory)
+
+    @property
+    def config_path(self):
+        return os.path.join(self._root_path, self.CONFIG_FILENAME)
+
+    def _load_config(self) -> dict:
+        if self._config is None:
+            try:
+                with open(self.config_path, "r", encoding="utf-8") as file_obj:
+                    self._config = json.load(file_obj)
+            except FileNotFoundError:
+                # Environments created before the configuration file existed
+                self._config = {}
+        return self._config
+
+    def _write_config(self, **changes):
+        config = {**self._load_config(), **changes}
+        self._write_atomically(self.config_path, json.dumps(config).encode())
+        self._config = config
+
+    @property
+    def durability(self) -> durability_module.Durability:
+        return self._syncer.durability
+
+    def set_durability(self, durability: str):
+        """Writes go to a temporary file renamed into place whatever the
+        policy, which only decides when they are flushed to stable storage.
+        Files of an incomplete group are flushed by `flush`.
+        """
+        self._syncer.flush()
+        self._syncer = durability_module.Syncer(durability_module.parse(durability))
+
+    @property
+    def compression(self) -> t.Optional[compression_module.Compression]:
+        """Compression of the stored files and processed outputs, recorded
+        when the environment was initialized.
+        """
+        return compression_module.parse(self._load_config().get("compression"))
+
+    @staticmethod
+    def _compression_setting(compression: t.Optional[str]) -> str:
+        """Validated setting to record for the compression chosen at
+        initialization.
+        """
+        parsed = compression_module.parse(compression)
+        return compression_module.NONE if parsed is None else str(parsed)
+
+    def _compress(self, data: bytes) -> bytes:
+        compression = self.compression
+        return data if compression is None else compression.compress(data)
+
+    def _decompress(self, data: bytes) -> bytes:
+        compression = self.compression
+        return data if compression is None else compression.decompress(data)
+
+    def _temporary_path(self, directory: str) -> str:
+        return os.path.join(
+            directory, f"{self.TEMPORARY_FILE_PREFIX}{uuid.uuid4().hex}"
+        )
+
+    def _write_atomically(self, path: str, data: bytes):
+        """Write `data` to a temporary file renamed over `path`, so that a
+        crash leaves either its previous contents or `data`.
+        """
+        temporary_path = self._temporary_path(os.path.dirname(path))
+        try:
+            with open(temporary_path, "xb") as file_obj:
+                file_obj.write(data)
+                self._syncer.before_rename(file_obj)
+            os.replace(temporary_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temporary_path)
+            raise
+        self._syncer.renamed(path)
+
+    async def save_async(self, file: t.BinaryIO, filename: str):
+        await asyncio.get_running_loop().run_in_executor(
+            self.io_executor, self.save, file, filename
+        )
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self._root_path, self.MANIFEST_FILENAME)
+
+    def _load_manifest(self) -> dict:
+        if self._manifest is None:
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as file_obj:
+                    manifest = json.load(file_obj)
+            except FileNotFoundError:
+                manifest = {}
+            if manifest.get("version") != self.MANIFEST_VERSION:
+                manifest = {"version": self.MANIFEST_VERSION, "outputs": {}}
+            self._manifest = manifest
+        return self._manifest["outputs"]
+
+    def mark_up_to_date(self, filename: str, key: dict):
+        self._load_manifest()[filename] = key
+
+    def flush(self):
+        """Outputs are flushed to stable storage, as the durability policy
+        requires, before the manifest records them as up to date.
+        """
+        self._syncer.flush()
+        if self._manifest is None:
+            return
+        self._write_atomically(
+            self.manifest_path, json.dumps(self._manifest).encode()
+        )
+        self._syncer.flush()
+
+
+# pylint: disable=too-many-public-methods
+class LocalFileBackend(_DirectoryBackend):
+    SHARD_WIDTH = 2
+    STORE_CHUNK_SIZE = 1 << 20
+
+    def _catalog_file(self, path: str, filename: str, digest: str):
+        """Catalog the stored file at `path` and write its sidecar, decoding
+        it only once for both.
+        """
+        decoded = self._catalog_data(filename, digest, self._read_path(path))
+        if decoded is not None:
+            self._write_sidecar(decoded, path)
+
+    @staticmethod
+    def _write_sidecar(decoded: smf.SMF, path: str) -> bool:
+        """Write the sidecar of the stored file at `path`, and return whether
+        it has one. Files whose columns a sidecar cannot hold are mutated
+        from their contents instead.
+        """
+        try:
+            with metrics.timer("sidecar.write"):
+                sidecar.write(decoded, path)
+        except sidecar.SidecarError:
+            metrics.count("sidecar.skipped")
+            return False
+        return True
+
+    def sidecar_source(self, filename: str) -> t.Optional[str]:
+        """Sidecars which are missing, stale or from another format version
+        are rebuilt here. Files the `smf` codec rejects have none.
+        """
+        path = self._sharded_path(self.unprocessed_path, filename)
+        with metrics.timer("sidecar.check"):
+            if sidecar.is_fresh(path):
+                return path
+        metrics.count("sidecar.rebuilds")
+        try:
+            decoded = smf.decode(self._read_path(path))
+        except smf.SMFError:
+            return None
+        return path if self._write_sidecar(decoded, path) else None
+
+    def reindex(self):
+        """Rebuild the catalog from the files on disk."""
+        self.catalog.clear()
+        for root, _, files in metrics.timed_iter(
+            "backend.walk", os.walk(self.unprocessed_path)
+        ):
+            for filename in files:
+                if filename.startswith(
+                    self.TEMPORARY_FILE_PREFIX
+                ) or filename.endswith(sidecar.SUFFIX):
+                    continue
+                self._catalog_file(
+                    os.path.join(root, filename),
+                    filename,
+                    self.source_digest(filename, os.path.join(root, filename)),
+                )
+                if os.path.isfile(self._sharded_path(self.processed_path, filename)):
+                    self.catalog.mark_processed(filename)
+
+    def fsck(self) -> t.List[str]:
+        """Check that every stored file is at its place in the layout and
+        matches the hash in its name, the catalog against the stored files,
+        and that no write was left unfinished.
+        """
+        problems = [
+            f"{os.path.join(root, filename)} was left by an interrupted write"
+            for directory in (self.unprocessed_path, self.processed_path)
+            for root, _, files in os.walk(directory)
+            for filename in files
+            if filename.startswith(self.TEMPORARY_FILE_PREFIX)
+        ]
+        stored = set()
+        for root, _, files in os.walk(self.unprocessed_path):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if filename.startswith(
+                    self.TEMPORARY_FILE_PREFIX
+                ) or filename.endswith(sidecar.SUFFIX):
+                    continue
+                stored.add(filename)
+                if not self.is_stored_file(path):
+                    problems.append(f"{path} is not at its place in the layout")
+                stem = filename.split(".", 1)[0]
+                if not _SHA1_PATTERN.fullmatch(stem):
+                    continue
+                try:
+                    digest = hashlib.sha1(self._read_path(path)).hexdigest()
+                except ValueError as error:
+                    problems.append(f"{path}: {error}")
+                    continue
+                if digest != stem:
+                    problems.append(f"{path} does not match the hash in its name")
+        return problems + self._catalog_problems(stored)
+
+    def is_stored_file(self, path: str) -> bool:
+        """Whether `path` is a stored file, rather than a temporary file or
+        sidecar, at its place in the layout of the unprocessed directory.
+        """
+        filename = os.path.basename(path)
+        return (
+            not filename.startswith(self.TEMPORARY_FILE_PREFIX)
+            and not filename.endswith(sidecar.SUFFIX)
+            and path == self._sharded_path(self.unprocessed_path, filename)
+        )
+
+    def index_file(self, path: str) -> str:
+        """Catalog a file placed in the unprocessed directory without going
+        through `store`, unless it already is, and return its filename.
+        """
+        filename = os.path.basename(path)
+        if not self.catalog.contains(filename):
+            self._catalog_file(path, filename, self.source_digest(filename, path))
+        return filename
+
+    @property
+    def shard_depth(self) -> int:
+        """Number of directory levels, named after successive pairs of hex
+        digits of the file's hash, between the (un)processed directories and
+        each file. 0 is a flat layout.
+        """
+        return self._load_config().get("shard_depth", 0)
+
+    def _sharded_path(self, directory: str, filename: str, shard_depth=None):
+        if shard_depth is None:
+            shard_depth = self.shard_depth
+        if not shard_depth:
+            return os.path.join(directory, filename)
+        stem = filename.split(".", 1)[0]
+        if not _SHA1_PATTERN.fullmatch(stem):
+            stem = hashlib.sha1(filename.encode()).hexdigest()
+        shards = [
+            stem[level * self.SHARD_WIDTH:(level + 1) * self.SHARD_WIDTH]
+            for level in range(shard_depth)
+        ]
+        return os.path.join(directory, *shards, filename)
+
+    def _read_path(self, path: str) -> bytes:
+        """Uncompressed contents of the stored file or output at `path`."""
+        with open(path, "rb") as file_obj:
+            return self._decompress(file_obj.read())
+
     def store(self, file_object: t.BinaryIO, extension="mid"):
+        with metrics.timer("backend.store"):
+            return self._store(file_object, extension)
+
+    def _store(self, file_object: t.BinaryIO, extension):
+        file_object.seek(os.SEEK_SET)
+        sha = hashlib.sha1()
+        buffer = bytearray(self.STORE_CHUNK_SIZE)
+        view = memoryview(buffer)
+        compression = self.compression
+        compressor = None if compression is None else compression.compressor()
+        # Hash, compress and copy in the same pass, into a temporary file
+        # that is only renamed into place once its hash, and so its name,
+        # is known. The hash is of the uncompressed contents, which are also
+        # kept to catalog the file without reading it back.
+        contents = bytearray()
+        temporary_path = self._temporary_path(self.unprocessed_path)
+        with open(temporary_path, "xb") as temporary_file:
+            try:
+                while size := file_object.readinto(buffer):
+                    metrics.count("backend.bytes_stored", size)
+                    sha.update(view[:size])
+                    contents += view[:size]
+                    if compressor is None:
+                        temporary_file.write(view[:size])
+                    else:
+                        temporary_file.write(compressor.compress(view[:size]))
+                if compressor is not None:
+                    temporary_file.write(compressor.flush())
+                self._syncer.before_rename(temporary_file)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
         file_object.seek(os.SEEK_SET)
-        sha_to_store = hashlib.sha1(file_object.read()).hexdigest()
-        full_target_path = os.path.join(
-            self._root_path,
-            self.UNPROCESSED_DIRECTORY_PREFIX,
-            f"{sha_to_store}.{extension}",
+        full_target_path = self._sharded_path(
+            self.unprocessed_path, f"{sha.hexdigest()}.{extension}"
         )
+        # Files are named after their content, so a matching name is a
+        # matching hash
         if os.path.exists(full_target_path):
-            with open(full_target_path, "rb") as existing_file_object:
-                existing_sha = hashlib.sha1(existing_file_object.read()).hexdigest()
-            if sha_to_store == existing_sha:
-                raise ValueError(
-                    f"Cannot store file at {full_target_path}, a file with that "
-                    "hash already exists in this environment"
+            os.unlink(temporary_path)
+            raise ValueError(
+                f"Cannot store file at {full_target_path}, a file with that "
+                "hash already exists in this environment"
+            )
+        # Catalogued, and its sidecar written, before it is renamed into
+        # place, so that a file which fails either is never left stored. The
+        # sidecar is written for the temporary file, whose size and
+        # modification time the stored file keeps.
+        try:
+            decoded = self._catalog_data(
+                os.path.basename(full_target_path), sha.hexdigest(),
+                contents,
+            )
+            has_sidecar = decoded is not None and self._write_sidecar(
+                decoded, temporary_path
+            )
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        os.makedirs(os.path.dirname(full_target_path), exist_ok=True)
+        os.replace(temporary_path, full_target_path)
+        self._syncer.renamed(full_target_path)
+        if has_sidecar:
+            os.replace(
+                sidecar.path_for(temporary_path),
+                sidecar.path_for(full_target_path),
+            )
+        return full_target_path
+
+    def contains(self, digest: str, extension: str = "mid") -> bool:
+        return os.path.exists(
+            self._sharded_path(self.unprocessed_path, f"{digest}.{extension}")
+        )
+
+    def initialize(self, shard_depth=0, compression: t.Optional[str] = None):
+        """`compression`, `codec[:level]`, compresses every stored file and
+        processed output, see `compression`.
+        """
+        self._make_directories()
+        self._write_config(
+            shard_depth=shard_depth,
+            compression=self._compression_setting(compression),
+        )
+        self.reindex()
+
+    def migrate(self, shard_depth: int):
+        """Move every stored and processed file to the layout with the given
+        shard depth, and record it. Interrupted migrations can be resumed by
+        running them again.
+        """
+        for directory in (self.unprocessed_path, self.processed_path):
+            for root, _, files in os.walk(directory, topdown=False):
+                for filename in files:
+                    if filename.startswith(self.TEMPORARY_FILE_PREFIX):
+                        continue
+                    target_path = self._sharded_path(
+                        directory, filename, shard_depth
+                    )
+                    current_path = os.path.join(root, filename)
+                    if current_path != target_path:
+                        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                        os.replace(current_path, target_path)
+                if root != directory and not os.listdir(root):
+                    os.rmdir(root)
+        self._write_config(shard_depth=shard_depth)
+
+    def _read(self, filename: str, exclude, needs_contents):
+        if exclude is not None and exclude(filename):
+            return _SKIPPED
+        path = self._sharded_path(self.unprocessed_path, filename)
+        if needs_contents is not None and not needs_contents(filename):
+            # Still raises for files which are not stored, like `open`
+            os.stat(path)
+            return None
+        with metrics.timer("backend.read"), open(path, "rb") as file_obj:
+            data = file_obj.read()
+        metrics.count("backend.bytes_read", len(data))
+        return io.BytesIO(self._decompress(data))
+
+    async def retrieve_all(
+        self,
+        exclude: t.Optional[t.Callable[[str], bool]] = None,
+        filenames: t.Optional[t.Iterable[str]] = None,
+        needs_contents: t.Optional[t.Callable[[str], bool]] = None,
+    ) -> t.AsyncGenerator[t.BinaryIO, None]:
+        """Yield the contents of every stored file, read in the I/O pool up
+        to `prefetch` files ahead of the consumer. `exclude` and
+        `needs_contents` are called in the I/O pool too.
+        """
+        loop = asyncio.get_running_loop()
+        pending = collections.deque()
+        page = [] if filenames is None else list(filenames)[::-1]
+        last_filename = ""
+        while True:
+            while len(pending) < self._prefetch:
+                if not page:
+                    if filenames is not None:
+                        break
+                    with metrics.timer("backend.list_page"):
+                        page = await loop.run_in_executor(
+                            self.io_executor, self.catalog.filenames_page,
+                            last_filename,
+                        )
+                    if not page:
+                        break
+                    last_filename = page[-1]
+                    page.reverse()
+                filename = page.pop()
+                pending.append(
+                    (
+                        filename,
+                        loop.run_in_executor(
+                            self.io_executor, self._read, filename, exclude,
+                            needs_contents,
+                        ),
+                    )
                 )
+            if not pending:
+                return
+            filename, future = pending.popleft()
+            file_obj = await future
+            if file_obj is not _SKIPPED:
+                yield (file_obj, filename)
+
+    def save(self, file: t.BinaryIO, filename: str):
+        with metrics.timer("backend.save"):
+            self._save(file, filename)
+
+    def _save(self, file: t.BinaryIO, filename: str):
+        file.seek(os.SEEK_SET)
+        full_target_path = self._sharded_path(self.processed_path, filename)
+        os.makedirs(os.path.dirname(full_target_path), exist_ok=True)
+        # Never leave a truncated output in place of the previous one
+        self._write_atomically(full_target_path, self._compress(file.read()))
+        file.seek(os.SEEK_SET)
+        self.catalog.mark_processed(filename)
+
+    def retrieve_processed(self, filename: str) -> bytes:
+        return self._read_path(self._sharded_path(self.processed_path, filename))
+
+    def source_digest(self, filename: str, path: t.Optional[str] = None) -> str:
+        stem = filename.split(".", 1)[0]
+        if _SHA1_PATTERN.fullmatch(stem):
+            return stem
+        # Not stored through `store`, so the name says nothing about content
+        if path is None:
+            path = self._sharded_path(self.unprocessed_path, filename)
+        return hashlib.sha1(self._read_path(path)).hexdigest()
+
+    def is_up_to_date(self, filename: str, key: dict) -> bool:
+        return self._load_manifest().get(filename) == key and os.path.isfile(
+            self._sharded_path(self.processed_path, filename)
+        )
+
+
+class PackFileBackend(_DirectoryBackend):
+    """Keeps stored files and processed outputs in append-only packs, see
+    `packfile`, instead of one file each, which suits environments of many
+    small files. Environments are catalogued like `LocalFileBackend` ones,
+    but have no sidecars, since files are read sequentially from the packs
+    rather than memory-mapped.
+    """
+
+    def __init__(
+        self,
+        local_root_path: str,
+        io_concurrency: int = 8,
+        prefetch: int = 16,
+        pack_bytes: int = packfile.DEFAULT_PACK_BYTES,
+        durability: str = durability_module.NONE,
+    ):
+        super().__init__(local_root_path, io_concurrency, prefetch, durability)
+        self._stored = packfile.PackSet(self.unprocessed_path, pack_bytes)
+        self._processed = packfile.PackSet(self.processed_path, pack_bytes)
+
+    def initialize(self, shard_depth=0, compression: t.Optional[str] = None):
+        """`compression`, `codec[:level]`, compresses every record, see
+        `compression`.
+        """
+        if shard_depth:
+            raise ValueError("Pack environments have no sharded layout")
+        self._make_directories()
+        self._write_config(
+            backend=PACK_BACKEND,
+            compression=self._compression_setting(compression),
+        )
+        self.reindex()
+
+    def migrate(self, shard_depth: int):
+        raise ValueError("Pack environments have no sharded layout to migrate")
+
+    def _appended(self, packs: packfile.PackSet, location: packfile.Location):
+        self._syncer.appended(packs.pack_path(location.pack), packs.index_path)
+
+    def store(self, file_object: t.BinaryIO, extension="mid"):
+        with metrics.timer("backend.store"):
+            return self._store(file_object, extension)
+
+    def _store(self, file_object: t.BinaryIO, extension):
         file_object.seek(os.SEEK_SET)
-        with open(full_target_path, "wb") as file_obj:
-            file_obj.write(file_object.read())
+        data = file_object.read()
         file_object.seek(os.SEEK_SET)
-        return full_target_path
+        metrics.count("backend.bytes_stored", len(data))
+        digest = hashlib.sha1(data).hexdigest()
+        filename = f"{digest}.{extension}"
+        try:
+            location = self._stored.append(
+                filename, self._compress(data), replace=False
+            )
+        except FileExistsError as error:
+            raise ValueError(
+                f"Cannot store file {filename}, a file with that hash already "
+                "exists in this environment"
+            ) from error
+        self._appended(self._stored, location)
+        self._catalog_data(filename, digest, data)
+        return filename
 
-    def initialize(self):
-        if not os.path.isdir(
-            os.path.join(self._root_path, self.PROCESSED_DIRECTORY_PREFIX)
-        ):
-            os.mkdir(os.path.join(self._root_path, self.PROCESSED_DIRECTORY_PREFIX))
-        if not os.path.isdir(
-            os.path.join(self._root_path, self.UNPROCESSED_DIRECTORY_PREFIX)
+    def contains(self, digest: str, extension: str = "mid") -> bool:
+        return f"{digest}.{extension}" in self._stored
+
+    def source_digest(self, filename: str) -> str:
+        return filename.split(".", 1)[0]
+
+    def _next_batch(
+        self, records: t.Iterator[t.Tuple[str, t.Optional[bytes]]], needs_contents
+    ) -> list:
+        with metrics.timer("backend.read"):
+            batch = list(itertools.islice(records, self._prefetch))
+        metrics.count(
+            "backend.bytes_read", sum(len(data or b"") for _, data in batch)
+        )
+        return [
+            (
+                filename,
+                None
+                if data is None
+                or needs_contents is not None and not needs_contents(filename)
+                else self._decompress(data),
+            )
+            for filename, data in batch
+        ]
+
+    def _named_records(
+        self, filenames: t.Iterable[str], exclude, needs_contents
+    ) -> t.Iterator[t.Tuple[str, t.Optional[bytes]]]:
+        """`filenames` which are stored and not excluded, read in the order
+        they lie in the packs unless their contents are not needed.
+        """
+        located = sorted(
+            (location, filename)
+            for filename in filenames
+            if (location := self._stored.location(filename)) is not None
+        )
+        for location, filename in located:
+            if exclude is not None and exclude(filename):
+                continue
+            if needs_contents is not None and not needs_contents(filename):
+                yield filename, None
+            else:
+                yield filename, self._stored.read_location(location)
+
+    async def retrieve_all(
+        self,
+        exclude: t.Optional[t.Callable[[str], bool]] = None,
+        filenames: t.Optional[t.Iterable[str]] = None,
+        needs_contents: t.Optional[t.Callable[[str], bool]] = None,
+    ) -> t.AsyncGenerator[t.BinaryIO, None]:
+        """Yield the contents of every stored file, reading the packs
+        sequentially in the I/O pool one batch of `prefetch` files ahead of
+        the consumer. `exclude` and `needs_contents` are called in the I/O
+        pool too. A sequential scan reads every record, but only those
+        whose contents are needed are decompressed.
+        """
+        loop = asyncio.get_running_loop()
+        records = (
+            self._stored.scan(exclude)
+            if filenames is None
+            else self._named_records(list(filenames), exclude, needs_contents)
+        )
+        batch = loop.run_in_executor(
+            self.io_executor, self._next_batch, records, needs_contents
+        )
+        while current := await batch:
+            batch = loop.run_in_executor(
+                self.io_executor, self._next_batch, records, needs_contents
+            )
+            for filename, data in current:
+                yield (None if data is None else io.BytesIO(data), filename)
+
+    def save(self, file: t.BinaryIO, filename: str):
+        with metrics.timer("backend.save"):
+            file.seek(os.SEEK_SET)
+            location = self._processed.append(filename, self._compress(file.read()))
+            self._appended(self._processed, location)
+            file.seek(os.SEEK_SET)
+            self.catalog.mark_processed(filename)
+
+    def retrieve_processed(self, filename: str) -> bytes:
+        return self._decompress(self._processed.read(filename))
+
+    def is_up_to_date(self, filename: str, key: dict) -> bool:
+        return (
+            self._load_manifest().get(filename) == key
+            and filename in self._processed
+        )
+
+    def reindex(self):
+        """Rebuild the pack indexes, then the catalog, from the packs."""
+        self._stored.rebuild_index()
+        self._processed.rebuild_index()
+        self.catalog.clear()
+        for filename, data in self._stored.scan():
+            self._catalog_data(
+                filename, self.source_digest(filename), self._decompress(data)
+            )
+            if filename in self._processed:
+                self.catalog.mark_processed(filename)
+
+    def compact(self) -> dict:
+        """Rewrite both sets of packs without superseded copies, and return
+        the number of bytes each took before and after. Nothing else may
+        write to the environment meanwhile.
+        """
+        sizes = {}
+        for name, packs in (
+            ("unprocessed", self._stored), ("processed", self._processed)
         ):
-            os.mkdir(os.path.join(self._root_path, self.UNPROCESSED_DIRECTORY_PREFIX))
+            before, after = packs.compact()
+            sizes[name] = {"before": before, "after": after}
+        return sizes
 
-    async def retrieve_all(self) -> t.AsyncGenerator[t.BinaryIO, None]:
-        for root, _, files in os.walk(self.unprocessed_path):
-            for filename in files:
-                path = os.path.join(root, filename)
-                with open(path, "rb") as file_obj:
-                    yield (file_obj, filename)
+    def fsck(self) -> t.List[str]:
+        """Check every record of both sets of packs against its checksum,
+        every stored file against the hash in its name, every index entry
+        against its record, and the catalog against the stored files.
+        """
+
+        def _matches_name(filename, data):
+            try:
+                data = self._decompress(data)
+            except ValueError:
+                return False
+            return hashlib.sha1(data).hexdigest() == self.source_digest(filename)
+
+        problems = self._stored.fsck(verify=_matches_name).problems
+        problems += self._processed.fsck().problems
+        return problems + self._catalog_problems(set(self._stored.filenames()))
+
+    def close(self):
+        self._stored.close()
+        self._processed.close()
+
+
+class InMemoryFileBackend(AbstractFileBackend):
+    """Keeps stored files and processed outputs in memory, named after the
+    SHA1 of their contents like those of the other backends, so that an
+    environment can be mutated without touching the disk. Its contents can
+    be written to, and read back from, a single snapshot file.
+
+    The catalog is only built, in memory, the first time files are listed
+    or summarized, so storing files costs no more than hashing them.
+    """
+
+    SNAPSHOT_MANIFEST = "manifest.json"
+
+    def __init__(self, prefetch: int = 64):
+        """`prefetch` is the number of files for which `retrieve_all` calls
+        its `exclude` callback at once, in a thread.
+        """
+        self._prefetch = max(prefetch, 1)
+        self._lock = threading.Lock()
+        self._stored: t.Dict[str, bytes] = {}
+        self._processed: t.Dict[str, bytes] = {}
+        self._manifest: t.Dict[str, dict] = {}
+        self._catalog = None
+
+    @property
+    def path(self):
+        """In-memory environments have no directories."""
+        return None
+
+    @property
+    def processed_path(self):
+        return None
+
+    @property
+    def unprocessed_path(self):
+        return None
+
+    @property
+    def catalog(self) -> catalog.Catalog:
+        with self._lock:
+            if self._catalog is None:
+                self._catalog = catalog.Catalog(":memory:")
+                self._index()
+        return self._catalog
+
+    def _index(self):
+        """Catalog every file, with the lock held."""
+        self._catalog.clear()
+        for filename, data in self._stored.items():
+            _catalog_contents(
+                self._catalog, filename, self.source_digest(filename), data
+            )
+            if filename in self._processed:
+                self._catalog.mark_processed(filename)
+
+    def initialize(self):
+        with self._lock:
+            self._stored.clear()
+            self._processed.clear()
+            self._manifest.clear()
+            if self._catalog is not None:
+                self._catalog.clear()
+
+    def store(self, file_object: t.BinaryIO, extension="mid"):
+        with metrics.timer("backend.store"):
+            file_object.seek(os.SEEK_SET)
+            data = file_object.read()
+            file_object.seek(os.SEEK_SET)
+            metrics.count("backend.bytes_stored", len(data))
+            digest = hashlib.sha1(data).hexdigest()
+            filename = f"{digest}.{extension}"
+            with self._lock:
+                if filename in self._stored:
+                    raise ValueError(
+                        f"Cannot store file {filename}, a file with that hash "
+                        "already exists in this environment"
+                    )
+                self._stored[filename] = data
+                file_catalog = self._catalog
+            if file_catalog is not None:
+                _catalog_contents(file_catalog, filename, digest, data)
+            return filename
+
+    def contains(self, digest: str, extension: str = "mid") -> bool:
+        return f"{digest}.{extension}" in self._stored
+
+    def source_digest(self, filename: str) -> str:
+        return filename.split(".", 1)[0]
+
+    def _next_batch(self, filenames: t.Iterator[str], exclude) -> list:
+        return [
+            (filename, self._stored[filename])
+            for filename in itertools.islice(filenames, self._prefetch)
+            if filename in self._stored
+            and (exclude is None or not exclude(filename))
+        ]
+
+    async def retrieve_all(
+        self,
+        exclude: t.Optional[t.Callable[[str], bool]] = None,
+        filenames: t.Optional[t.Iterable[str]] = None,
+        needs_contents: t.Optional[t.Callable[[str], bool]] = None,
+    ) -> t.AsyncGenerator[t.BinaryIO, None]:
+        """Yield the contents of every stored file, in the order they were
+        stored. `exclude`, which may do I/O, is called in a thread for a
+        batch of `prefetch` files at a time; without it, no thread is used.
+        Contents are held in memory, so they are yielded whether or not
+        `needs_contents` says they are needed.
+        """
+        names = iter(list(self._stored if filenames is None else filenames))
+        while True:
+            if exclude is None:
+                batch = self._next_batch(names, None)
+            else:
+                batch = await asyncio.to_thread(self._next_batch, names, exclude)
+            if not batch:
+                return
+            for filename, data in batch:
+                yield (io.BytesIO(data), filename)
 
     def save(self, file: t.BinaryIO, filename: str):
-        file.seek(os.SEEK_SET)
-        with open(os.path.join(self.processed_path, filename), "wb") as file_obj:
-            file_obj.write(file.read())
-        file.seek(os.SEEK_SET)
+        with metrics.timer("backend.save"):
+            file.seek(os.SEEK_SET)
+            data = file.read()
+            file.seek(os.SEEK_SET)
+            with self._lock:
+                self._processed[filename] = data
+                file_catalog = self._catalog
+            if file_catalog is not None:
+                file_catalog.mark_processed(filename)
+
+    async def save_async(self, file: t.BinaryIO, filename: str):
+        self.save(file, filename)
+
+    def retrieve_processed(self, filename: str) -> bytes:
+        return self._processed[filename]
+
+    def is_up_to_date(self, filename: str, key: dict) -> bool:
+        return self._manifest.get(filename) == key and filename in self._processed
+
+    def mark_up_to_date(self, filename: str, key: dict):
+        self._manifest[filename] = key
+
+    def list_files(
+        self, processed: t.Optional[bool] = None, limit: t.Optional[int] = None
+    ) -> t.List[dict]:
+        return self.catalog.query(processed=processed, limit=limit)
+
+    def stats(self) -> dict:
+        return self.catalog.stats()
+
+    def reindex(self):
+        with self._lock:
+            if self._catalog is not None:
+                self._index()
+
+    def fsck(self) -> t.List[str]:
+        """Check every stored file against the hash in its name, and the
+        catalog, if built, against the stored files.
+        """
+        with self._lock:
+            stored = dict(self._stored)
+            file_catalog = self._catalog
+        problems = [
+            f"{filename} does not match the hash in its name"
+            for filename, data in stored.items()
+            if hashlib.sha1(data).hexdigest() != self.source_digest(filename)
+        ]
+        if file_catalog is not None:
+            problems += _catalog_differences(file_catalog, set(stored))
+        return problems
+
+    def snapshot(self, path: str):
+        """Write every stored file and processed output, and the record of
+        which outputs are up to date, to the zip file `path`. The file is
+        replaced atomically, so an interrupted snapshot leaves any previous
+        one intact.
+        """
+        with self._lock:
+            stored = dict(self._stored)
+            processed = dict(self._processed)
+            manifest = json.dumps(self._manifest)
+        temporary_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        try:
+            with zipfile.ZipFile(temporary_path, "w") as archive:
+                for prefix, files in (
+                    (_DirectoryBackend.UNPROCESSED_DIRECTORY_PREFIX, stored),
+                    (_DirectoryBackend.PROCESSED_DIRECTORY_PREFIX, processed),
+                ):
+                    for filename, data in files.items():
+                        archive.writestr(f"{prefix}/{filename}", data)
+                archive.writestr(self.SNAPSHOT_MANIFEST, manifest)
+            os.replace(temporary_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temporary_path)
+            raise
+
+    def load(self, path: str):
+        """Replace the contents of the environment with those of the
+        snapshot `path`.
+        """
+        stored, processed = {}, {}
+        folders = {
+            _DirectoryBackend.UNPROCESSED_DIRECTORY_PREFIX: stored,
+            _DirectoryBackend.PROCESSED_DIRECTORY_PREFIX: processed,
+        }
+        with zipfile.ZipFile(path) as archive:
+            manifest = json.loads(archive.read(self.SNAPSHOT_MANIFEST))
+            for name in archive.namelist():
+                prefix, _, filename = name.partition("/")
+                if prefix in folders and filename:
+                    folders[prefix][filename] = archive.read(name)
+        with self._lock:
+            self._stored = stored
+            self._processed = processed
+            self._manifest = manifest
+            if self._catalog is not None:
+                self._index()
+
+
+# pylint: disable=too-many-instance-attributes
+class S3FileBackend(AbstractFileBackend):
+    """Keeps an environment in S3-compatible object storage, at the URL
+    `s3://bucket/prefix`. Stored files and processed outputs are objects
+    under `prefix/unprocessed/` and `prefix/processed/`, named like those
+    of `LocalFileBackend`, and the manifest of processed outputs is the
+    object `prefix/manifest.json`. See `s3` for the client, which is
+    configured from the usual `AWS_*` environment variables unless given.
+
+    Requests run in an I/O pool of `io_concurrency` threads, sharing as
+    many pooled connections. Environments have no catalog, so `list_files`
+    and `stats` only report what listing the bucket tells.
+    """
+
+    STORE_CHUNK_SIZE = 1 << 20
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        url: str,
+        io_concurrency: int = 8,
+        prefetch: int = 16,
+        client=None,
+        page_size: int = 1000,
+        multipart_threshold: t.Optional[int] = None,
+        part_size: t.Optional[int] = None,
+    ):
+        """`prefetch` bounds the number of objects `retrieve_all` downloads
+        ahead of its consumer, and `page_size` the number of keys listed
+        per request. Objects of at least `multipart_threshold` bytes are
+        uploaded in parts of `part_size` bytes.
+        """
+        bucket, self._prefix = s3.parse_url(url)
+        self._io_concurrency = io_concurrency
+        self._prefetch = max(prefetch, 1)
+        self._client = client or s3.S3Client.from_environment(
+            bucket, pool_size=io_concurrency
+        )
+        self._page_size = page_size
+        self._multipart_threshold = (
+            multipart_threshold or s3.DEFAULT_MULTIPART_THRESHOLD
+        )
+        self._part_size = part_size or s3.DEFAULT_PART_SIZE
+        self._io_executor = None
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._processed = None
+
+    def _key(self, *parts: str) -> str:
+        return "/".join(part for part in (self._prefix, *parts) if part)
+
+    def _url(self, key: str) -> str:
+        return f"{s3.URL_SCHEME}{self._client.bucket}/{key}"
+
+    @property
+    def path(self):
+        return self._url(self._key())
+
+    @property
+    def processed_path(self):
+        return self._url(self._key(_DirectoryBackend.PROCESSED_DIRECTORY_PREFIX))
+
+    @property
+    def unprocessed_path(self):
+        return self._url(self._key(_DirectoryBackend.UNPROCESSED_DIRECTORY_PREFIX))
+
+    def _stored_key(self, filename: str) -> str:
+        """Key of the stored file `filename`, or with an empty filename the
+        prefix of every stored file's key.
+        """
+        return (
+            f"{self._key(_DirectoryBackend.UNPROCESSED_DIRECTORY_PREFIX)}/{filename}"
+        )
+
+    def _processed_key(self, filename: str) -> str:
+        return f"{self._key(_DirectoryBackend.PROCESSED_DIRECTORY_PREFIX)}/{filename}"
+
+    @property
+    def io_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if self._io_executor is None:
+            self._io_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._io_concurrency,
+                thread_name_prefix="magenta-rapids-s3",
+            )
+        return self._io_executor
+
+    def initialize(self):
+        self._client.put_object(
+            self._key(_DirectoryBackend.CONFIG_FILENAME),
+            json.dumps({"backend": S3_BACKEND}).encode(),
+        )
+
+    def migrate(self, shard_depth: int):
+        raise ValueError("S3 environments have no sharded layout to migrate")
+
+    def store(self, file_object: t.BinaryIO, extension="mid"):
+        with metrics.timer("backend.store"):
+            return self._store(file_object, extension)
+
+    def _store(self, file_object: t.BinaryIO, extension):
+        file_object.seek(os.SEEK_SET)
+        sha = hashlib.sha1()
+        while chunk := file_object.read(self.STORE_CHUNK_SIZE):
+            metrics.count("backend.bytes_stored", len(chunk))
+            sha.update(chunk)
+        key = self._stored_key(f"{sha.hexdigest()}.{extension}")
+        if self._client.head_object(key) is not None:
+            raise ValueError(
+                f"Cannot store file at {self._url(key)}, a file with that hash "
+                "already exists in this environment"
+            )
+        file_object.seek(os.SEEK_SET)
+        self._client.upload(
+            key, file_object, self._multipart_threshold, self._part_size
+        )
+        file_object.seek(os.SEEK_SET)
+        return self._url(key)
+
+    def contains(self, digest: str, extension: str = "mid") -> bool:
+        return (
+            self._client.head_object(self._stored_key(f"{digest}.{extension}"))
+            is not None
+        )
+
+    def source_digest(self, filename: str) -> str:
+        return filename.split(".", 1)[0]
+
+    def _list_page(self, token: t.Optional[str]):
+        with metrics.timer("backend.list_page"):
+            return self._client.list_objects(
+                self._stored_key(""), token, self._page_size
+            )
+
+    def _read(self, filename: str, exclude, needs_contents):
+        if exclude is not None and exclude(filename):
+            return _SKIPPED
+        if needs_contents is not None and not needs_contents(filename):
+            if self._client.head_object(self._stored_key(filename)) is None:
+                return _SKIPPED
+            return None
+        with metrics.timer("backend.read"):
+            data = self._client.get_object(self._stored_key(filename))
+        if data is None:
+            return _SKIPPED
+        metrics.count("backend.bytes_read", len(data))
+        return io.BytesIO(data)
+
+    async def retrieve_all(
+        self,
+        exclude: t.Optional[t.Callable[[str], bool]] = None,
+        filenames: t.Optional[t.Iterable[str]] = None,
+        needs_contents: t.Optional[t.Callable[[str], bool]] = None,
+    ) -> t.AsyncGenerator[t.BinaryIO, None]:
+        """Yield the contents of every stored file, downloaded in the I/O
+        pool up to `prefetch` files ahead of the consumer. The next page of
+        the listing is requested as soon as the previous one arrives.
+        `exclude` and `needs_contents` are called in the I/O pool too.
+        Named files which are not stored are skipped.
+        """
+        loop = asyncio.get_running_loop()
+        pending = collections.deque()
+        page = collections.deque(() if filenames is None else filenames)
+        next_page = (
+            loop.run_in_executor(self.io_executor, self._list_page, None)
+            if filenames is None
+            else None
+        )
+        stored_prefix = self._stored_key("")
+        while True:
+            while len(pending) < self._prefetch:
+                if not page:
+                    if next_page is None:
+                        break
+                    objects, token = await next_page
+                    next_page = (
+                        None
+                        if token is None
+                        else loop.run_in_executor(
+                            self.io_executor, self._list_page, token
+                        )
+                    )
+                    page.extend(key[len(stored_prefix):] for key, _ in objects)
+                    continue
+                filename = page.popleft()
+                pending.append(
+                    (
+                        filename,
+                        loop.run_in_executor(
+                            self.io_executor, self._read, filename, exclude,
+                            needs_contents,
+                        ),
+                    )
+                )
+            if not pending:
+                return
+            filename, future = pending.popleft()
+            file_obj = await future
+            if file_obj is not _SKIPPED:
+                yield (file_obj, filename)
+
+    def save(self, file: t.BinaryIO, filename: str):
+        with metrics.timer("backend.save"):
+            file.seek(os.SEEK_SET)
+            self._client.upload(
+                self._processed_key(filename), file, self._multipart_threshold,
+                self._part_size,
+            )
+            file.seek(os.SEEK_SET)
+        with self._lock:
+            if self._processed is not None:
+                self._processed.add(filename)
+
+    async def save_async(self, file: t.BinaryIO, filename: str):
+        await asyncio.get_running_loop().run_in_executor(
+            self.io_executor, self.save, file, filename
+        )
+
+    def retrieve_processed(self, filename: str) -> bytes:
+        data = self._client.get_object(self._processed_key(filename))
+        if data is None:
+            raise FileNotFoundError(self._url(self._processed_key(filename)))
+        return data
+
+    def _listed(self, key_prefix: str) -> t.Dict[str, int]:
+        """Size of every object under `key_prefix`, by filename."""
+        return {
+            key[len(key_prefix):]: size
+            for key, size in self._client.list_all(key_prefix, self._page_size)
+        }
+
+    def _processed_filenames(self) -> t.Set[str]:
+        """Filenames with a processed output, listed once and then kept up
+        to date by `save`.
+        """
+        with self._lock:
+            if self._processed is None:
+                self._processed = set(self._listed(self._processed_key("")))
+            return self._processed
+
+    def _load_manifest(self) -> dict:
+        with self._lock:
+            if self._manifest is None:
+                data = self._client.get_object(
+                    self._key(_DirectoryBackend.MANIFEST_FILENAME)
+                )
+                manifest = {} if data is None else json.loads(data)
+                if manifest.get("version") != _DirectoryBackend.MANIFEST_VERSION:
+                    manifest = {
+                        "version": _DirectoryBackend.MANIFEST_VERSION, "outputs": {}
+                    }
+                self._manifest = manifest
+            return self._manifest["outputs"]
+
+    def is_up_to_date(self, filename: str, key: dict) -> bool:
+        return (
+            self._load_manifest().get(filename) == key
+            and filename in self._processed_filenames()
+        )
+
+    def mark_up_to_date(self, filename: str, key: dict):
+        self._load_manifest()[filename] = key
+
+    def flush(self):
+        if self._manifest is None:
+            return
+        self._client.put_object(
+            self._key(_DirectoryBackend.MANIFEST_FILENAME),
+            json.dumps(self._manifest).encode(),
+        )
+
+    def list_files(
+        self, processed: t.Optional[bool] = None, limit: t.Optional[int] = None
+    ) -> t.List[dict]:
+        """The stored files, with only the columns of the catalog which
+        listing the bucket gives filled in.
+        """
+        outputs = set(self._listed(self._processed_key("")))
+        rows = []
+        for filename, size in sorted(self._listed(self._stored_key("")).items()):
+            is_processed = filename in outputs
+            if processed is not None and is_processed != processed:
+                continue
+            rows.append(
+                {
+                    **dict.fromkeys(catalog.COLUMNS),
+                    "filename": filename,
+                    "sha1": self.source_digest(filename),
+                    "size": size,
+                    "processed": int(is_processed),
+                }
+            )
+            if limit is not None and len(rows) == limit:
+                break
+        return rows
+
+    def stats(self) -> dict:
+        rows = self.list_files()
+        return {
+            "files": len(rows),
+            "processed": sum(row["processed"] for row in rows),
+            "total_size": sum(row["size"] for row in rows),
+        }
+
+    def fsck(self) -> t.List[str]:
+        """Download every stored file and check it against the hash in its
+        name.
+        """
+
+        def _check(filename):
+            data = self._client.get_object(self._stored_key(filename))
+            if data is None:
+                return f"{self._url(self._stored_key(filename))} disappeared"
+            if hashlib.sha1(data).hexdigest() != self.source_digest(filename):
+                return (
+                    f"{self._url(self._stored_key(filename))} does not match "
+                    "the hash in its name"
+                )
+            return None
+
+        return [
+            problem
+            for problem in self.io_executor.map(
+                _check, sorted(self._listed(self._stored_key("")))
+            )
+            if problem is not None
+        ]
+
+    def close(self):
+        if self._io_executor is not None:
+            self._io_executor.shutdown()
+        self._client.close()
+
+
+LOCAL_BACKEND = "local"
+PACK_BACKEND = "pack"
+S3_BACKEND = "s3"
+BACKENDS = {LOCAL_BACKEND: LocalFileBackend, PACK_BACKEND: PackFileBackend}
+
+
+def open_backend(local_root_path: str, **kwargs) -> AbstractFileBackend:
+    """Open the environment in `local_root_path` with the backend recorded
+    in its configuration when it was initialized, or the one at an
+    `s3://bucket/prefix` URL.
+    """
+    if file_utilities.is_object_storage_url(local_root_path):
+        return S3FileBackend(local_root_path, **kwargs)
+    config_path = os.path.join(local_root_path, _DirectoryBackend.CONFIG_FILENAME)
+    try:
+        with open(config_path, "r", encoding="utf-8") as file_obj:
+            name = json.load(file_obj).get("backend", LOCAL_BACKEND)
+    except FileNotFoundError:
+        name = LOCAL_BACKEND
+    return BACKENDS[name](local_root_path, **kwargs)
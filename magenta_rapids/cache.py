@@ -0,0 +1,223 @@
+"""Mutation result cache for Magenta Rapids. Mutation is deterministic, so a
+result only depends on the content of the source file, the transform
+applied and the number of steps. A `MutationCache` keeps results under a
+key derived from those three, in a bounded in-memory LRU in front of a
+cache directory which can be shared between environments and runs.
+
+Both tiers are bounded in bytes. The memory tier evicts its least recently
+used entries; the directory evicts the entries it least recently wrote or
+read, using file modification times, which reads refresh.
+"""
+
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+import typing as t
+import uuid
+from magenta_rapids import metrics
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 1024 * 1024 * 1024
+# Fraction of its bound the directory is pruned down to once it overflows,
+# so that a full cache is not pruned again on every write
+_PRUNE_TARGET = 0.9
+# Age after which a temporary file is assumed to be left by a writer which
+# was interrupted, rather than being written by another process
+_STALE_TEMPORARY_SECONDS = 3600
+
+
+def default_directory() -> str:
+    """`$MAGENTA_RAPIDS_CACHE_DIR`, or `magenta_rapids` in the user's cache
+    directory.
+    """
+    if "MAGENTA_RAPIDS_CACHE_DIR" in os.environ:
+        return os.environ["MAGENTA_RAPIDS_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "magenta_rapids")
+
+
+def cache_key(
+    source_digest: str, mutator_identity: str, number_steps: int
+) -> str:
+    """Key of the result of mutating the file with SHA1 `source_digest`."""
+    return hashlib.sha1(
+        json.dumps([source_digest, mutator_identity, number_steps]).encode()
+    ).hexdigest()
+
+
+class CacheStats(t.NamedTuple):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    memory_evictions: int = 0
+    disk_evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class PruneSummary(t.NamedTuple):
+    removed: int
+    removed_bytes: int
+    remaining: int
+    remaining_bytes: int
+
+
+def _entries(directory: str) -> t.List[t.Tuple[float, int, str]]:
+    """(mtime, size, path) of every entry in a cache directory."""
+    entries = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def prune(
+    directory: str,
+    max_bytes: t.Optional[int] = None,
+    max_age: t.Optional[float] = None,
+) -> PruneSummary:
+    """Remove the entries of a cache directory not used for `max_age`
+    seconds, then the least recently used ones until at most `max_bytes`
+    remain. Temporary files left by interrupted writes are always removed.
+    """
+    entries = sorted(_entries(directory))
+    now = time.time()
+    cutoff = None if max_age is None else now - max_age
+    total = sum(size for _, size, _ in entries)
+    removed = removed_bytes = 0
+    for mtime, size, path in entries:
+        if not (
+            (
+                ".tmp-" in os.path.basename(path)
+                and mtime < now - _STALE_TEMPORARY_SECONDS
+            )
+            or (cutoff is not None and mtime < cutoff)
+            or (max_bytes is not None and total > max_bytes)
+        ):
+            continue
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
+            removed += 1
+            removed_bytes += size
+        total -= size
+    return PruneSummary(removed, removed_bytes, len(entries) - removed, total)
+
+
+# pylint: disable=too-many-instance-attributes
+class MutationCache:
+    """Results of mutations, kept in memory up to `memory_bytes` and in
+    `directory`, when given, up to `disk_bytes`. Safe to use from several
+    threads.
+    """
+
+    def __init__(
+        self,
+        directory: t.Optional[str] = None,
+        memory_bytes: int = DEFAULT_MEMORY_BYTES,
+        disk_bytes: int = DEFAULT_DISK_BYTES,
+    ):
+        self.directory = directory
+        self._memory_bytes = memory_bytes
+        self._disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory: t.OrderedDict[str, bytes] = collections.OrderedDict()
+        self._memory_used = 0
+        # Bytes in the directory, measured on the first write
+        self._disk_used: t.Optional[int] = None
+        self._stats = collections.Counter()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**self._stats)
+
+    def _count(self, name: str):
+        self._stats[name] += 1
+        metrics.count(f"cache.{name}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _remember(self, key: str, result: bytes):
+        """Add to the memory tier, with the lock held."""
+        if len(result) > self._memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous)
+        self._memory[key] = result
+        self._memory_used += len(result)
+        while self._memory_used > self._memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            self._count("memory_evictions")
+
+    def get(self, key: str) -> t.Optional[bytes]:
+        """The cached result for `key`, or `None`."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self._count("memory_hits")
+                return result
+        if self.directory is not None:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as file_obj:
+                    result = file_obj.read()
+                os.utime(path)
+            except FileNotFoundError:
+                result = None
+            if result is not None:
+                with self._lock:
+                    self._remember(key, result)
+                    self._count("disk_hits")
+                return result
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def put(self, key: str, result: bytes):
+        with self._lock:
+            self._remember(key, result)
+        if self.directory is None or len(result) > self._disk_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        with open(temporary_path, "wb") as file_obj:
+            file_obj.write(result)
+        os.replace(temporary_path, path)
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(
+                    size for _, size, _ in _entries(self.directory)
+                )
+            else:
+                self._disk_used += len(result)
+            if self._disk_used <= self._disk_bytes:
+                return
+            summary = prune(
+                self.directory, max_bytes=int(self._disk_bytes * _PRUNE_TARGET)
+            )
+            self._disk_used = summary.remaining_bytes
+            self._stats["disk_evictions"] += summary.removed
+            metrics.count("cache.disk_evictions", summary.removed)
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
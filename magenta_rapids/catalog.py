@@ -0,0 +1,199 @@
+"""SQLite catalog of the files in a Magenta Rapids environment. The catalog
+records every stored file together with facts parsed from it when it was
+stored, so that enumerating and summarizing an environment does not need to
+walk or open its files.
+"""
+
+import io
+import sqlite3
+import threading
+import time
+import typing as t
+from magenta_rapids import smf
+from magenta_rapids.lazy import lazy_import
+
+mido = lazy_import("mido")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    sha1 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_at REAL NOT NULL,
+    processed INTEGER NOT NULL DEFAULT 0,
+    processed_at REAL,
+    track_count INTEGER,
+    ticks_per_beat INTEGER,
+    note_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_processed ON files (processed);
+"""
+
+COLUMNS = (
+    "filename",
+    "sha1",
+    "size",
+    "stored_at",
+    "processed",
+    "processed_at",
+    "track_count",
+    "ticks_per_beat",
+    "note_count",
+)
+
+
+class MidiFacts(t.NamedTuple):
+    track_count: t.Optional[int]
+    ticks_per_beat: t.Optional[int]
+    note_count: t.Optional[int]
+
+
+def parse_midi_facts(file_object: t.BinaryIO) -> MidiFacts:
+    """Facts about a MIDI file recorded in the catalog. Files which cannot be
+    parsed are still catalogued, without facts.
+    """
+    data = file_object.read()
+    try:
+        decoded = smf.decode(data)
+    except smf.SMFError:
+        return _parse_midi_facts_with_mido(data)
+    return decoded_midi_facts(decoded)
+
+
+def decoded_midi_facts(decoded: smf.SMF) -> MidiFacts:
+    tracks = decoded.tracks
+    note_count = sum(
+        1
+        for track in tracks
+        for idx in track.note_indices
+        if track.statuses[idx] & 0xF0 == smf.NOTE_ON and track.velocities[idx]
+    )
+    return MidiFacts(len(tracks), decoded.ticks_per_beat, note_count)
+
+
+def _parse_midi_facts_with_mido(data: bytes) -> MidiFacts:
+    try:
+        file = mido.MidiFile(file=io.BytesIO(data))
+    except (OSError, EOFError, ValueError, KeyError):
+        return MidiFacts(None, None, None)
+    note_count = sum(
+        1
+        for track in file.tracks
+        for message in track
+        if message.type == "note_on" and message.velocity > 0
+    )
+    return MidiFacts(len(file.tracks), file.ticks_per_beat, note_count)
+
+
+class Catalog:
+    """Catalog stored in a single SQLite database. A catalog may be shared
+    between threads.
+    """
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add(self, filename: str, sha1: str, size: int, facts: MidiFacts):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (filename, sha1, size, stored_at, "
+                "track_count, ticks_per_beat, note_count) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filename, sha1, size, time.time(), *facts),
+            )
+
+    def contains(self, filename: str) -> bool:
+        with self._lock:
+            return (
+                self._connection.execute(
+                    "SELECT 1 FROM files WHERE filename = ?", (filename,)
+                ).fetchone()
+                is not None
+            )
+
+    def mark_processed(self, filename: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE files SET processed = 1, processed_at = ? "
+                "WHERE filename = ?",
+                (time.time(), filename),
+            )
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM files")
+
+    def filenames_page(self, after: str = "") -> t.List[str]:
+        """Up to `PAGE_SIZE` catalogued filenames following `after`, in
+        order. Paging lets the catalog be updated while it is iterated.
+        """
+        with self._lock:
+            return [
+                filename
+                for (filename,) in self._connection.execute(
+                    "SELECT filename FROM files WHERE filename > ? "
+                    "ORDER BY filename LIMIT ?",
+                    (after, self.PAGE_SIZE),
+                )
+            ]
+
+    def filenames(self) -> t.Iterator[str]:
+        """Iterate over every catalogued filename."""
+        page = self.filenames_page()
+        while page:
+            yield from page
+            page = self.filenames_page(page[-1])
+
+    def query(
+        self, processed: t.Optional[bool] = None, limit: t.Optional[int] = None
+    ) -> t.List[dict]:
+        sql = f"SELECT {', '.join(COLUMNS)} FROM files"
+        parameters = []
+        if processed is not None:
+            sql += " WHERE processed = ?"
+            parameters.append(int(processed))
+        sql += " ORDER BY filename"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(processed), 0), "
+                "COALESCE(SUM(size), 0), COALESCE(SUM(note_count), 0), "
+                "COALESCE(SUM(track_count), 0), MIN(stored_at), MAX(stored_at) "
+                "FROM files"
+            ).fetchone()
+        return dict(
+            zip(
+                (
+                    "files",
+                    "processed",
+                    "total_size",
+                    "notes",
+                    "tracks",
+                    "first_stored_at",
+                    "last_stored_at",
+                ),
+                row,
+            )
+        )
@@ -2,73 +2,491 @@
 Command-Line Interface
 """
 
-import asyncio
+import json
 import click
-import mido
-from magenta_rapids import decorators, backends
+from magenta_rapids import decorators, file_utilities
+from magenta_rapids.lazy import lazy_import
+
+# Only imported by the commands which use them, to keep startup fast
+asyncio = lazy_import("asyncio")
+cProfile = lazy_import("cProfile")
+mido = lazy_import("mido")
+pstats = lazy_import("pstats")
+backends = lazy_import("magenta_rapids.backends")
+cache_module = lazy_import("magenta_rapids.cache")
+compression_module = lazy_import("magenta_rapids.compression")
+metrics = lazy_import("magenta_rapids.metrics")
+mutators = lazy_import("magenta_rapids.mutators")
+playback = lazy_import("magenta_rapids.playback")
+server = lazy_import("magenta_rapids.server")
+watch_module = lazy_import("magenta_rapids.watch")
 
 CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"]}
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
-def cli():
+@click.option(
+    "--profile", is_flag=True,
+    help="Print per-stage timings and counters when the command ends",
+)
+@click.option(
+    "--metrics-out", "--metrics_out", "metrics_out",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write per-stage totals, histograms and counters to this JSON file",
+)
+@click.option(
+    "--cprofile-out", "--cprofile_out", "cprofile_out",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Capture a cProfile of the main thread and write pstats data to this file",
+)
+@click.pass_context
+def cli(ctx, profile, metrics_out, cprofile_out):
     """Main entrypoint for CLI
     """
+    if profile or metrics_out:
+        metrics.enable()
+        ctx.call_on_close(lambda: _report_metrics(profile, metrics_out))
+    if cprofile_out:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        ctx.call_on_close(lambda: _report_cprofile(profiler, profile, cprofile_out))
+
+
+def _report_metrics(profile, metrics_out):
+    described = metrics.summary()
+    if metrics_out:
+        with open(metrics_out, "w", encoding="utf-8") as file_obj:
+            json.dump(described, file_obj, indent=2)
+    if profile:
+        click.echo(metrics.format_summary(described), err=True)
+
+
+def _report_cprofile(profiler, profile, cprofile_out):
+    profiler.disable()
+    profiler.dump_stats(cprofile_out)
+    if profile:
+        click.echo(err=True)
+        profile_stats = pstats.Stats(
+            profiler, stream=click.get_text_stream("stderr")
+        )
+        profile_stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(20)
+
+
+def _parse_compression(ctx, param, value):
+    try:
+        compression_module.parse(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error), ctx=ctx, param=param) from error
+    return value
 
 
 @cli.command()
 @decorators.option_valid_environment(exists=False)
-def init(environment_path):
+@decorators.option_shard_depth()
+@click.option(
+    "--backend", "backend_name", type=click.Choice(["local", "pack"]),
+    default="local", show_default=True,
+    help="Keep each file in its own file, or append them to large pack files",
+)
+@click.option(
+    "--compression", default="none", show_default=True,
+    callback=_parse_compression, metavar="CODEC[:LEVEL]",
+    help="Compress stored files and outputs with zlib or lzma, at level 0-9",
+)
+def init(environment_path, shard_depth, backend_name, compression):
     """
     Initialize a Magenta Rapids environment
     """
+    if backend_name == "pack" and shard_depth:
+        raise click.BadParameter(
+            "Pack environments have no sharded layout", param_hint="--shard_depth"
+        )
+    is_object_storage = file_utilities.is_object_storage_url(environment_path)
+    if is_object_storage and (
+        backend_name != "local" or shard_depth or compression != "none"
+    ):
+        raise click.UsageError(
+            "Environments in object storage have no backend, layout or "
+            "compression options"
+        )
     click.echo("Initializing a new Magenta Rapids environment in ", nl=False)
     click.secho(environment_path, fg="green", bold=True)
-    backend = backends.LocalFileBackend(local_root_path=environment_path)
-    backend.initialize()
+    if is_object_storage:
+        backends.open_backend(environment_path).initialize()
+        return
+    backend = backends.BACKENDS[backend_name](local_root_path=environment_path)
+    backend.initialize(shard_depth=shard_depth, compression=compression)
+
+
+@cli.command()
+@decorators.option_valid_environment()
+@decorators.option_shard_depth()
+def migrate(environment_path, shard_depth):
+    """
+    Convert a Magenta Rapids environment to a new directory layout
+    """
+    environment = environment_path
+    click.echo("Migrating Magenta Rapids environment in ", nl=False)
+    click.secho(environment, fg="green", bold=True, nl=False)
+    click.echo(f" to shard depth {shard_depth}")
+    environment.migrate(shard_depth)
 
 
 @cli.command()
 @decorators.option_valid_environment()
-@decorators.option_valid_midi_file(exists=False)
-def store(environment_path, file):
+@decorators.option_valid_midi_sources()
+@click.option(
+    "-j", "--jobs", help="Number of threads used to hash and copy files",
+    default=8, type=click.IntRange(min=1),
+)
+@decorators.option_durability()
+def store(environment_path, file, jobs, durability):
     """
     Store Buffered MIDI in Magenta Rapids format in a given environment
     """
     environment = environment_path
-    click.echo("Storing a new file ", nl=False)
-    click.secho(file, fg="green", bold=True, nl=False)
-    click.echo(" in ", nl=False)
+    environment.backend.set_durability(durability)
+    click.echo(f"Storing {len(file)} file(s) in ", nl=False)
     click.secho(environment, fg="green", bold=True)
-    with open(file, "rb") as file_obj:
-        full_target_path = environment.store(file_obj)
-    click.echo("Successfully stored file ", nl=False)
-    click.secho(full_target_path, fg="green", bold=True)
+    summary = environment.store_many(file, jobs=jobs)
+    if len(file) == 1:
+        for full_target_path in summary.stored.values():
+            click.echo("Successfully stored file ", nl=False)
+            click.secho(full_target_path, fg="green", bold=True)
+    if summary.duplicates:
+        click.secho(
+            f"Skipped {len(summary.duplicates)} duplicate file(s):", fg="yellow"
+        )
+        for path, digest in summary.duplicates.items():
+            click.echo(f"  {path} ({digest})")
+    click.echo(
+        f"Stored {len(summary.stored)} file(s), "
+        f"skipped {len(summary.duplicates)} duplicate(s)"
+    )
+
+
+def _parse_pipeline(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return mutators.parse_pipeline(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error), ctx=ctx, param=param) from error
 
 
 @cli.command()
 @decorators.option_valid_environment()
 @click.option("-n", "--number_steps", help="Number of times to mutate", default=1, type=int)
-def mutate(environment_path, number_steps):
+@click.option(
+    "-j", "--jobs", help="Number of worker processes, 0 for one per CPU",
+    default=1, type=click.IntRange(min=0),
+)
+@click.option(
+    "--read_queue_depth", help="Number of files read ahead of mutation",
+    default=8, type=click.IntRange(min=1),
+)
+@click.option(
+    "--write_queue_depth", help="Number of mutated files waiting to be saved",
+    default=8, type=click.IntRange(min=1),
+)
+@click.option(
+    "--force", is_flag=True,
+    help="Mutate every file, even when its processed output is up to date",
+)
+@click.option(
+    "--pipeline", callback=_parse_pipeline,
+    help="Mutators to chain over one decode of each file, such as "
+    "'simple:2,memoized'. A stage without ':STEPS' runs --number_steps steps",
+)
+@click.option(
+    "--cache", "use_cache", is_flag=True,
+    help="Reuse and record results in the mutation result cache in "
+    "$MAGENTA_RAPIDS_CACHE_DIR or ~/.cache/magenta_rapids",
+)
+@click.option(
+    "--cache_dir", type=click.Path(file_okay=False),
+    help="Reuse and record results in the mutation result cache in this "
+    "directory, which environments may share",
+)
+@decorators.option_durability()
+# pylint: disable=too-many-arguments
+def mutate(
+    environment_path, number_steps, jobs, read_queue_depth, write_queue_depth,
+    force, pipeline, use_cache, cache_dir, durability,
+):
     """
     Mutate MIDI currently stored in Magenta Rapids format in a given environment
     """
     environment = environment_path
+    environment.backend.set_durability(durability)
+    if pipeline is not None:
+        environment.mutator = pipeline
+    if use_cache or cache_dir is not None:
+        environment.cache = cache_module.MutationCache(
+            cache_dir or cache_module.default_directory()
+        )
     click.echo("Mutating files for Magenta Rapids environment in ", nl=False)
     click.secho(environment, fg="green", bold=True)
-    asyncio.run(environment.mutate(number_steps))
+    asyncio.run(
+        environment.mutate(
+            number_steps,
+            jobs=jobs,
+            read_queue_depth=read_queue_depth,
+            write_queue_depth=write_queue_depth,
+            force=force,
+        )
+    )
+    if environment.cache is not None:
+        cache_stats = environment.cache.stats()
+        click.echo(
+            f"Mutation cache hit rate {cache_stats.hit_rate:.1%} "
+            f"({cache_stats.memory_hits + cache_stats.disk_hits} hit(s), "
+            f"{cache_stats.misses} miss(es))"
+        )
+
+
+@cli.command()
+@decorators.option_valid_environment()
+@click.option("-n", "--number_steps", help="Number of times to mutate", default=1, type=int)
+@click.option(
+    "-j", "--jobs", help="Number of worker processes, 0 for one per CPU",
+    default=1, type=click.IntRange(min=0),
+)
+@click.option(
+    "--debounce", help="Seconds a new file must stay unchanged before it is mutated",
+    default=0.2, type=click.FloatRange(min=0),
+)
+@click.option(
+    "--poll_interval", help="Seconds between scans when inotify is unavailable",
+    default=0.5, type=click.FloatRange(min=0.01),
+)
+@click.option("--polling", is_flag=True, help="Scan for new files even if inotify is available")
+@decorators.option_durability()
+# pylint: disable=too-many-arguments
+def watch(
+    environment_path, number_steps, jobs, debounce, poll_interval, polling,
+    durability,
+):
+    """
+    Mutate new files as they arrive in a given environment, until interrupted
+    """
+    environment = environment_path
+    if not isinstance(environment.backend, backends.LocalFileBackend):
+        raise click.UsageError("Only local environments can be watched")
+    if environment.backend.compression is not None:
+        # Files dropped into the environment would not be compressed
+        raise click.UsageError("Compressed environments cannot be watched")
+    environment.backend.set_durability(durability)
+    click.echo("Watching Magenta Rapids environment in ", nl=False)
+    click.secho(environment.backend.path, fg="green", bold=True)
+
+    def _on_batch(filenames):
+        click.echo(f"Mutated {len(filenames)} new file(s)")
+
+    def _on_error(filename, error):
+        click.secho(
+            f"Failed to process {filename}, left unprocessed: {error!r}",
+            fg="red", err=True,
+        )
+
+    watcher = watch_module.Watcher(
+        environment,
+        number_steps,
+        jobs=jobs,
+        debounce=debounce,
+        poll_interval=poll_interval,
+        polling=polling,
+        on_batch=_on_batch,
+        on_error=_on_error,
+    )
+    asyncio.run(watcher.run())
+    click.echo("Stopped watching")
+
+
+@cli.command()
+@decorators.option_valid_environment()
+@click.option("--host", help="Address to listen on", default="127.0.0.1")
+@click.option("--port", help="TCP port to listen on", default=8765, type=int)
+@click.option("--unix_socket", help="Listen on this Unix socket instead of TCP")
+@click.option(
+    "-j", "--jobs", help="Number of worker processes, 0 for one per CPU",
+    default=1, type=click.IntRange(min=0),
+)
+@click.option(
+    "--max_in_flight", type=click.IntRange(min=1),
+    help="Mutations run at once across connections, twice --jobs by default",
+)
+@click.option(
+    "--max_pipeline", default=16, type=click.IntRange(min=1),
+    help="Requests in progress per connection before it stops being read",
+)
+# pylint: disable=too-many-arguments
+def serve(
+    environment_path, host, port, unix_socket, jobs, max_in_flight, max_pipeline
+):
+    """
+    Serve mutations over HTTP with a given environment's mutator, until interrupted
+    """
+    environment = environment_path
+    click.echo("Serving mutations on ", nl=False)
+    click.secho(unix_socket or f"http://{host}:{port}", fg="green", bold=True)
+    mutation_server = server.MutationServer(
+        environment, jobs=jobs, max_in_flight=max_in_flight,
+        max_pipeline=max_pipeline,
+    )
+    asyncio.run(
+        mutation_server.serve_forever(host=host, port=port, unix_socket=unix_socket)
+    )
+    click.echo("Stopped serving")
+
+
+@cli.group(name="cache")
+def cache_group():
+    """
+    Manage the mutation result cache
+    """
+
+
+@cache_group.command()
+@click.option(
+    "--cache_dir", type=click.Path(file_okay=False),
+    help="Directory of the mutation result cache. "
+    "Defaults to $MAGENTA_RAPIDS_CACHE_DIR or ~/.cache/magenta_rapids",
+)
+@click.option(
+    "--max_mb", type=click.FloatRange(min=0),
+    help="Remove the least recently used results until at most this many MB remain",
+)
+@click.option(
+    "--max_age_days", type=click.FloatRange(min=0),
+    help="Remove results not used for this many days",
+)
+def prune(cache_dir, max_mb, max_age_days):
+    """
+    Remove old or least recently used results from the mutation result cache
+    """
+    cache_dir = cache_dir or cache_module.default_directory()
+    click.echo("Pruning mutation cache in ", nl=False)
+    click.secho(cache_dir, fg="green", bold=True)
+    summary = cache_module.prune(
+        cache_dir,
+        max_bytes=None if max_mb is None else int(max_mb * 1e6),
+        max_age=None if max_age_days is None else max_age_days * 86400,
+    )
+    click.echo(
+        f"Removed {summary.removed} result(s), {summary.removed_bytes} bytes; "
+        f"kept {summary.remaining} result(s), {summary.remaining_bytes} bytes"
+    )
+
+
+@cli.command(name="ls")
+@decorators.option_valid_environment()
+@click.option(
+    "--processed/--unprocessed", default=None,
+    help="Only list files which have (or have not) been processed",
+)
+@click.option("-l", "--limit", help="Maximum number of files to list", type=int)
+def list_files(environment_path, processed, limit):
+    """
+    List the files stored in a given environment
+    """
+    environment = environment_path
+    for row in environment.list_files(processed=processed, limit=limit):
+        click.secho(row["filename"], fg="green" if row["processed"] else None, nl=False)
+        click.echo(
+            f"  {row['size']} bytes"
+            f"  tracks={row['track_count']}"
+            f"  ticks_per_beat={row['ticks_per_beat']}"
+            f"  notes={row['note_count']}"
+        )
+
+
+@cli.command()
+@decorators.option_valid_environment()
+def stats(environment_path):
+    """
+    Summarize the files stored in a given environment
+    """
+    environment = environment_path
+    for name, value in environment.stats().items():
+        click.echo(f"{name}: ", nl=False)
+        click.secho(str(value), bold=True)
+
+
+@cli.command()
+@decorators.option_valid_environment()
+def reindex(environment_path):
+    """
+    Rebuild the catalog of a given environment from the files on disk
+    """
+    environment = environment_path
+    click.echo("Reindexing Magenta Rapids environment in ", nl=False)
+    click.secho(environment, fg="green", bold=True)
+    environment.reindex()
+
+
+@cli.command()
+@decorators.option_valid_environment()
+def compact(environment_path):
+    """
+    Reclaim the space taken by superseded files in a given pack environment
+    """
+    environment = environment_path
+    click.echo("Compacting Magenta Rapids environment in ", nl=False)
+    click.secho(environment, fg="green", bold=True)
+    sizes = environment.compact()
+    for name, size in (sizes or {}).items():
+        click.echo(f"{name}: {size['before']} -> {size['after']} bytes")
+
+
+@cli.command()
+@decorators.option_valid_environment()
+def fsck(environment_path):
+    """
+    Check the integrity of the files stored in a given environment
+    """
+    environment = environment_path
+    try:
+        problems = environment.fsck()
+    except NotImplementedError as error:
+        raise click.UsageError("This environment's backend cannot be checked") from error
+    for problem in problems:
+        click.secho(problem, fg="red")
+    if problems:
+        raise click.ClickException(f"Found {len(problems)} problem(s)")
+    click.secho("No problems found", fg="green")
 
 
 @cli.command()
 @click.option("-f", "--file", help="MIDI file to play", required=True)
-def play(file):
+@click.option("-p", "--port", help="Name of the MIDI output port to play to")
+@click.option(
+    "--measure", is_flag=True,
+    help="Play to an in-process mock port and report timing percentiles",
+)
+def play(file, port, measure):
     """
-    Mutate MIDI currently stored in Magenta Rapids format in a given environment
+    Play a MIDI file to a MIDI output port
     """
     click.echo("Playing ", nl=False)
     click.secho(file, fg="green", bold=True)
-    # pylint: disable=no-member
-    port = mido.open_output()
-    loaded_file = mido.MidiFile(file)
-    for msg in loaded_file.play():
-        port.send(msg)
+    schedule = playback.compile_schedule(mido.MidiFile(file))
+    if measure:
+        output = playback.MockPort()
+    else:
+        # pylint: disable=no-member
+        output = mido.open_output(port)
+    try:
+        report = playback.play(schedule, output)
+    finally:
+        if not measure:
+            output.close()
+    if measure:
+        for name, percentiles in report.summary().items():
+            click.echo(f"{name} (ms): ", nl=False)
+            click.echo(
+                "  ".join(
+                    f"{key}={value * 1000:.3f}"
+                    for key, value in percentiles.items()
+                )
+            )
@@ -0,0 +1,80 @@
+"""Compression of the files kept by backends. An environment is either
+uncompressed, or compresses every stored file and processed output with one
+of the standard library's codecs at a given level, as chosen when it is
+initialized. Files are always named, catalogued and handed to mutators by
+their uncompressed contents.
+
+Compression settings are written `codec:level`, for example `zlib:6` or
+`lzma:9`, or just `codec` for its default level.
+"""
+
+import lzma
+import typing as t
+import zlib
+from magenta_rapids import metrics
+
+NONE = "none"
+CODECS = ("zlib", "lzma")
+DEFAULT_LEVEL = 6
+LEVELS = range(0, 10)
+
+
+class Compression(t.NamedTuple):
+    codec: str
+    level: int = DEFAULT_LEVEL
+
+    def __str__(self):
+        return f"{self.codec}:{self.level}"
+
+    def compressor(self):
+        """Incremental compressor, with `compress` and `flush` methods."""
+        if self.codec == "zlib":
+            return zlib.compressobj(self.level)
+        return lzma.LZMACompressor(preset=self.level)
+
+    def compress(self, data: bytes) -> bytes:
+        with metrics.timer("compression.compress"):
+            compressor = self.compressor()
+            return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes) -> bytes:
+        """Raises `ValueError` if `data` was not compressed with this
+        codec, or is truncated.
+        """
+        with metrics.timer("compression.decompress"):
+            try:
+                if self.codec == "zlib":
+                    return zlib.decompress(data)
+                decompressor = lzma.LZMADecompressor()
+                result = decompressor.decompress(data)
+            except (zlib.error, lzma.LZMAError) as error:
+                raise ValueError(
+                    f"Cannot decompress {self.codec} data: {error}"
+                ) from error
+            if not decompressor.eof:
+                raise ValueError(f"Cannot decompress {self.codec} data: truncated")
+            return result
+
+
+def parse(value: t.Optional[str]) -> t.Optional[Compression]:
+    """The compression described by `value`, or `None` for `none`. Raises
+    `ValueError` if it describes neither.
+    """
+    if value is None or value == NONE:
+        return None
+    codec, separator, level = value.partition(":")
+    if codec not in CODECS:
+        raise ValueError(
+            f"Unknown codec {codec!r}, expected one of {', '.join(CODECS)}"
+        )
+    if not separator:
+        return Compression(codec)
+    try:
+        level = int(level)
+    except ValueError:
+        level = None
+    if level not in LEVELS:
+        raise ValueError(
+            f"Compression level must be between {LEVELS[0]} and {LEVELS[-1]}"
+        )
+    return Compression(codec, level)
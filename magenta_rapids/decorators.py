@@ -24,29 +24,19 @@ def _single_value_if_only_last_mutates(iterable):
     )
 
 
-def option_valid_midi_file(exists=True):
-    """Check that the given MIDI file either exists or does not exist, depending on
-    the value of the `exists` parameter. If `exists=True`, check that it does not
-    already exist in the environment. If `exists=False` check that it does exist
-    at the given location.
+def option_valid_midi_sources():
+    """Expand the given source into a list of MIDI files to store, and check
+    that each of them exists. The source may be a file, a directory, a glob
+    pattern or `-` for a newline-delimited list of paths on stdin.
     """
-    if exists:
-        help_text = "Absolute path to MIDI file to retrieve from environment."
-        def _callback(ctx, param, value):
-            return _single_value_if_only_last_mutates(
-                [
-                    validators.validate_file_exists_in_environment(ctx, param, value),
-                    validators.validate_file_does_not_exist_at_source(ctx, param, value),
-                ]
-            )
-    else:
-        help_text = "Absolute path to MIDI file to store in environment."
-        def _callback(ctx, param, value):
-            return _single_value_if_only_last_mutates(
-                [
-                    validators.validate_file_exists_at_source(ctx, param, value),
-                ]
-            )
+    help_text = (
+        "MIDI file, directory, glob pattern, or - to read paths from stdin, "
+        "to store in environment."
+    )
+    def _callback(ctx, param, value):
+        return _single_value_if_only_last_mutates(
+            [validators.validate_midi_sources_exist(ctx, param, value)]
+        )
 
     return click.option(
         "-f", "--file", help=help_text, required=True, callback=_callback
@@ -87,3 +77,30 @@ def option_valid_environment(exists=True):
     return click.option(
         "--environment_path", "-e", help=help_text, required=True, callback=_callback
     )
+
+
+def option_shard_depth():
+    """Number of hash-prefix directory levels used to lay out files in the
+    environment. Large environments should use a depth of 1 or 2 to keep
+    directories small.
+    """
+    return click.option(
+        "--shard_depth",
+        help="Number of hash-prefix directory levels, 0 for a flat layout.",
+        default=0,
+        type=click.IntRange(min=0, max=20),
+    )
+
+
+def option_durability():
+    """When writes to the environment are flushed to stable storage, see
+    `magenta_rapids.durability`. Writes are atomic under every policy.
+    """
+    return click.option(
+        "--durability",
+        help="Flush writes to stable storage never (none), after every file "
+        "(file), or once per group of N files (group[:N])",
+        default="none",
+        metavar="none|file|group[:N]",
+        callback=validators.validate_durability,
+    )
@@ -0,0 +1,145 @@
+"""Durability of the files written by the backends keeping an environment in
+a local directory. Files are written to a temporary file which is renamed
+over their destination, or appended to, so a crashed process never leaves
+one truncated. The durability policy decides when writes are also flushed to
+stable storage with `fsync`, to survive a power loss or a kernel crash:
+
+- `none`: never, leaving it to the operating system
+- `file`: every file and the directory entry naming it, before the write
+  returns
+- `group[:N]`: every N files at once, with one fsync of each directory
+  they are in, and whatever is pending when the backend is flushed. The
+  last files written before a power loss may be lost, but the cost of the
+  fsyncs is shared by the whole group.
+
+Policies are written `none`, `file`, `group` for groups of
+`DEFAULT_GROUP_SIZE` files, or `group:N`.
+"""
+
+import os
+import threading
+import typing as t
+from magenta_rapids import metrics
+
+NONE = "none"
+FILE = "file"
+GROUP = "group"
+POLICIES = (NONE, FILE, GROUP)
+DEFAULT_GROUP_SIZE = 64
+
+
+class Durability(t.NamedTuple):
+    policy: str = NONE
+    group_size: int = DEFAULT_GROUP_SIZE
+
+    def __str__(self):
+        if self.policy == GROUP:
+            return f"{self.policy}:{self.group_size}"
+        return self.policy
+
+
+def parse(value: t.Optional[str]) -> Durability:
+    """The durability policy described by `value`, `none` if it is `None`.
+    Raises `ValueError` if it describes none.
+    """
+    if value is None:
+        return Durability()
+    policy, separator, group_size = value.partition(":")
+    if policy not in POLICIES:
+        raise ValueError(
+            f"Unknown durability policy {policy!r}, expected one of "
+            f"{', '.join(POLICIES)}"
+        )
+    if not separator:
+        return Durability(policy)
+    if policy != GROUP:
+        raise ValueError(f"Only the {GROUP} policy takes a number of files")
+    if not group_size.isdigit() or int(group_size) < 1:
+        raise ValueError(
+            f"Invalid group size {group_size!r}, expected a positive integer"
+        )
+    return Durability(policy, int(group_size))
+
+
+def fsync_path(path: str):
+    """Flush the file or directory at `path` to stable storage."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        with metrics.timer("durability.fsync"):
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    metrics.count("durability.fsyncs")
+
+
+def _sync(paths: t.Iterable[str]):
+    """Flush every one of `paths`, then once each directory holding them."""
+    paths = list(paths)
+    for path in paths:
+        try:
+            fsync_path(path)
+        except FileNotFoundError:
+            # Replaced or removed since, leaving nothing of it to flush
+            pass
+    for directory in dict.fromkeys(map(os.path.dirname, paths)):
+        fsync_path(directory)
+
+
+class Syncer:
+    """Applies a durability policy to the files a backend writes. Safe to
+    use from several threads.
+    """
+
+    def __init__(self, durability: Durability = Durability()):
+        self.durability = durability
+        self._lock = threading.Lock()
+        self._pending: t.Dict[str, None] = {}
+        self._files = 0
+
+    def before_rename(self, file_obj: t.BinaryIO):
+        """Called with the complete temporary file of a write, before it is
+        renamed into place.
+        """
+        if self.durability.policy == FILE:
+            file_obj.flush()
+            with metrics.timer("durability.fsync"):
+                os.fsync(file_obj.fileno())
+            metrics.count("durability.fsyncs")
+
+    def renamed(self, path: str):
+        """Called once a temporary file was renamed to `path`."""
+        if self.durability.policy == FILE:
+            fsync_path(os.path.dirname(path))
+        elif self.durability.policy == GROUP:
+            self._add([path])
+
+    def appended(self, *paths: str):
+        """Called once one file was written by appending to `paths`."""
+        if self.durability.policy == FILE:
+            _sync(paths)
+        elif self.durability.policy == GROUP:
+            self._add(paths)
+
+    def _add(self, paths: t.Iterable[str]):
+        with self._lock:
+            self._pending.update(dict.fromkeys(paths))
+            self._files += 1
+            if self._files < self.durability.group_size:
+                return
+            batch = self._take()
+        _sync(batch)
+
+    def _take(self) -> t.List[str]:
+        """Pending paths, with the lock held, leaving none pending."""
+        batch = list(self._pending)
+        self._pending.clear()
+        self._files = 0
+        if batch:
+            metrics.count("durability.group_syncs")
+        return batch
+
+    def flush(self):
+        """Flush the files of a group that is not yet complete."""
+        with self._lock:
+            batch = self._take()
+        _sync(batch)
@@ -5,15 +5,92 @@ on initialization, and the environment will call the appropriate methods
 on the backend and mutator when necessary.
 """
 
+import concurrent.futures
+import hashlib
+import io
+import os
 import typing as t
+from magenta_rapids import cache, metrics, sidecar
+from magenta_rapids.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+
+class StoreSummary(t.NamedTuple):
+    """Outcome of storing a batch of files. `stored` maps each stored path to
+    its location in the environment, and `duplicates` maps each skipped path
+    to the SHA1 it shares with an earlier file in the batch or a file already
+    in the environment.
+    """
+
+    stored: t.Dict[str, str]
+    duplicates: t.Dict[str, str]
+
+
+def _mutate_bytes(mutator, data: bytes, number_steps: int) -> bytes:
+    """Mutate the raw bytes of a MIDI file. This is the unit of work sent to
+    worker processes, so it only takes and returns picklable values.
+    """
+    return mutator.mutate(io.BytesIO(data), number_steps).read()
+
+
+def _mutate_source(
+    mutator, source_path: t.Optional[str], data: t.Optional[bytes],
+    number_steps: int,
+) -> bytes:
+    """Mutate a MIDI file given either the local path of a file with a
+    sidecar or its raw bytes. Sidecars which went stale since they were
+    checked fall back to reading the file.
+    """
+    if source_path is None:
+        return _mutate_bytes(mutator, data, number_steps)
+    try:
+        with metrics.timer("sidecar.load"):
+            decoded = sidecar.load(source_path)
+    except sidecar.SidecarError:
+        with open(source_path, "rb") as file_obj:
+            return _mutate_bytes(mutator, file_obj.read(), number_steps)
+    return mutator.mutate_decoded(decoded, number_steps).read()
+
+
+def _mutate_source_with_metrics(*args) -> t.Tuple[bytes, dict]:
+    """`_mutate_source` for worker processes, also returning the metrics
+    recorded while mutating so the parent can merge them.
+    """
+    metrics.reset()
+    metrics.enable()
+    return _mutate_source(*args), metrics.snapshot()
 
 
 class Environment:
-    """A standard Magenta Rapids environment"""
+    """A standard Magenta Rapids environment. Given a `mutation_cache`,
+    `mutate` reuses the results it holds and adds new ones to it.
+    """
 
-    def __init__(self, backend, mutator):
+    def __init__(self, backend, mutator, mutation_cache=None):
         self._backend = backend
         self._mutator = mutator
+        self._cache = mutation_cache
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def mutator(self):
+        return self._mutator
+
+    @mutator.setter
+    def mutator(self, mutator):
+        self._mutator = mutator
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @cache.setter
+    def cache(self, mutation_cache):
+        self._cache = mutation_cache
 
     def initialize(self):
         self._backend.initialize()
@@ -21,10 +98,233 @@ class Environment:
     def store(self, file_object: t.BinaryIO, extension="mid"):
         return self._backend.store(file_object, extension)
 
-    async def mutate(self, number_steps):
-        mutated = {}
-        gen = self._backend.retrieve_all()
-        async for (file, filename) in gen:
-            mutated[filename] = self._mutator.mutate(file, number_steps)
-        for filename, file in mutated.items():
-            self._backend.save(file, filename)
+    def migrate(self, shard_depth: int):
+        self._backend.migrate(shard_depth)
+
+    def reindex(self):
+        self._backend.reindex()
+
+    def compact(self):
+        return self._backend.compact()
+
+    def fsck(self) -> t.List[str]:
+        return self._backend.fsck()
+
+    def list_files(self, processed=None, limit=None) -> t.List[dict]:
+        return self._backend.list_files(processed=processed, limit=limit)
+
+    def stats(self) -> dict:
+        return self._backend.stats()
+
+    def store_many(self, paths: t.Iterable[str], jobs=8) -> StoreSummary:
+        """Store a batch of files using a pool of `jobs` threads, reading each
+        file once. Duplicates within the batch or of files already in the
+        environment are rejected by the backend as they are stored, and
+        reported in the summary instead of raising. Of identical files in the
+        batch, the first is reported as stored.
+        """
+
+        def _store(path):
+            with open(path, "rb") as file_obj:
+                try:
+                    return self._backend.store(file_obj), None
+                except ValueError:
+                    # Only duplicates are hashed again, to report them
+                    file_obj.seek(os.SEEK_SET)
+                    digest = hashlib.file_digest(file_obj, "sha1").hexdigest()
+                    if not self._backend.contains(digest):
+                        raise
+                    return None, digest
+
+        paths = list(paths)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_store, paths))
+        # Stored files are named after their hash
+        digests = [
+            digest or os.path.basename(target).split(".", 1)[0]
+            for target, digest in results
+        ]
+        targets = {
+            digest: target
+            for (target, _), digest in zip(results, digests)
+            if target is not None
+        }
+        stored = {}
+        duplicates = {}
+        for path, digest in zip(paths, digests):
+            if digest in targets:
+                stored[path] = targets.pop(digest)
+            else:
+                duplicates[path] = digest
+        self._backend.flush()
+        return StoreSummary(stored=stored, duplicates=duplicates)
+
+    async def mutate_data(
+        self, data: bytes, number_steps: int, executor=None
+    ) -> bytes:
+        """Mutate the bytes of a single MIDI file which is not stored in the
+        environment, in `executor` or else in a thread, without blocking
+        the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, _mutate_bytes, self._mutator, data, number_steps
+        )
+
+    def _mutation_key(self, filename, number_steps) -> dict:
+        return {
+            "source": self._backend.source_digest(filename),
+            "mutator": self._mutator.identity,
+            "number_steps": number_steps,
+        }
+
+    # pylint: disable=too-many-arguments
+    async def mutate(
+        self, number_steps, jobs=1, read_queue_depth=8, write_queue_depth=8,
+        force=False, filenames=None, executor=None,
+    ):
+        """Mutate every file in the backend, or only `filenames`, through a
+        streaming pipeline. A reader stage feeds file contents into a
+        bounded queue, mutation workers drain it into a second bounded
+        queue, and a writer stage saves results while later files are still
+        being mutated, so at most roughly
+        `read_queue_depth + jobs + write_queue_depth` files are held in
+        memory at once. Files with a sidecar are loaded from it by the
+        workers instead of being parsed. With `jobs` greater than one the
+        mutations run in a pool of that many worker processes; `jobs=0`
+        uses one per CPU. An existing process pool may be passed as
+        `executor` to reuse it across calls, in which case it is left
+        running.
+
+        Files whose processed output the backend records as produced from
+        the same source, mutator and number of steps are skipped unless
+        `force` is set.
+        """
+        jobs = jobs or os.cpu_count()
+        read_queue = asyncio.Queue(maxsize=read_queue_depth)
+        write_queue = asyncio.Queue(maxsize=write_queue_depth)
+        owns_executor = executor is None and jobs > 1
+        if owns_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(
+                    self._read_stage(
+                        read_queue, number_steps, jobs, force, filenames
+                    )
+                )
+                group.create_task(
+                    self._mutate_stage(
+                        read_queue, write_queue, number_steps, jobs, executor
+                    )
+                )
+                group.create_task(self._write_stage(write_queue))
+        finally:
+            if owns_executor:
+                executor.shutdown(cancel_futures=True)
+            self._backend.flush()
+
+    # pylint: disable=too-many-arguments
+    async def _read_stage(
+        self, read_queue, number_steps, number_workers, force, filenames
+    ):
+        keys = {}
+        sources = {}
+        cached = {}
+
+        def _is_up_to_date(filename):
+            key = keys[filename] = self._mutation_key(filename, number_steps)
+            if not force and self._backend.is_up_to_date(filename, key):
+                metrics.count("environment.files_up_to_date")
+                return True
+            # Called in the backend's I/O pool, so the cache and sidecars are
+            # checked, and sidecars rebuilt, off the event loop. Forced runs
+            # mutate every file again rather than trust earlier results.
+            if self._cache is not None and not force:
+                result = self._cache.get(
+                    cache.cache_key(
+                        key["source"], key["mutator"], key["number_steps"]
+                    )
+                )
+                if result is not None:
+                    cached[filename] = result
+                    sources[filename] = None
+                    return False
+            sources[filename] = self._backend.sidecar_source(filename)
+            return False
+
+        def _needs_contents(filename):
+            # Files with a sidecar or a cached result are not read
+            return sources.get(filename) is None and filename not in cached
+
+        async for (file, filename) in self._backend.retrieve_all(
+            exclude=_is_up_to_date, filenames=filenames,
+            needs_contents=_needs_contents,
+        ):
+            source = sources.pop(filename)
+            result = cached.pop(filename, None)
+            await read_queue.put(
+                (
+                    filename,
+                    keys.pop(filename),
+                    source,
+                    None if source is not None or result is not None
+                    else file.read(),
+                    result,
+                )
+            )
+        for _ in range(number_workers):
+            await read_queue.put(None)
+
+    async def _mutate_stage(
+        self, read_queue, write_queue, number_steps, number_workers, executor
+    ):
+        loop = asyncio.get_running_loop()
+
+        async def _worker():
+            while (item := await read_queue.get()) is not None:
+                filename, key, source, data, result = item
+                if result is not None:
+                    metrics.count("environment.files_from_cache")
+                    await write_queue.put((filename, key, result))
+                    continue
+                with metrics.timer("environment.mutate_file"):
+                    if executor is None:
+                        # Off the event loop, which keeps reading and writing
+                        result = await asyncio.to_thread(
+                            _mutate_source, self._mutator, source, data,
+                            number_steps,
+                        )
+                    elif metrics.enabled():
+                        result, recorded = await loop.run_in_executor(
+                            executor, _mutate_source_with_metrics,
+                            self._mutator, source, data, number_steps,
+                        )
+                        metrics.merge(recorded)
+                    else:
+                        result = await loop.run_in_executor(
+                            executor, _mutate_source, self._mutator, source,
+                            data, number_steps,
+                        )
+                metrics.count("environment.files_mutated")
+                if self._cache is not None:
+                    await asyncio.to_thread(
+                        self._cache.put,
+                        cache.cache_key(
+                            key["source"], key["mutator"], key["number_steps"]
+                        ),
+                        result,
+                    )
+                await write_queue.put((filename, key, result))
+
+        async with asyncio.TaskGroup() as group:
+            for _ in range(number_workers):
+                group.create_task(_worker())
+        await write_queue.put(None)
+
+    async def _write_stage(self, write_queue):
+        while (item := await write_queue.get()) is not None:
+            filename, key, result = item
+            metrics.count("environment.bytes_written", len(result))
+            await self._backend.save_async(io.BytesIO(result), filename)
+            self._backend.mark_up_to_date(filename, key)
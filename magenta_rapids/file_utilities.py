@@ -1,7 +1,12 @@
 """Helper functions for file and directory operations
 """
 
+import glob
 import os
+import typing as t
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+OBJECT_STORAGE_SCHEMES = ("s3://",)
 
 
 def check_is_empty_dir(directory: str):
@@ -10,3 +15,32 @@ def check_is_empty_dir(directory: str):
         if len(files) > 0 or len(directories) > 0:
             return False
     return True
+
+
+def is_object_storage_url(path: str) -> bool:
+    """Whether an environment path names a location in object storage
+    rather than a local directory.
+    """
+    return path.startswith(OBJECT_STORAGE_SCHEMES)
+
+
+def expand_midi_sources(source: str, stdin: t.TextIO) -> t.List[str]:
+    """Expand a source given on the command line into a list of file paths.
+    The source may be a single file, a directory which is searched
+    recursively for MIDI files, a glob pattern, or `-` to read one path per
+    line from `stdin`.
+    """
+    if source == "-":
+        return [line.strip() for line in stdin if line.strip()]
+    if os.path.isfile(source):
+        return [source]
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(source)
+            for filename in filenames
+            if filename.lower().endswith(MIDI_EXTENSIONS)
+        )
+    return sorted(
+        path for path in glob.glob(source, recursive=True) if os.path.isfile(path)
+    )
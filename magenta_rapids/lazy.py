@@ -0,0 +1,64 @@
+"""Deferred imports, keeping CLI startup fast. Modules which are expensive
+to import and only used by some commands, such as `mido`, `numpy` and
+`asyncio`, are bound with `lazy_import` instead of `import`: the name is
+available at module level as usual, but the module is only executed on
+first attribute access.
+
+Unlike `importlib.util.LazyLoader` before Python 3.12, the first access may
+come from any thread: the module is executed once, and other threads wait
+until it is complete rather than seeing it partially executed.
+"""
+
+import importlib.util
+import sys
+import threading
+import types
+
+
+class _LazyModule(types.ModuleType):
+    """Module executed on first attribute access."""
+
+    def __getattribute__(self, attribute):
+        _load(self)
+        return object.__getattribute__(self, attribute)
+
+    def __setattr__(self, attribute, value):
+        _load(self)
+        object.__setattr__(self, attribute, value)
+
+    def __delattr__(self, attribute):
+        _load(self)
+        object.__delattr__(self, attribute)
+
+
+def _load(module: types.ModuleType):
+    spec = object.__getattribute__(module, "__spec__")
+    state = spec.loader_state
+    with state["lock"]:
+        # Accesses from the module's own execution, which holds the lock,
+        # see it as it is so far, as with a regular import
+        if state["loading"]:
+            return
+        state["loading"] = True
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            state["loading"] = False
+            raise
+        object.__setattr__(module, "__class__", types.ModuleType)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Module `name`, executed on first attribute access. Modules already
+    imported are returned as is.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader_state = {"lock": threading.RLock(), "loading": False}
+    module = importlib.util.module_from_spec(spec)
+    module.__class__ = _LazyModule
+    sys.modules[name] = module
+    return module
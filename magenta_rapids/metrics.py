@@ -0,0 +1,173 @@
+"""Per-stage timers and counters for Magenta Rapids. Instrumented code wraps
+each stage in `timer(stage)` and reports quantities with `count(name, n)`.
+Both are no-ops until `enable` is called, so instrumentation costs a single
+flag check when metrics are off.
+
+Every timed stage keeps one sample per call, normally one per file, from
+which `summary` derives totals, percentiles and a histogram. Worker
+processes collect into their own registry; `snapshot` and `merge` move
+their samples into the parent's.
+"""
+
+import bisect
+import collections
+import contextlib
+import threading
+import time
+import typing as t
+from magenta_rapids.lazy import lazy_import
+
+statistics = lazy_import("statistics")
+
+# Upper bounds, in seconds, of the histogram buckets of each stage
+HISTOGRAM_BOUNDS = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+
+_enabled = False  # pylint: disable=invalid-name
+_lock = threading.Lock()
+_samples: t.Dict[str, t.List[float]] = collections.defaultdict(list)
+_counters: t.Counter[str] = collections.Counter()
+
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+    __slots__ = ("_stage", "_start")
+
+    def __init__(self, stage: str):
+        self._stage = stage
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start
+        with _lock:
+            _samples[self._stage].append(elapsed)
+
+
+def enable():
+    # pylint: disable=global-statement
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    # pylint: disable=global-statement
+    global _enabled
+    _enabled = False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _counters.clear()
+
+
+def timer(stage: str):
+    """Context manager timing one call of `stage`."""
+    return _Timer(stage) if _enabled else _NULL_TIMER
+
+
+def timed_iter(stage: str, iterable: t.Iterable) -> t.Iterable:
+    """Iterate over `iterable`, timing the production of each item as one
+    call of `stage`. Useful for generators doing I/O, such as `os.walk`.
+    """
+    if not _enabled:
+        return iterable
+    return _timed_iter(stage, iter(iterable))
+
+
+def _timed_iter(stage: str, iterator: t.Iterator) -> t.Iterator:
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        elapsed = time.perf_counter() - start
+        with _lock:
+            _samples[stage].append(elapsed)
+        yield item
+
+
+def count(name: str, amount: int = 1):
+    if _enabled:
+        with _lock:
+            _counters[name] += amount
+
+
+def snapshot() -> dict:
+    """Picklable copy of everything recorded so far."""
+    with _lock:
+        return {
+            "samples": {stage: list(values) for stage, values in _samples.items()},
+            "counters": dict(_counters),
+        }
+
+
+def merge(recorded: dict):
+    """Add a `snapshot`, typically taken in a worker process."""
+    with _lock:
+        for stage, values in recorded["samples"].items():
+            _samples[stage].extend(values)
+        _counters.update(recorded["counters"])
+
+
+def _describe(values: t.List[float]) -> dict:
+    ordered = sorted(values)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = ordered[0]
+    histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for value in ordered:
+        histogram[bisect.bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+    labels = [f"<={bound:g}s" for bound in HISTOGRAM_BOUNDS]
+    labels.append(f">{HISTOGRAM_BOUNDS[-1]:g}s")
+    return {
+        "count": len(ordered),
+        "total_s": sum(ordered),
+        "mean_s": sum(ordered) / len(ordered),
+        "min_s": ordered[0],
+        "p50_s": p50,
+        "p90_s": p90,
+        "p99_s": p99,
+        "max_s": ordered[-1],
+        "histogram": dict(zip(labels, histogram)),
+    }
+
+
+def summary() -> dict:
+    """Totals, percentiles and histogram of every stage, and the counters."""
+    recorded = snapshot()
+    return {
+        "stages": {
+            stage: _describe(values)
+            for stage, values in sorted(recorded["samples"].items())
+            if values
+        },
+        "counters": dict(sorted(recorded["counters"].items())),
+    }
+
+
+def format_summary(described: dict) -> str:
+    lines = [
+        f"{'stage':<28}{'count':>9}{'total s':>11}{'mean ms':>10}"
+        f"{'p50 ms':>10}{'p99 ms':>10}"
+    ]
+    for stage, row in described["stages"].items():
+        lines.append(
+            f"{stage:<28}{row['count']:>9}{row['total_s']:>11.3f}"
+            f"{row['mean_s'] * 1000:>10.3f}{row['p50_s'] * 1000:>10.3f}"
+            f"{row['p99_s'] * 1000:>10.3f}"
+        )
+    for name, value in described["counters"].items():
+        lines.append(f"{name:<28}{value:>9}")
+    return "\n".join(lines)
@@ -1,17 +1,33 @@
 """Mutator classes for Magenta Rapids. A mutator is responsible for
 mutating a MIDI bytestream, and must implement the `mutate` method. `mutate`
 must return a bytestream containing the mutated MIDI messages.
+
+The mutators in this module only alter the delta-times of note events. They
+decode files with the `smf` codec, which leaves every other event untouched,
+and fall back to a full `mido` decode for files the codec rejects. A
+`PipelineMutator` chains several of them over a single decode and encode.
 """
 
 import abc
+import array
+import functools
 import io
 import os
 import typing as t
-import mido
+from magenta_rapids import metrics, smf
+from magenta_rapids.lazy import lazy_import
+
+mido = lazy_import("mido")
+np = lazy_import("numpy")
 
 
 # pylint: disable=too-few-public-methods
 class AbstractMutator(abc.ABC):
+    # Part of the identity. Increase it whenever a change to a mutator
+    # changes its outputs, so that outputs recorded or cached before the
+    # change are not reused.
+    VERSION = 1
+
     @abc.abstractmethod
     def __init__(self, *args, **kwargs):
         raise NotImplementedError
@@ -20,39 +36,371 @@ class AbstractMutator(abc.ABC):
     def mutate(self, file_object: t.BinaryIO, number_steps: int) -> t.BinaryIO:
         raise NotImplementedError
 
+    def mutate_decoded(self, decoded: smf.SMF, number_steps: int) -> t.BinaryIO:
+        """Mutate a file already decoded with the `smf` codec, such as one
+        loaded from a sidecar. Mutators which work on the decoded columns
+        should override this to skip re-encoding and parsing the file.
+        """
+        return self.mutate(io.BytesIO(smf.encode(decoded)), number_steps)
+
+    @property
+    def identity(self) -> str:
+        """Name and version identifying the transform applied by this
+        mutator. Outputs produced by mutators with the same identity are
+        interchangeable.
+        """
+        return f"{type(self).__module__}.{type(self).__qualname__}@{self.VERSION}"
+
+
+# Per-note constants of the `SimpleMutator` formula, `60 / note**2` and
+# `note**1.9`, computed once with Python scalar arithmetic so that every
+# mutator uses bit-identical values. Note 0 has no scale; `SimpleMutator`
+# raises `ZeroDivisionError` for it.
+NOTE_SCALES = (None,) + tuple(60 / note**2 for note in range(1, 128))
+NOTE_POWERS = tuple(note**1.9 for note in range(128))
+
+
+
+@functools.cache
+def _note_arrays():
+    """`NOTE_SCALES`, with 0 for note 0, and `NOTE_POWERS` as arrays."""
+    return np.array((0.0,) + NOTE_SCALES[1:]), np.array(NOTE_POWERS)
+
+
+# Relative distance to the nearest integer under which a vectorized result
+# is recomputed with scalar arithmetic before truncation. `np.power` may
+# differ from the C `pow` used by Python floats in the last few bits, which
+# only matters when it moves a value across an integer boundary.
+_TRUNCATION_TOLERANCE = 1e-9
+
+_INT64_LIMIT = float(2**63)
+
+
+class EventMutator(AbstractMutator):
+    """Base class for mutators which transform the events of a decoded file.
+    `mutate` decodes the file once, with the `smf` codec or else `mido`,
+    hands it to `_alter_decoded` or `_alter_mido`, and encodes it once.
+    """
+
+    @abc.abstractmethod
+    def _alter_decoded(self, decoded: smf.SMF, number_steps: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def _alter_mido(self, file: "mido.MidiFile", number_steps: int):
+        raise NotImplementedError
+
+    def _mutate_with_mido(
+        self, file_object: t.BinaryIO, number_steps: int
+    ) -> t.BinaryIO:
+        metrics.count("mutator.mido_fallbacks")
+        with metrics.timer("mutator.mido_parse"):
+            file = mido.MidiFile(file=file_object)
+        with metrics.timer("mutator.alter"):
+            self._alter_mido(file, number_steps)
+        new_file_object = t.cast(t.BinaryIO, io.BytesIO())
+        with metrics.timer("mutator.mido_save"):
+            file.save(file=new_file_object)
+        new_file_object.seek(os.SEEK_SET)
+        return new_file_object
+
+    def mutate(self, file_object: t.BinaryIO, number_steps: int) -> t.BinaryIO:
+        file_object.seek(os.SEEK_SET)
+        data = file_object.read()
+        file_object.seek(os.SEEK_SET)
+        try:
+            with metrics.timer("mutator.decode"):
+                decoded = smf.decode(data)
+        except smf.SMFError:
+            return self._mutate_with_mido(io.BytesIO(data), number_steps)
+        return self.mutate_decoded(decoded, number_steps)
+
+    def mutate_decoded(self, decoded: smf.SMF, number_steps: int) -> t.BinaryIO:
+        with metrics.timer("mutator.alter"):
+            self._alter_decoded(decoded, number_steps)
+        with metrics.timer("mutator.encode"):
+            encoded = smf.encode(decoded)
+        new_file_object = t.cast(t.BinaryIO, io.BytesIO(encoded))
+        return new_file_object
+
+
+class NoteTimeMutator(EventMutator):
+    """Base class for mutators which rewrite the times of `note_on` and
+    `note_off` events from their type, note and time. Subclasses implement
+    `_alter_times` for the note events of one track, and may override
+    `_alter_track` to work on the decoded columns directly.
+    """
+
+    @abc.abstractmethod
+    def _alter_times(
+        self,
+        note_offs: t.Sequence[bool],
+        notes: t.Sequence[int],
+        times: t.Sequence[int],
+        number_steps: int,
+    ) -> t.List[int]:
+        raise NotImplementedError
+
+    def _alter_track(self, track: smf.Track, number_steps: int):
+        indices = track.note_indices
+        times = self._alter_times(
+            [track.statuses[idx] & 0xF0 == smf.NOTE_OFF for idx in indices],
+            [track.notes[idx] for idx in indices],
+            [track.deltas[idx] for idx in indices],
+            number_steps,
+        )
+        track.set_deltas(indices, times)
+
+    def _alter_decoded(self, decoded: smf.SMF, number_steps: int):
+        for track in decoded.tracks:
+            if track.note_indices:
+                metrics.count("mutator.note_events", len(track.note_indices))
+                self._alter_track(track, number_steps)
+
+    def _alter_mido(self, file: "mido.MidiFile", number_steps: int):
+        for track in file.tracks:
+            indices = [
+                idx
+                for idx, message in enumerate(track)
+                if message.type in ("note_on", "note_off")
+            ]
+            metrics.count("mutator.note_events", len(indices))
+            times = self._alter_times(
+                [track[idx].type == "note_off" for idx in indices],
+                [track[idx].note for idx in indices],
+                [track[idx].time for idx in indices],
+                number_steps,
+            )
+            for idx, time in zip(indices, times):
+                track[idx] = track[idx].copy(time=time)
+
 
 # pylint: disable=too-few-public-methods
-class SimpleMutator(AbstractMutator):
+class SimpleMutator(NoteTimeMutator):
     def __init__(self, *args, **kwargs):
         pass
 
-    def __alter_note(self, message: mido.Message) -> mido.Message:
-        if message.type == "note_off":
+    def __alter_note(self, note_off: bool, note: int, time: int) -> int:
+        if note_off:
             note_off_delay = 50
         else:
             note_off_delay = 0
-        return message.copy(
-            time=int(
-                message.time
-                + note_off_delay
-                + (
-                    (60 / message.note**2)
-                    * (message.time**1.1 + message.note**1.9)
+        return int(
+            time
+            + note_off_delay
+            + ((60 / note**2) * (time**1.1 + note**1.9))
+        )
+
+    def _alter_times(self, note_offs, notes, times, number_steps):
+        altered = []
+        for note_off, note, time in zip(note_offs, notes, times):
+            for _ in range(number_steps):
+                time = self.__alter_note(note_off, note, time)
+            altered.append(time)
+        return altered
+
+
+# pylint: disable=too-few-public-methods
+class VectorizedMutator(NoteTimeMutator):
+    """Array-based equivalent of `SimpleMutator`. The times and notes of all
+    note events in a track are gathered into arrays, every step is applied
+    to the whole track at once, and only the final times are written back.
+    The output is byte-for-byte identical to `SimpleMutator`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @staticmethod
+    def _scalar_step(time: int, note: int, delay: int) -> int:
+        return int(
+            time + delay + ((60 / note**2) * (time**1.1 + note**1.9))
+        )
+
+    def _alter_array(
+        self, times: "np.ndarray", notes: "np.ndarray", delays: "np.ndarray",
+        number_steps: int,
+    ) -> "np.ndarray":
+        if number_steps > 0 and not notes.all():
+            raise ZeroDivisionError("division by zero")
+        note_scales, note_powers = _note_arrays()
+        scales = note_scales[notes]
+        powers = note_powers[notes]
+        for _ in range(number_steps):
+            altered = times + delays + scales * (np.power(times, 1.1) + powers)
+            if not np.isfinite(altered).all():
+                raise OverflowError("note time out of range")
+            distance = np.abs(altered - np.rint(altered))
+            for idx in np.flatnonzero(
+                distance <= _TRUNCATION_TOLERANCE * np.maximum(altered, 1.0)
+            ):
+                altered[idx] = self._scalar_step(
+                    int(times[idx]), int(notes[idx]), int(delays[idx])
                 )
+            times = np.trunc(altered)
+        return times
+
+    def _alter_times(self, note_offs, notes, times, number_steps):
+        altered = self._alter_array(
+            np.array(times, dtype=float),
+            np.array(notes, dtype=np.intp),
+            np.where(np.array(note_offs, dtype=bool), 50.0, 0.0),
+            number_steps,
+        )
+        return [int(time) for time in altered.tolist()]
+
+    def _alter_track(self, track: smf.Track, number_steps: int):
+        if not isinstance(track.deltas, array.array):
+            super()._alter_track(track, number_steps)
+            return
+        indices = np.frombuffer(track.note_indices, dtype=np.int64)
+        deltas = np.frombuffer(track.deltas, dtype=np.int64)
+        statuses = np.frombuffer(track.statuses, dtype=np.uint8)[indices]
+        altered = self._alter_array(
+            deltas[indices].astype(float),
+            np.frombuffer(track.notes, dtype=np.uint8)[indices].astype(np.intp),
+            np.where(statuses & 0xF0 == smf.NOTE_OFF, 50.0, 0.0),
+            number_steps,
+        )
+        if altered.max() < _INT64_LIMIT:
+            deltas[indices] = altered.astype(np.int64)
+        else:
+            track.set_deltas(
+                indices.tolist(), [int(time) for time in altered.tolist()]
             )
+
+
+# pylint: disable=too-few-public-methods
+class MemoizedMutator(NoteTimeMutator):
+    """Equivalent of `SimpleMutator` which memoizes the whole multi-step
+    transform of a note event. The result only depends on the event type,
+    note, time and number of steps, so a repeated event costs a single
+    lookup in a bounded LRU cache. `cache_info` exposes the hit and miss
+    counters of the cache.
+    """
+
+    DEFAULT_CACHE_SIZE = 2**16
+
+    def __init__(self, *args, cache_size: int = DEFAULT_CACHE_SIZE, **kwargs):
+        self._cache_size = cache_size
+        self._alter_time = functools.lru_cache(maxsize=cache_size)(
+            self._compute_time
         )
 
-    def mutate(self, file_object: t.BinaryIO, number_steps: int) -> t.BinaryIO:
-        file_object.seek(os.SEEK_SET)
-        file = mido.MidiFile(file=file_object)
-        file_object.seek(os.SEEK_SET)
-        for track in file.tracks:
-            for idx, message in enumerate(track):
-                if message.type in ("note_on", "note_off"):
-                    for _ in range(number_steps):
-                        message = self.__alter_note(message)
-                    track[idx] = message
-        new_file_object = t.cast(t.BinaryIO, io.BytesIO())
-        file.save(file=new_file_object)
-        new_file_object.seek(os.SEEK_SET)
-        return new_file_object
+    def __getstate__(self):
+        # The cache is not picklable, workers start with an empty one
+        return {"_cache_size": self._cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(cache_size=state["_cache_size"])
+
+    @staticmethod
+    def _compute_time(
+        note_off: bool, note: int, time: int, number_steps: int
+    ) -> int:
+        if number_steps == 0:
+            return time
+        scale = NOTE_SCALES[note]
+        if scale is None:
+            raise ZeroDivisionError("division by zero")
+        power = NOTE_POWERS[note]
+        note_off_delay = 50 if note_off else 0
+        for _ in range(number_steps):
+            time = int(time + note_off_delay + (scale * (time**1.1 + power)))
+        return time
+
+    def cache_info(self):
+        return self._alter_time.cache_info()
+
+    def cache_clear(self):
+        self._alter_time.cache_clear()
+
+    def _alter_times(self, note_offs, notes, times, number_steps):
+        return [
+            self._alter_time(note_off, note, time, number_steps)
+            for note_off, note, time in zip(note_offs, notes, times)
+        ]
+
+
+class PipelineStage(t.NamedTuple):
+    """One transform of a `PipelineMutator`, run for `number_steps` steps,
+    or for the number of steps the pipeline is run with when `None`.
+    """
+
+    mutator: EventMutator
+    number_steps: t.Optional[int] = None
+
+
+# pylint: disable=too-few-public-methods
+class PipelineMutator(EventMutator):
+    """Runs several event-level mutators in sequence over a single decode
+    and encode of the file, rather than one of each per mutator. The output
+    is the same as feeding each stage's output to the next stage's `mutate`.
+    """
+
+    def __init__(self, stages: t.Sequence[PipelineStage], *args, **kwargs):
+        stages = [
+            stage if isinstance(stage, PipelineStage) else PipelineStage(stage)
+            for stage in stages
+        ]
+        for stage in stages:
+            if not isinstance(stage.mutator, EventMutator):
+                raise TypeError(
+                    f"{stage.mutator.identity} cannot be fused into a pipeline"
+                )
+        self.stages = stages
+
+    def _stage_steps(
+        self, number_steps: int
+    ) -> t.Iterator[t.Tuple[EventMutator, int]]:
+        for stage in self.stages:
+            yield stage.mutator, (
+                number_steps if stage.number_steps is None else stage.number_steps
+            )
+
+    def _alter_decoded(self, decoded: smf.SMF, number_steps: int):
+        for mutator, steps in self._stage_steps(number_steps):
+            # pylint: disable=protected-access
+            mutator._alter_decoded(decoded, steps)
+
+    def _alter_mido(self, file: "mido.MidiFile", number_steps: int):
+        for mutator, steps in self._stage_steps(number_steps):
+            # pylint: disable=protected-access
+            mutator._alter_mido(file, steps)
+
+    @property
+    def identity(self) -> str:
+        stages = ",".join(
+            f"{stage.mutator.identity}"
+            + ("" if stage.number_steps is None else f":{stage.number_steps}")
+            for stage in self.stages
+        )
+        return f"{super().identity}[{stages}]"
+
+
+MUTATORS = {
+    "simple": SimpleMutator,
+    "vectorized": VectorizedMutator,
+    "memoized": MemoizedMutator,
+}
+
+
+def parse_pipeline(spec: str) -> PipelineMutator:
+    """Build a pipeline from a comma-separated list of mutator names from
+    `MUTATORS`, each optionally followed by `:STEPS` to run that stage for
+    a fixed number of steps, such as `simple:2,memoized`.
+    """
+    stages = []
+    for item in spec.split(","):
+        name, _, steps = item.strip().partition(":")
+        if name not in MUTATORS:
+            raise ValueError(
+                f"Unknown mutator {name!r}, expected one of "
+                + ", ".join(sorted(MUTATORS))
+            )
+        if steps and not (steps.isdigit() and steps.isascii()):
+            raise ValueError(f"Invalid number of steps {steps!r} for {name}")
+        stages.append(
+            PipelineStage(MUTATORS[name](), int(steps) if steps else None)
+        )
+    return PipelineMutator(stages)
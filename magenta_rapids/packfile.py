@@ -0,0 +1,457 @@
+"""Pack files holding many small stored files. A `PackSet` appends files to
+large pack files in one directory and keeps an index of where each file
+lives, so storing or reading a file costs no `open`, inode or directory
+entry of its own, and reading every file is a sequential scan of a few
+large files.
+
+Files are named `<sha1>.<extension>`, as `store` names them, and indexed by
+the binary SHA1. Appending a file which is already indexed supersedes the
+earlier copy, which stays in its pack as dead bytes until `compact`
+rewrites the live files into new packs.
+
+Pack layout: the magic bytes and a little-endian `u32` format version,
+followed by records. Each record is a header holding the record magic,
+the data length, the CRC-32 of the data and the name length, followed by
+the name and the data.
+
+Index layout: the magic bytes and a `u32` format version, followed by
+fixed-size entries holding the binary SHA1, the extension, the pack number,
+the offset of the data in the pack and its length. Entries are appended
+after the record they describe is written, and later entries supersede
+earlier ones. A record whose entry was lost is recovered by `rebuild_index`.
+"""
+
+import binascii
+import contextlib
+import os
+import re
+import struct
+import threading
+import typing as t
+import uuid
+import zlib
+
+MAGIC = b"MRPK"
+INDEX_MAGIC = b"MRPI"
+RECORD_MAGIC = b"MRRC"
+VERSION = 1
+INDEX_FILENAME = "index"
+DEFAULT_PACK_BYTES = 256 * 1024 * 1024
+
+_PREAMBLE = struct.Struct("<4sI")
+# Record magic, data length, CRC-32 of the data, name length
+_RECORD = struct.Struct("<4sIIH")
+# SHA1, extension, pack number, data offset, data length
+_ENTRY = struct.Struct("<20s8sIQI")
+_PACK_PATTERN = re.compile(r"pack-(\d{6})\.pack")
+_NAME_PATTERN = re.compile(r"([0-9a-f]{40})\.([^/]{1,8})")
+_SCAN_BUFFER_BYTES = 1 << 20
+
+
+class PackError(ValueError):
+    """Raised when a pack or index is malformed, or a name cannot be
+    packed.
+    """
+
+
+class Location(t.NamedTuple):
+    pack: int
+    offset: int
+    length: int
+
+
+class FsckReport(t.NamedTuple):
+    """Outcome of `PackSet.fsck`. `problems` is empty for a healthy set."""
+
+    problems: t.List[str]
+    records: int
+    live: int
+    dead_bytes: int
+
+
+def _split_name(filename: str) -> t.Tuple[bytes, bytes]:
+    match = _NAME_PATTERN.fullmatch(filename)
+    if match is None:
+        raise PackError(f"cannot pack {filename!r}, names must be <sha1>.<extension>")
+    return binascii.unhexlify(match.group(1)), match.group(2).encode()
+
+
+def _join_name(digest: bytes, extension: bytes) -> str:
+    return f"{digest.hex()}.{extension.decode()}"
+
+
+def _read_record(
+    header: bytes, file_obj: t.BinaryIO
+) -> t.Tuple[bytes, bytes, int]:
+    """Name, data and checksum of the record starting with `header`."""
+    if len(header) < _RECORD.size:
+        raise PackError("truncated record header")
+    magic, length, crc, name_length = _RECORD.unpack(header)
+    if magic != RECORD_MAGIC:
+        raise PackError("bad record magic")
+    name = file_obj.read(name_length)
+    data = file_obj.read(length)
+    if len(name) < name_length or len(data) < length:
+        raise PackError("truncated record")
+    return name, data, crc
+
+
+def pack_filename(number: int) -> str:
+    return f"pack-{number:06d}.pack"
+
+
+# pylint: disable=too-many-instance-attributes
+class PackSet:
+    """The packs and index in `directory`. A new pack is started once the
+    current one holds `pack_bytes`. Safe to use from several threads.
+    """
+
+    def __init__(self, directory: str, pack_bytes: int = DEFAULT_PACK_BYTES):
+        self.directory = directory
+        self._pack_bytes = pack_bytes
+        self._lock = threading.Lock()
+        self._index: t.Optional[t.Dict[bytes, t.Tuple[bytes, Location]]] = None
+        self._read_fds: t.Dict[int, int] = {}
+        self._pack_file = None
+        self._pack_number = 0
+        self._index_file = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILENAME)
+
+    def pack_path(self, number: int) -> str:
+        return os.path.join(self.directory, pack_filename(number))
+
+    def pack_numbers(self) -> t.List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(match.group(1))
+            for match in map(_PACK_PATTERN.fullmatch, os.listdir(self.directory))
+            if match is not None
+        )
+
+    def _load_index(self) -> t.Dict[bytes, t.Tuple[bytes, Location]]:
+        if self._index is not None:
+            return self._index
+        with self._lock:
+            if self._index is not None:
+                return self._index
+            index = {}
+            try:
+                with open(self.index_path, "rb") as file_obj:
+                    data = file_obj.read()
+            except FileNotFoundError:
+                data = b""
+            if data:
+                magic, version = _PREAMBLE.unpack_from(data)
+                if magic != INDEX_MAGIC or version != VERSION:
+                    raise PackError(f"{self.index_path} is not a version {VERSION} index")
+                body = memoryview(data)[_PREAMBLE.size:]
+                # A partly written entry at the end is ignored, its record is
+                # recovered by `rebuild_index`
+                body = body[: len(body) - len(body) % _ENTRY.size]
+                for digest, extension, pack, offset, length in _ENTRY.iter_unpack(
+                    body
+                ):
+                    index[digest] = (
+                        extension.rstrip(b"\0"), Location(pack, offset, length)
+                    )
+            self._index = index
+            return index
+
+    def __len__(self) -> int:
+        return len(self._load_index())
+
+    def __contains__(self, filename: str) -> bool:
+        try:
+            digest, extension = _split_name(filename)
+        except PackError:
+            return False
+        entry = self._load_index().get(digest)
+        return entry is not None and entry[0] == extension
+
+    def location(self, filename: str) -> t.Optional[Location]:
+        digest, extension = _split_name(filename)
+        entry = self._load_index().get(digest)
+        if entry is None or entry[0] != extension:
+            return None
+        return entry[1]
+
+    def filenames(self) -> t.List[str]:
+        """Every indexed filename, in the order the files lie in the packs."""
+        return [
+            _join_name(digest, extension)
+            for digest, (extension, _) in sorted(
+                self._load_index().items(), key=lambda item: item[1][1]
+            )
+        ]
+
+    def _open_for_append(self):
+        """Open the pack being appended to, and the index, with the lock
+        held.
+        """
+        if self._pack_file is not None and self._pack_file.tell() < self._pack_bytes:
+            return
+        if self._pack_file is not None:
+            self._pack_file.close()
+        numbers = self.pack_numbers()
+        self._pack_number = numbers[-1] if numbers else 1
+        path = self.pack_path(self._pack_number)
+        if numbers and os.path.getsize(path) >= self._pack_bytes:
+            self._pack_number += 1
+            path = self.pack_path(self._pack_number)
+        self._pack_file = open(path, "ab")  # pylint: disable=consider-using-with
+        if self._pack_file.tell() == 0:
+            self._pack_file.write(_PREAMBLE.pack(MAGIC, VERSION))
+        if self._index_file is None:
+            # pylint: disable=consider-using-with
+            self._index_file = open(self.index_path, "ab")
+            if self._index_file.tell() == 0:
+                self._index_file.write(_PREAMBLE.pack(INDEX_MAGIC, VERSION))
+
+    def append(self, filename: str, data: bytes, replace: bool = True) -> Location:
+        """Append the file `filename` with contents `data`, superseding any
+        earlier copy, or raising `FileExistsError` if there is one and
+        `replace` is false.
+        """
+        digest, extension = _split_name(filename)
+        name = filename.encode()
+        index = self._load_index()
+        with self._lock:
+            if not replace and digest in index:
+                raise FileExistsError(f"{filename} is already in {self.directory}")
+            self._open_for_append()
+            header = _RECORD.pack(
+                RECORD_MAGIC, len(data), zlib.crc32(data), len(name)
+            )
+            offset = self._pack_file.tell() + len(header) + len(name)
+            self._pack_file.write(header + name + data)
+            self._pack_file.flush()
+            location = Location(self._pack_number, offset, len(data))
+            self._index_file.write(
+                _ENTRY.pack(
+                    digest, extension, location.pack, location.offset,
+                    location.length,
+                )
+            )
+            self._index_file.flush()
+            index[digest] = (extension, location)
+        return location
+
+    def _read_fd(self, pack: int) -> int:
+        fd = self._read_fds.get(pack)
+        if fd is None:
+            with self._lock:
+                fd = self._read_fds.get(pack)
+                if fd is None:
+                    fd = self._read_fds[pack] = os.open(
+                        self.pack_path(pack), os.O_RDONLY
+                    )
+        return fd
+
+    def read_location(self, location: Location) -> bytes:
+        data = os.pread(self._read_fd(location.pack), location.length, location.offset)
+        if len(data) != location.length:
+            raise PackError(f"{self.pack_path(location.pack)} is truncated")
+        return data
+
+    def read(self, filename: str) -> bytes:
+        location = self.location(filename)
+        if location is None:
+            raise FileNotFoundError(f"{filename} is not in {self.directory}")
+        return self.read_location(location)
+
+    def _scan_pack(
+        self, number: int
+    ) -> t.Iterator[t.Tuple[str, Location, t.Optional[bytes], t.Optional[str]]]:
+        """Every record of pack `number` in order, as its name, location,
+        data and a description of what is wrong with it, if anything. The
+        scan stops at the first record which cannot be framed.
+        """
+        path = self.pack_path(number)
+        with open(path, "rb", buffering=_SCAN_BUFFER_BYTES) as file_obj:
+            if file_obj.read(_PREAMBLE.size) != _PREAMBLE.pack(MAGIC, VERSION):
+                yield "", Location(number, 0, 0), None, (
+                    f"{path} is not a version {VERSION} pack"
+                )
+                return
+            position = _PREAMBLE.size
+            while header := file_obj.read(_RECORD.size):
+                try:
+                    name, data, crc = _read_record(header, file_obj)
+                except PackError as error:
+                    yield "", Location(number, position, 0), None, (
+                        f"{path} at offset {position}: {error}"
+                    )
+                    return
+                offset = position + _RECORD.size + len(name)
+                location = Location(number, offset, len(data))
+                position = offset + len(data)
+                name = name.decode(errors="replace")
+                if zlib.crc32(data) != crc:
+                    yield name, location, data, (
+                        f"{path} at offset {offset}: checksum mismatch for {name}"
+                    )
+                else:
+                    yield name, location, data, None
+
+    def scan(
+        self, exclude: t.Optional[t.Callable[[str], bool]] = None
+    ) -> t.Iterator[t.Tuple[str, bytes]]:
+        """Every live file, reading the packs sequentially, skipping the
+        names for which `exclude` is true without keeping their data.
+        """
+        index = self._load_index()
+        for number in self.pack_numbers():
+            for name, location, data, problem in self._scan_pack(number):
+                if problem is not None:
+                    raise PackError(problem)
+                try:
+                    digest, _ = _split_name(name)
+                except PackError:
+                    continue
+                entry = index.get(digest)
+                if entry is None or entry[1] != location:
+                    continue
+                if exclude is not None and exclude(name):
+                    continue
+                yield name, data
+
+    def rebuild_index(self):
+        """Rewrite the index from the records in the packs, the last record
+        of each name winning. Records after a damaged one in the same pack
+        are lost; `fsck` reports them.
+        """
+        entries = {}
+        for number in self.pack_numbers():
+            for name, location, _, problem in self._scan_pack(number):
+                if problem is None:
+                    with contextlib.suppress(PackError):
+                        digest, extension = _split_name(name)
+                        entries[digest] = (extension, location)
+        self._write_index(entries)
+
+    def _write_index(self, entries: t.Dict[bytes, t.Tuple[bytes, Location]]):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = f"{self.index_path}.tmp-{uuid.uuid4().hex}"
+        with open(temporary_path, "wb") as file_obj:
+            file_obj.write(_PREAMBLE.pack(INDEX_MAGIC, VERSION))
+            for digest, (extension, location) in sorted(
+                entries.items(), key=lambda item: item[1][1]
+            ):
+                file_obj.write(_ENTRY.pack(digest, extension, *location))
+        with self._lock:
+            self._close_files()
+            os.replace(temporary_path, self.index_path)
+            self._index = entries
+
+    def compact(self) -> t.Tuple[int, int]:
+        """Rewrite the live files into new packs and remove the old ones,
+        returning the number of bytes the packs took before and after.
+        Interrupted compactions leave either the old or the new index in
+        place, and the packs it does not refer to are removed by the next
+        compaction.
+        """
+        index = self._load_index()
+        old_numbers = self.pack_numbers()
+        before = sum(os.path.getsize(self.pack_path(number)) for number in old_numbers)
+        number = (old_numbers[-1] if old_numbers else 0) + 1
+        new_numbers = [number]
+        entries = {}
+        output = open(self.pack_path(number), "wb")  # pylint: disable=consider-using-with
+        try:
+            output.write(_PREAMBLE.pack(MAGIC, VERSION))
+            for digest, (extension, location) in sorted(
+                index.items(), key=lambda item: item[1][1]
+            ):
+                if output.tell() >= self._pack_bytes:
+                    output.close()
+                    number += 1
+                    new_numbers.append(number)
+                    # pylint: disable=consider-using-with
+                    output = open(self.pack_path(number), "wb")
+                    output.write(_PREAMBLE.pack(MAGIC, VERSION))
+                data = self.read_location(location)
+                name = _join_name(digest, extension).encode()
+                output.write(
+                    _RECORD.pack(RECORD_MAGIC, len(data), zlib.crc32(data), len(name))
+                )
+                output.write(name)
+                entries[digest] = (
+                    extension, Location(number, output.tell(), len(data))
+                )
+                output.write(data)
+        finally:
+            output.close()
+        self._write_index(entries)
+        for old_number in old_numbers:
+            os.unlink(self.pack_path(old_number))
+        after = sum(os.path.getsize(self.pack_path(number)) for number in new_numbers)
+        return before, after
+
+    # pylint: disable=too-many-locals
+    def fsck(
+        self, verify: t.Optional[t.Callable[[str, bytes], bool]] = None
+    ) -> FsckReport:
+        """Check that every record is framed correctly and matches its
+        checksum, that `verify(name, data)` holds for every live record,
+        that every index entry points at a record of that name and that
+        every name in the packs is indexed.
+        """
+        problems = []
+        index = self._load_index()
+        found = set()
+        unindexed = {}
+        records = dead_bytes = 0
+        for number in self.pack_numbers():
+            for name, location, data, problem in self._scan_pack(number):
+                if data is None:
+                    problems.append(problem)
+                    continue
+                records += 1
+                if problem is not None:
+                    problems.append(problem)
+                try:
+                    digest, extension = _split_name(name)
+                except PackError as error:
+                    problems.append(str(error))
+                    continue
+                if index.get(digest) != (extension, location):
+                    dead_bytes += _RECORD.size + len(name) + location.length
+                    if digest not in index:
+                        unindexed[name] = location
+                    continue
+                found.add(digest)
+                if problem is None and verify is not None and not verify(name, data):
+                    problems.append(f"{name} does not match its contents")
+        for digest, (extension, location) in index.items():
+            if digest not in found:
+                problems.append(
+                    f"index entry for {_join_name(digest, extension)} points at "
+                    f"no record in {pack_filename(location.pack)} at offset "
+                    f"{location.offset}"
+                )
+        problems += [
+            f"{name} in {pack_filename(location.pack)} is not indexed, "
+            "rebuild the index to recover it"
+            for name, location in unindexed.items()
+        ]
+        return FsckReport(problems, records, len(found), dead_bytes)
+
+    def _close_files(self):
+        """Close every open file, with the lock held."""
+        if self._pack_file is not None:
+            self._pack_file.close()
+            self._pack_file = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        for fd in self._read_fds.values():
+            os.close(fd)
+        self._read_fds.clear()
+
+    def close(self):
+        with self._lock:
+            self._close_files()
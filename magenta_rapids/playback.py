@@ -0,0 +1,193 @@
+"""Playback engine for Magenta Rapids. A file is first compiled into a
+schedule of batches of messages at absolute times, computed from its tick
+positions and tempo map rather than by summing per-message delays. A
+dedicated sender thread then waits for each batch against a monotonic clock,
+sleeping until shortly before it is due and spinning for the remainder.
+Every wait is measured from the start of playback, so a late batch never
+delays the batches after it and timing error does not accumulate.
+"""
+
+import statistics
+import threading
+import time
+import typing as t
+import mido
+
+DEFAULT_TEMPO = 500000
+
+
+class Batch(t.NamedTuple):
+    """Messages due at the same time, in seconds from the start."""
+
+    time: float
+    messages: t.Tuple[mido.Message, ...]
+
+
+def compile_schedule(midi_file: mido.MidiFile) -> t.List[Batch]:
+    """Compile a MIDI file into batches of the messages to send. Meta
+    messages are consumed for their tempo changes and never sent.
+    """
+    if midi_file.type == 2:
+        raise TypeError("can't play type 2 (asynchronous) MIDI files")
+    ticks_per_beat = midi_file.ticks_per_beat
+    tempo = DEFAULT_TEMPO
+    # Absolute time of the last tempo change, in ticks and seconds
+    segment_tick = 0
+    segment_time = 0.0
+    tick = 0
+    schedule = []
+    for message in mido.merge_tracks(midi_file.tracks):
+        tick += message.time
+        now = segment_time + mido.tick2second(
+            tick - segment_tick, ticks_per_beat, tempo
+        )
+        if message.is_meta:
+            if message.type == "set_tempo":
+                segment_tick, segment_time = tick, now
+                tempo = message.tempo
+            continue
+        message = message.copy(time=0)
+        if schedule and schedule[-1].time == now:
+            schedule[-1] = Batch(now, schedule[-1].messages + (message,))
+        else:
+            schedule.append(Batch(now, (message,)))
+    return schedule
+
+
+class MockPort:
+    """In-process output port recording when each message was sent, for
+    measuring playback without MIDI hardware.
+    """
+
+    def __init__(self, clock: t.Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.sent: t.List[t.Tuple[float, mido.Message]] = []
+
+    def send(self, message: mido.Message):
+        self.sent.append((self._clock(), message))
+
+    def reset(self):
+        pass
+
+
+class PlaybackReport(t.NamedTuple):
+    """Lateness of each batch, in seconds, relative to its scheduled time.
+    Jitter is the variation in lateness between consecutive batches.
+    """
+
+    latencies: t.List[float]
+
+    @staticmethod
+    def _percentiles(values: t.Sequence[float]) -> t.Dict[str, float]:
+        if len(values) < 2:
+            values = list(values) * 2 or [0.0, 0.0]
+        cuts = statistics.quantiles(values, n=100, method="inclusive")
+        return {
+            "p50": cuts[49],
+            "p90": cuts[89],
+            "p99": cuts[98],
+            "max": max(values),
+        }
+
+    @property
+    def jitters(self) -> t.List[float]:
+        return [
+            abs(later - earlier)
+            for earlier, later in zip(self.latencies, self.latencies[1:])
+        ]
+
+    def summary(self) -> t.Dict[str, t.Dict[str, float]]:
+        return {
+            "latency": self._percentiles(self.latencies),
+            "jitter": self._percentiles(self.jitters),
+        }
+
+
+# pylint: disable=too-many-instance-attributes
+class Player:
+    """Sends a schedule to a port from a dedicated thread. Waits sleep until
+    `spin_threshold` seconds before a batch is due, then spin on the clock,
+    trading a little CPU for precision. Playback starts `lead_time` seconds
+    after `start` is called, leaving the thread time to get scheduled.
+    """
+
+    def __init__(
+        self,
+        port,
+        spin_threshold: float = 0.002,
+        lead_time: float = 0.01,
+        clock: t.Callable[[], float] = time.monotonic,
+    ):
+        self._port = port
+        self._spin_threshold = spin_threshold
+        self._lead_time = lead_time
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread = None
+        self._latencies = []
+        self._error = None
+
+    def _wait_until(self, deadline: float) -> bool:
+        remaining = deadline - self._clock()
+        if remaining > self._spin_threshold:
+            if self._stop.wait(remaining - self._spin_threshold):
+                return False
+        while self._clock() < deadline:
+            pass
+        return not self._stop.is_set()
+
+    def _run(self, schedule: t.Sequence[Batch], start: float):
+        try:
+            for batch in schedule:
+                deadline = start + batch.time
+                if not self._wait_until(deadline):
+                    break
+                self._latencies.append(self._clock() - deadline)
+                for message in batch.messages:
+                    self._port.send(message)
+            if self._stop.is_set():
+                self._port.reset()
+        except BaseException as error:  # pylint: disable=broad-exception-caught
+            self._error = error
+
+    def start(self, schedule: t.Sequence[Batch]):
+        if self._thread is not None:
+            raise RuntimeError("player already started")
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(schedule, self._clock() + self._lead_time),
+            name="magenta-rapids-playback",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop playback, silencing the port if it was interrupted."""
+        self._stop.set()
+        self.join()
+
+    def join(self, timeout: t.Optional[float] = None) -> bool:
+        """Wait for playback to finish, and return whether it has. Errors
+        raised by the port in the sender thread are raised here.
+        """
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        return not self._thread.is_alive()
+
+    def report(self) -> PlaybackReport:
+        return PlaybackReport(list(self._latencies))
+
+
+def play(schedule: t.Sequence[Batch], port, **kwargs) -> PlaybackReport:
+    """Play a schedule to a port, blocking until it ends. Interrupting the
+    calling thread stops playback.
+    """
+    player = Player(port, **kwargs)
+    player.start(schedule)
+    try:
+        player.join()
+    except KeyboardInterrupt:
+        player.stop()
+        raise
+    return player.report()
@@ -0,0 +1,417 @@
+"""Client for S3-compatible object storage, used by `S3FileBackend`. It
+implements the few calls the backend needs over the standard library's
+`http.client`, signed with AWS Signature Version 4, so that any S3
+implementation (AWS, MinIO, Ceph, ...) can be used without extra
+dependencies:
+
+- `HEAD`, `GET`, `PUT` and `DELETE` of single objects
+- paginated `ListObjectsV2`
+- multipart uploads, used for objects larger than a threshold
+
+Connections are kept alive in a pool shared by every thread, which also
+bounds the number of requests in flight at once.
+"""
+
+import contextlib
+import datetime
+import hashlib
+import hmac
+import http.client
+import os
+import queue
+import threading
+import time
+import typing as t
+import urllib.parse
+from xml.etree import ElementTree
+from magenta_rapids import metrics
+
+URL_SCHEME = "s3://"
+DEFAULT_REGION = "us-east-1"
+DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+# S3 requires every part but the last to be at least 5 MiB
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+_ALGORITHM = "AWS4-HMAC-SHA256"
+_NAMESPACE = "{http://s3.amazonaws.com/doc/2006-03-01/}"
+# Statuses worth retrying, as the request may succeed if sent again
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class S3Error(Exception):
+    """Raised when the storage answers a request with an error."""
+
+    def __init__(self, status: int, code: str, message: str = ""):
+        super().__init__(f"{status} {code}: {message}" if message else code)
+        self.status = status
+        self.code = code
+
+
+class Credentials(t.NamedTuple):
+    access_key: str
+    secret_key: str
+    session_token: t.Optional[str] = None
+
+    @classmethod
+    def from_environment(cls) -> "Credentials":
+        """Credentials from the usual `AWS_*` environment variables."""
+        try:
+            return cls(
+                os.environ["AWS_ACCESS_KEY_ID"],
+                os.environ["AWS_SECRET_ACCESS_KEY"],
+                os.environ.get("AWS_SESSION_TOKEN"),
+            )
+        except KeyError as error:
+            raise ValueError(
+                f"Missing {error.args[0]} for S3 environments"
+            ) from error
+
+
+class ListPage(t.NamedTuple):
+    """One page of a listing: `(key, size)` of each object, and the token
+    to pass to get the next page, or `None` after the last one.
+    """
+
+    objects: t.List[t.Tuple[str, int]]
+    next_token: t.Optional[str]
+
+
+def parse_url(url: str) -> t.Tuple[str, str]:
+    """Bucket and key prefix, without trailing slash, of `s3://bucket/prefix`."""
+    if not url.startswith(URL_SCHEME):
+        raise ValueError(f"{url} is not an {URL_SCHEME} URL")
+    bucket, _, prefix = url[len(URL_SCHEME):].partition("/")
+    if not bucket:
+        raise ValueError(f"{url} does not name a bucket")
+    return bucket, prefix.strip("/")
+
+
+def _quote(value: str, safe: str = "-_.~") -> str:
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def sign(
+    method: str,
+    path: str,
+    query: t.Dict[str, str],
+    headers: t.Dict[str, str],
+    payload_hash: str,
+    credentials: Credentials,
+    region: str,
+    now: datetime.datetime,
+) -> t.Dict[str, str]:
+    """`headers`, which must include `host`, with those authenticating the
+    request added. `path` is not yet URL-encoded.
+    """
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    headers = {
+        **{name.lower(): str(value).strip() for name, value in headers.items()},
+        "x-amz-content-sha256": payload_hash,
+        "x-amz-date": amz_date,
+    }
+    if credentials.session_token:
+        headers["x-amz-security-token"] = credentials.session_token
+    signed_headers = ";".join(sorted(headers))
+    canonical_request = "\n".join(
+        [
+            method,
+            _quote(path, safe="/-_.~"),
+            "&".join(
+                f"{_quote(name)}={_quote(value)}"
+                for name, value in sorted(query.items())
+            ),
+            "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers,
+            payload_hash,
+        ]
+    )
+    scope = f"{amz_date[:8]}/{region}/s3/aws4_request"
+    string_to_sign = "\n".join(
+        [
+            _ALGORITHM,
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ]
+    )
+    key = ("AWS4" + credentials.secret_key).encode()
+    for part in (amz_date[:8], region, "s3", "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    headers["authorization"] = (
+        f"{_ALGORITHM} Credential={credentials.access_key}/{scope}, "
+        f"SignedHeaders={signed_headers}, Signature={signature}"
+    )
+    return headers
+
+
+class _ConnectionPool:
+    """Keep-alive connections to one host. At most `size` are in use at
+    once; callers wait for one to be returned beyond that.
+    """
+
+    def __init__(self, url: urllib.parse.SplitResult, size: int, timeout: float):
+        self._connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self._host = url.hostname
+        self._port = url.port
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def connection(self) -> t.Iterator[http.client.HTTPConnection]:
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                metrics.count("s3.connections_opened")
+                connection = self._connection_class(
+                    self._host, self._port, timeout=self._timeout
+                )
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# pylint: disable=too-many-instance-attributes
+class S3Client:
+    """Client for `bucket` at `endpoint_url`. Objects are addressed by path
+    (`endpoint/bucket/key`), which every S3 implementation supports, unless
+    `virtual_hosted` is set (`bucket.endpoint/key`). At most `pool_size`
+    requests are in flight at once.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        endpoint_url: str,
+        bucket: str,
+        credentials: Credentials,
+        region: str = DEFAULT_REGION,
+        pool_size: int = 8,
+        timeout: float = 60,
+        retries: int = 2,
+        virtual_hosted: bool = False,
+    ):
+        url = urllib.parse.urlsplit(endpoint_url)
+        if virtual_hosted:
+            url = url._replace(netloc=f"{bucket}.{url.netloc}")
+        self._netloc = url.netloc
+        self._path_prefix = url.path.rstrip("/")
+        if not virtual_hosted:
+            self._path_prefix += f"/{bucket}"
+        self._bucket = bucket
+        self._credentials = credentials
+        self._region = region
+        self._retries = retries
+        self._pool = _ConnectionPool(url, pool_size, timeout)
+
+    @classmethod
+    def from_environment(cls, bucket: str, **kwargs) -> "S3Client":
+        """Client configured from the usual `AWS_*` environment variables,
+        including `AWS_ENDPOINT_URL` for storage other than AWS.
+        """
+        region = (
+            os.environ.get("AWS_REGION")
+            or os.environ.get("AWS_DEFAULT_REGION")
+            or DEFAULT_REGION
+        )
+        endpoint_url = os.environ.get("AWS_ENDPOINT_URL_S3") or os.environ.get(
+            "AWS_ENDPOINT_URL"
+        )
+        if endpoint_url is None:
+            endpoint_url = f"https://s3.{region}.amazonaws.com"
+            kwargs.setdefault("virtual_hosted", True)
+        return cls(
+            endpoint_url, bucket, Credentials.from_environment(), region, **kwargs
+        )
+
+    @property
+    def bucket(self) -> str:
+        return self._bucket
+
+    def close(self):
+        self._pool.close()
+
+    # pylint: disable=too-many-arguments
+    def _request(
+        self,
+        method: str,
+        key: str = "",
+        query: t.Optional[t.Dict[str, str]] = None,
+        body: bytes = b"",
+        expected: t.Tuple[int, ...] = (200,),
+    ) -> t.Tuple[int, http.client.HTTPMessage, bytes]:
+        query = query or {}
+        path = f"{self._path_prefix}/{key}"
+        target = _quote(path, safe="/-_.~") + (
+            "?" + "&".join(
+                f"{_quote(name)}={_quote(value)}" for name, value in query.items()
+            )
+            if query
+            else ""
+        )
+        payload_hash = hashlib.sha256(body).hexdigest()
+        for attempt in range(self._retries + 1):
+            headers = sign(
+                method, path, query,
+                {"host": self._netloc, "content-length": str(len(body))},
+                payload_hash, self._credentials, self._region,
+                datetime.datetime.now(datetime.timezone.utc),
+            )
+            try:
+                with (
+                    metrics.timer(f"s3.{method.lower()}"),
+                    self._pool.connection() as connection,
+                ):
+                    connection.request(method, target, body=body, headers=headers)
+                    response = connection.getresponse()
+                    data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # Most likely a kept-alive connection the server closed
+                if attempt == self._retries:
+                    raise
+                metrics.count("s3.retries")
+                continue
+            if response.status not in _RETRY_STATUSES or attempt == self._retries:
+                break
+            metrics.count("s3.retries")
+            time.sleep(0.1 * 2**attempt)
+        if response.status not in expected:
+            code, message = str(response.status), response.reason
+            if data:
+                with contextlib.suppress(ElementTree.ParseError):
+                    error = ElementTree.fromstring(data)
+                    code = error.findtext("Code") or code
+                    message = error.findtext("Message") or message
+            raise S3Error(response.status, code, message)
+        return response.status, response.headers, data
+
+    def head_object(self, key: str) -> t.Optional[int]:
+        """Size of the object `key`, or `None` if there is none."""
+        status, headers, _ = self._request("HEAD", key, expected=(200, 404))
+        return None if status == 404 else int(headers["Content-Length"])
+
+    def get_object(self, key: str) -> t.Optional[bytes]:
+        """Contents of the object `key`, or `None` if there is none."""
+        status, _, data = self._request("GET", key, expected=(200, 404))
+        if status == 404:
+            return None
+        metrics.count("s3.bytes_read", len(data))
+        return data
+
+    def put_object(self, key: str, data: bytes):
+        self._request("PUT", key, body=data)
+        metrics.count("s3.bytes_written", len(data))
+
+    def delete_object(self, key: str):
+        self._request("DELETE", key, expected=(200, 204))
+
+    def list_objects(
+        self, prefix: str, token: t.Optional[str] = None, page_size: int = 1000
+    ) -> ListPage:
+        """Objects whose key starts with `prefix`, a page at a time, in key
+        order.
+        """
+        query = {"list-type": "2", "prefix": prefix, "max-keys": str(page_size)}
+        if token is not None:
+            query["continuation-token"] = token
+        _, _, data = self._request("GET", query=query)
+        root = ElementTree.fromstring(data)
+        objects = [
+            (
+                contents.findtext(f"{_NAMESPACE}Key"),
+                int(contents.findtext(f"{_NAMESPACE}Size")),
+            )
+            for contents in root.iter(f"{_NAMESPACE}Contents")
+        ]
+        truncated = root.findtext(f"{_NAMESPACE}IsTruncated") == "true"
+        return ListPage(
+            objects,
+            root.findtext(f"{_NAMESPACE}NextContinuationToken")
+            if truncated else None,
+        )
+
+    def list_all(
+        self, prefix: str, page_size: int = 1000
+    ) -> t.Iterator[t.Tuple[str, int]]:
+        token = None
+        while True:
+            page = self.list_objects(prefix, token, page_size)
+            yield from page.objects
+            if page.next_token is None:
+                return
+            token = page.next_token
+
+    def upload(
+        self,
+        key: str,
+        file_object: t.BinaryIO,
+        multipart_threshold: int = DEFAULT_MULTIPART_THRESHOLD,
+        part_size: int = DEFAULT_PART_SIZE,
+    ):
+        """Upload `file_object` from its current position, in one request
+        if it is smaller than `multipart_threshold`, else in parts of
+        `part_size` bytes read as they are sent, so that large objects are
+        never held in memory whole.
+        """
+        data = file_object.read(multipart_threshold)
+        if len(data) < multipart_threshold:
+            self.put_object(key, data)
+            return
+        _, _, response = self._request("POST", key, query={"uploads": ""})
+        upload_id = ElementTree.fromstring(response).findtext(
+            f"{_NAMESPACE}UploadId"
+        )
+        metrics.count("s3.multipart_uploads")
+        try:
+            etags = []
+            while data:
+                if len(data) < part_size:
+                    data += file_object.read(part_size - len(data))
+                part, data = data[:part_size], data[part_size:]
+                _, headers, _ = self._request(
+                    "PUT", key,
+                    query={"partNumber": str(len(etags) + 1), "uploadId": upload_id},
+                    body=part,
+                )
+                etags.append(headers["ETag"])
+                metrics.count("s3.bytes_written", len(part))
+                if not data:
+                    data = file_object.read(part_size)
+            self._request(
+                "POST", key, query={"uploadId": upload_id},
+                body=(
+                    "<CompleteMultipartUpload>"
+                    + "".join(
+                        f"<Part><PartNumber>{number}</PartNumber>"
+                        f"<ETag>{etag}</ETag></Part>"
+                        for number, etag in enumerate(etags, start=1)
+                    )
+                    + "</CompleteMultipartUpload>"
+                ).encode(),
+            )
+        except BaseException:
+            with contextlib.suppress(S3Error, OSError):
+                self._request(
+                    "DELETE", key, query={"uploadId": upload_id}, expected=(204, 200)
+                )
+            raise
@@ -0,0 +1,278 @@
+"""Local mutation service for Magenta Rapids. A `MutationServer` speaks a
+small subset of HTTP/1.1 over TCP or a Unix socket, so other services can
+mutate MIDI files without going through an environment's directories:
+
+    POST /mutate?number_steps=N     body: MIDI file, response: mutated file
+    GET /health
+
+One environment, and so one mutator instance, serves every request, and
+mutations run in a process pool shared by all connections. Requests may be
+pipelined; responses are written in request order. Backpressure is applied
+at two levels: each connection has at most `max_pipeline` requests in
+progress before the server stops reading from it, and at most
+`max_in_flight` mutations run at once across all connections.
+"""
+
+import concurrent.futures
+import contextlib
+import http
+import os
+import signal
+import typing as t
+import urllib.parse
+from magenta_rapids import metrics
+from magenta_rapids.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class Request(t.NamedTuple):
+    method: str
+    path: str
+    query: t.Dict[str, t.List[str]]
+    headers: t.Dict[str, str]
+    body: bytes
+    keep_alive: bool
+
+
+class HTTPError(Exception):
+    """Raised while reading a request which cannot be served."""
+
+    def __init__(self, status: http.HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def _response(
+    status: http.HTTPStatus,
+    body: bytes = b"",
+    content_type: str = "text/plain; charset=utf-8",
+    keep_alive: bool = True,
+) -> bytes:
+    headers = [
+        f"HTTP/1.1 {status.value} {status.phrase}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+    ]
+    if not keep_alive:
+        headers.append("Connection: close")
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body
+
+
+def _error_response(error: HTTPError, keep_alive: bool = True) -> bytes:
+    return _response(error.status, f"{error}\n".encode(), keep_alive=keep_alive)
+
+
+class MutationServer:
+    """Serves mutations with `environment`'s mutator. `jobs` worker
+    processes run the mutations, or a thread when it is 1.
+    """
+
+    DEFAULT_MAX_BODY_BYTES = 16 * 1024 * 1024
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        environment,
+        jobs: int = 1,
+        max_in_flight: t.Optional[int] = None,
+        max_pipeline: int = 16,
+        max_body_bytes: int = DEFAULT_MAX_BODY_BYTES,
+    ):
+        self._environment = environment
+        self._jobs = jobs or os.cpu_count()
+        self._max_in_flight = max_in_flight or 2 * self._jobs
+        self._max_pipeline = max_pipeline
+        self._max_body_bytes = max_body_bytes
+        self._executor = None
+        self._slots = None
+        self._server = None
+        self._unix_socket = None
+
+    async def start(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        unix_socket: t.Optional[str] = None,
+    ):
+        """Start listening on `unix_socket` if given, else on `host` and
+        `port`, 0 picking a free port. Returns the `asyncio.Server`.
+        """
+        if self._jobs > 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self._jobs
+            )
+        self._slots = asyncio.Semaphore(self._max_in_flight)
+        if unix_socket is not None:
+            self._unix_socket = unix_socket
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, path=unix_socket, limit=MAX_HEADER_BYTES
+            )
+        else:
+            self._server = await asyncio.start_server(
+                self._handle_connection, host=host, port=port,
+                limit=MAX_HEADER_BYTES,
+            )
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._unix_socket is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._unix_socket)
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    async def serve_forever(self, **listen_kwargs):
+        """Start, then serve until the process receives SIGINT or SIGTERM."""
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stop.set)
+        await self.start(**listen_kwargs)
+        try:
+            await stop.wait()
+        finally:
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signal_number)
+            await self.close()
+
+    async def _read_request(self, reader) -> t.Optional[Request]:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as error:
+            if error.partial.strip():
+                raise HTTPError(http.HTTPStatus.BAD_REQUEST) from error
+            return None
+        except asyncio.LimitOverrunError as error:
+            raise HTTPError(
+                http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE
+            ) from error
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+            headers = {}
+            for line in lines[1:]:
+                if line:
+                    name, value = line.split(":", 1)
+                    headers[name.strip().lower()] = value.strip()
+        except ValueError as error:
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST) from error
+        if "transfer-encoding" in headers:
+            raise HTTPError(
+                http.HTTPStatus.NOT_IMPLEMENTED, "chunked bodies are not supported"
+            )
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError as error:
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST) from error
+        if length > self._max_body_bytes:
+            raise HTTPError(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError as error:
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST) from error
+        connection = headers.get("connection", "").lower()
+        keep_alive = (
+            connection != "close"
+            if version == "HTTP/1.1"
+            else connection == "keep-alive"
+        )
+        url = urllib.parse.urlsplit(target)
+        return Request(
+            method, url.path, urllib.parse.parse_qs(url.query), headers, body,
+            keep_alive,
+        )
+
+    async def _process(self, request: Request) -> bytes:
+        metrics.count("server.requests")
+        if request.path == "/health" and request.method == "GET":
+            return _response(http.HTTPStatus.OK, b"ok\n", keep_alive=request.keep_alive)
+        if request.path != "/mutate":
+            return _error_response(
+                HTTPError(http.HTTPStatus.NOT_FOUND), request.keep_alive
+            )
+        if request.method != "POST":
+            return _error_response(
+                HTTPError(http.HTTPStatus.METHOD_NOT_ALLOWED), request.keep_alive
+            )
+        try:
+            number_steps = int(request.query.get("number_steps", ["1"])[0])
+            if number_steps < 0:
+                raise ValueError(number_steps)
+        except ValueError:
+            return _error_response(
+                HTTPError(
+                    http.HTTPStatus.BAD_REQUEST,
+                    "number_steps must be a non-negative integer",
+                ),
+                request.keep_alive,
+            )
+        async with self._slots:
+            with metrics.timer("server.mutate"):
+                try:
+                    result = await self._environment.mutate_data(
+                        request.body, number_steps, self._executor
+                    )
+                except (
+                    OSError, EOFError, ValueError, KeyError, ArithmeticError
+                ) as error:
+                    return _error_response(
+                        HTTPError(
+                            http.HTTPStatus.UNPROCESSABLE_ENTITY,
+                            f"cannot mutate file: {error}",
+                        ),
+                        request.keep_alive,
+                    )
+        return _response(
+            http.HTTPStatus.OK, result, "audio/midi", keep_alive=request.keep_alive
+        )
+
+    @staticmethod
+    async def _write_responses(responses, writer, handler):
+        try:
+            while (response := await responses.get()) is not None:
+                writer.write(await response)
+                # Waits while the client is slow to read, which in turn stops
+                # new requests from being read once the pipeline is full
+                await writer.drain()
+        except ConnectionError:
+            # The reader may be blocked on a full pipeline nobody will drain
+            handler.cancel()
+
+    async def _handle_connection(self, reader, writer):
+        responses = asyncio.Queue(maxsize=self._max_pipeline)
+        writer_task = asyncio.create_task(
+            self._write_responses(responses, writer, asyncio.current_task())
+        )
+        pending = []
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as error:
+                    future = asyncio.get_running_loop().create_future()
+                    future.set_result(_error_response(error, keep_alive=False))
+                    await responses.put(future)
+                    break
+                if request is None:
+                    break
+                task = asyncio.create_task(self._process(request))
+                pending.append(task)
+                await responses.put(task)
+                pending = [task for task in pending if not task.done()]
+                if not request.keep_alive:
+                    break
+            await responses.put(None)
+            await writer_task
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer_task.cancel()
+            for task in pending:
+                task.cancel()
+            writer.close()
@@ -0,0 +1,244 @@
+"""Columnar sidecar files holding a pre-parsed `smf.SMF`. A sidecar is
+written next to each stored MIDI file so that mutators can skip parsing it.
+Every column is stored as a contiguous, 8-byte aligned array in native byte
+order, so loading a sidecar memory-maps it and wraps the columns without
+copying them. The per-track columns are the absolute tick, delta-time,
+status, note, velocity and flags of each event, the offsets of each event's
+raw bytes in a per-track blob (empty for note events) and the indices of
+the note events.
+
+Layout: the magic bytes, a little-endian `u32` format version and a `u32`
+header length, followed by a JSON header describing the source file and the
+offset of every section, followed by the sections themselves.
+"""
+
+import array
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import typing as t
+import uuid
+from magenta_rapids import smf
+
+MAGIC = b"MRSC"
+VERSION = 1
+SUFFIX = ".cols"
+
+_PREAMBLE = struct.Struct("<4sII")
+_ALIGNMENT = 8
+
+# Column name, array typecode
+_COLUMNS = (
+    ("deltas", "q"),
+    ("abs_ticks", "q"),
+    ("statuses", "B"),
+    ("notes", "B"),
+    ("velocities", "B"),
+    ("flags", "B"),
+    ("raw_offsets", "q"),
+    ("note_indices", "q"),
+)
+
+
+class SidecarError(ValueError):
+    """Raised when a sidecar is missing, malformed or stale."""
+
+
+class RawEvents(t.Sequence):
+    """Raw bytes of a track's events, as slices of a single blob. Note
+    events, which have no raw bytes, are `None`.
+    """
+
+    def __init__(self, blob: memoryview, offsets: t.Sequence[int]):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return self._blob[start:end] if end > start else None
+
+    def __iter__(self):
+        blob = self._blob
+        for start, end in itertools.pairwise(self._offsets):
+            yield blob[start:end] if end > start else None
+
+
+def path_for(source_path: str) -> str:
+    return f"{source_path}{SUFFIX}"
+
+
+def _source_fingerprint(source_path: str) -> dict:
+    stat = os.stat(source_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _track_columns(track: smf.Track) -> t.Tuple[dict, bytes]:
+    try:
+        abs_ticks = array.array("q", itertools.accumulate(track.deltas))
+    except OverflowError as error:
+        # Every delta-time fits, but their running total may not
+        raise SidecarError("absolute ticks too large for a sidecar") from error
+    raw_offsets = array.array("q", [0])
+    blob = bytearray()
+    for raw in track.raw:
+        if raw is not None:
+            blob += raw
+        raw_offsets.append(len(blob))
+    columns = {
+        "deltas": array.array("q", track.deltas),
+        "abs_ticks": abs_ticks,
+        "statuses": track.statuses,
+        "notes": track.notes,
+        "velocities": track.velocities,
+        "flags": track.flags,
+        "raw_offsets": raw_offsets,
+        "note_indices": track.note_indices,
+    }
+    return columns, bytes(blob)
+
+
+def write(decoded: smf.SMF, source_path: str) -> str:
+    """Write the sidecar of the file at `source_path`, decoded as `decoded`,
+    and return its path. Raises `SidecarError`, writing nothing, if its
+    absolute ticks do not fit the sidecar's columns.
+    """
+    sections = []
+    offset = 0
+
+    def _add_section(data: bytes) -> t.List[int]:
+        nonlocal offset
+        padding = -len(data) % _ALIGNMENT
+        sections.append(bytes(data) + b"\0" * padding)
+        location = [offset, len(data)]
+        offset += len(data) + padding
+        return location
+
+    chunks = []
+    for chunk in decoded.chunks:
+        if isinstance(chunk, smf.Track):
+            columns, blob = _track_columns(chunk)
+            chunks.append(
+                {
+                    "kind": "track",
+                    "events": len(chunk),
+                    "columns": {
+                        name: _add_section(columns[name].tobytes())
+                        for name, _ in _COLUMNS
+                    },
+                    "blob": _add_section(blob),
+                }
+            )
+        else:
+            chunks.append({"kind": "raw", "data": _add_section(chunk)})
+    header = json.dumps(
+        {
+            **_source_fingerprint(source_path),
+            "byteorder": sys.byteorder,
+            "header": _add_section(decoded.header),
+            "trailer": _add_section(decoded.trailer),
+            "chunks": chunks,
+        }
+    ).encode()
+    header += b" " * (-(_PREAMBLE.size + len(header)) % _ALIGNMENT)
+
+    path = path_for(source_path)
+    temporary_path = os.path.join(
+        os.path.dirname(path), f".tmp-{uuid.uuid4().hex}"
+    )
+    with open(temporary_path, "wb") as file_obj:
+        file_obj.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        file_obj.write(header)
+        for section in sections:
+            file_obj.write(section)
+    os.replace(temporary_path, path)
+    return path
+
+
+def _check_header(preamble: bytes, read_header, source_path: str) -> dict:
+    magic, version, header_length = _PREAMBLE.unpack(preamble)
+    if magic != MAGIC or version != VERSION:
+        raise SidecarError(f"sidecar for {source_path} has an unknown format")
+    try:
+        header = json.loads(read_header(header_length))
+        byteorder = header["byteorder"]
+        fingerprint = {
+            key: header[key] for key in ("source_size", "source_mtime_ns")
+        }
+    except (ValueError, KeyError, TypeError) as error:
+        raise SidecarError(f"sidecar for {source_path} is malformed") from error
+    if byteorder != sys.byteorder:
+        raise SidecarError(f"sidecar for {source_path} has another byte order")
+    if fingerprint != _source_fingerprint(source_path):
+        raise SidecarError(f"sidecar for {source_path} is stale")
+    return header
+
+
+def is_fresh(source_path: str) -> bool:
+    """Whether the file at `source_path` has a sidecar `load` would accept.
+    Only the sidecar's header is read.
+    """
+    try:
+        with open(path_for(source_path), "rb") as file_obj:
+            _check_header(
+                file_obj.read(_PREAMBLE.size), file_obj.read, source_path
+            )
+    except (OSError, struct.error, ValueError):
+        return False
+    return True
+
+
+def load(source_path: str) -> smf.SMF:
+    """Load the sidecar of the file at `source_path`. Raises `SidecarError`
+    if it is missing, was written by another format version or on a machine
+    with another byte order, or is older than the file.
+    """
+    try:
+        with open(path_for(source_path), "rb") as file_obj:
+            mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError) as error:
+        raise SidecarError(f"no sidecar for {source_path}") from error
+    view = memoryview(mapped)
+    if len(view) < _PREAMBLE.size:
+        raise SidecarError(f"sidecar for {source_path} is truncated")
+    header_length = _PREAMBLE.unpack_from(view)[2]
+    header = _check_header(
+        bytes(view[:_PREAMBLE.size]),
+        lambda length: bytes(view[_PREAMBLE.size:_PREAMBLE.size + length]),
+        source_path,
+    )
+    data = view[_PREAMBLE.size + header_length:]
+
+    def _section(location):
+        start, length = location
+        return data[start:start + length]
+
+    chunks = []
+    for chunk in header["chunks"]:
+        if chunk["kind"] == "raw":
+            chunks.append(bytes(_section(chunk["data"])))
+            continue
+        columns = {
+            name: _section(chunk["columns"][name]).cast(typecode)
+            for name, typecode in _COLUMNS
+        }
+        track = smf.Track()
+        # Mutators rewrite delta-times, so they are the only copied column
+        track.deltas = array.array("q", columns["deltas"])
+        track.statuses = columns["statuses"]
+        track.notes = columns["notes"]
+        track.velocities = columns["velocities"]
+        track.flags = columns["flags"]
+        track.note_indices = columns["note_indices"]
+        track.raw = RawEvents(_section(chunk["blob"]), columns["raw_offsets"])
+        chunks.append(track)
+    return smf.SMF(
+        bytes(_section(header["header"])),
+        chunks,
+        bytes(_section(header["trailer"])),
+    )
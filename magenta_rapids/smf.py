@@ -0,0 +1,249 @@
+"""Minimal Standard MIDI File codec. Only what mutators need is decoded: the
+delta-time of every event, and the status, note and velocity of note events.
+All other events are kept as the raw bytes that followed their delta-time,
+and all chunks other than tracks as raw chunks, so decoding and re-encoding
+an unmodified file reproduces it byte for byte. Malformed files raise
+`SMFError`, in which case callers should fall back to `mido`.
+"""
+
+import array
+import struct
+import typing as t
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+
+# Flag set on note events which relied on running status in the source file
+RUNNING_STATUS = 0x01
+
+# Number of data bytes following each channel message status nibble
+_CHANNEL_DATA_LENGTHS = {
+    0x80: 2,
+    0x90: 2,
+    0xA0: 2,
+    0xB0: 2,
+    0xC0: 1,
+    0xD0: 1,
+    0xE0: 2,
+}
+
+
+class SMFError(ValueError):
+    """Raised when a file is not a well-formed Standard MIDI File."""
+
+
+class Track:
+    """Events of one track, stored column-wise. Every event has a delta-time
+    in `deltas`. Note events also have their status, note and velocity in the
+    matching columns and `None` in `raw`; every other event has its bytes in
+    `raw`. `note_indices` lists the positions of the note events.
+    """
+
+    __slots__ = (
+        "deltas",
+        "statuses",
+        "notes",
+        "velocities",
+        "flags",
+        "raw",
+        "note_indices",
+    )
+
+    def __init__(self):
+        self.deltas = array.array("q")
+        self.statuses = array.array("B")
+        self.notes = array.array("B")
+        self.velocities = array.array("B")
+        self.flags = array.array("B")
+        self.raw: t.List[t.Optional[bytes]] = []
+        self.note_indices = array.array("q")
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def set_deltas(self, indices: t.Iterable[int], values: t.Iterable[int]):
+        """Assign delta-times at `indices`. Mutated times may outgrow 64
+        bits, in which case the column becomes a list of Python integers.
+        """
+        indices, values = list(indices), list(values)
+        try:
+            for idx, value in zip(indices, values):
+                self.deltas[idx] = value
+        except OverflowError:
+            self.deltas = list(self.deltas)
+            for idx, value in zip(indices, values):
+                self.deltas[idx] = value
+
+    def append_note(self, delta, status, note, velocity, flags=0):
+        self.note_indices.append(len(self.deltas))
+        self.deltas.append(delta)
+        self.statuses.append(status)
+        self.notes.append(note)
+        self.velocities.append(velocity)
+        self.flags.append(flags)
+        self.raw.append(None)
+
+    def append_raw(self, delta, raw):
+        self.deltas.append(delta)
+        self.statuses.append(raw[0] if raw[0] >= 0x80 else 0)
+        self.notes.append(0)
+        self.velocities.append(0)
+        self.flags.append(0)
+        self.raw.append(raw)
+
+
+class SMF:
+    """A decoded Standard MIDI File. `chunks` holds the chunks following the
+    header in file order, either as a `Track` or as raw chunk bytes, and
+    `trailer` any bytes following the last chunk.
+    """
+
+    def __init__(self, header: bytes, chunks: list, trailer: bytes = b""):
+        self.header = header
+        self.chunks = chunks
+        self.trailer = trailer
+
+    @property
+    def tracks(self) -> t.List[Track]:
+        return [chunk for chunk in self.chunks if isinstance(chunk, Track)]
+
+    @property
+    def ticks_per_beat(self) -> int:
+        return struct.unpack_from(">h", self.header, 12)[0]
+
+
+def _read_variable_int(data, position, end):
+    # Like `mido`, quantities longer than the four bytes allowed by the
+    # standard are accepted, since mutated files may contain them
+    value = 0
+    while position < end:
+        byte = data[position]
+        position += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, position
+    raise SMFError("truncated variable-length quantity")
+
+
+def encode_variable_int(value: int) -> bytes:
+    if value < 0:
+        raise ValueError("variable int must be a non-negative integer")
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def _decode_track(data, position, end) -> Track:
+    try:
+        return _decode_events(data, position, end)
+    except OverflowError as error:
+        # The delta-time column holds 64-bit integers, which long
+        # variable-length quantities in mutated files can outgrow
+        raise SMFError("delta-time too large to decode") from error
+
+
+# pylint: disable=too-many-branches
+def _decode_events(data, position, end) -> Track:
+    track = Track()
+    running_status = None
+    while position < end:
+        delta, position = _read_variable_int(data, position, end)
+        start = position
+        status = data[position]
+        if status < 0x80:
+            if running_status is None:
+                raise SMFError("running status without a previous status")
+            status = running_status
+            flags = RUNNING_STATUS
+        else:
+            position += 1
+            flags = 0
+        if status == 0xFF:
+            if position >= end:
+                raise SMFError("truncated meta event")
+            length, position = _read_variable_int(data, position + 1, end)
+            position += length
+        elif status in (0xF0, 0xF7):
+            length, position = _read_variable_int(data, position, end)
+            position += length
+            running_status = status
+        elif status >= 0xF0:
+            raise SMFError(f"unexpected system message 0x{status:02x} in track")
+        else:
+            running_status = status
+            kind = status & 0xF0
+            data_end = position + _CHANNEL_DATA_LENGTHS[kind]
+            if data_end > end:
+                raise SMFError("truncated channel message")
+            if kind in (NOTE_ON, NOTE_OFF):
+                note, velocity = data[position], data[position + 1]
+                if note > 0x7F or velocity > 0x7F:
+                    raise SMFError("data byte out of range")
+                track.append_note(delta, status, note, velocity, flags)
+                position = data_end
+                continue
+            position = data_end
+        if position > end:
+            raise SMFError("event runs past the end of its track")
+        track.append_raw(delta, bytes(data[start:position]))
+    return track
+
+
+def decode(data: bytes) -> SMF:
+    data = memoryview(data)
+    if bytes(data[:4]) != b"MThd" or len(data) < 14:
+        raise SMFError("missing MThd header")
+    (header_length,) = struct.unpack_from(">I", data, 4)
+    if header_length < 6 or len(data) < 8 + header_length:
+        raise SMFError("truncated MThd header")
+    header = bytes(data[: 8 + header_length])
+    chunks = []
+    position = 8 + header_length
+    while len(data) - position >= 8:
+        name = bytes(data[position:position + 4])
+        (length,) = struct.unpack_from(">I", data, position + 4)
+        start, end = position + 8, position + 8 + length
+        if end > len(data):
+            raise SMFError(f"truncated {name!r} chunk")
+        if name == b"MTrk":
+            chunks.append(_decode_track(data, start, end))
+        else:
+            chunks.append(bytes(data[position:end]))
+        position = end
+    return SMF(header, chunks, bytes(data[position:]))
+
+
+def _encode_track(track: Track) -> bytes:
+    encoded = bytearray()
+    running_status = None
+    statuses, notes, velocities, flags = (
+        track.statuses,
+        track.notes,
+        track.velocities,
+        track.flags,
+    )
+    for idx, (delta, raw) in enumerate(zip(track.deltas, track.raw)):
+        encoded += encode_variable_int(delta)
+        if raw is None:
+            status = statuses[idx]
+            if not flags[idx] & RUNNING_STATUS or status != running_status:
+                encoded.append(status)
+            encoded.append(notes[idx])
+            encoded.append(velocities[idx])
+            running_status = status
+        else:
+            encoded += raw
+            if 0x80 <= raw[0] < 0xF0 or raw[0] in (0xF0, 0xF7):
+                running_status = raw[0]
+    return b"MTrk" + struct.pack(">I", len(encoded)) + encoded
+
+
+def encode(smf: SMF) -> bytes:
+    encoded = bytearray(smf.header)
+    for chunk in smf.chunks:
+        encoded += _encode_track(chunk) if isinstance(chunk, Track) else chunk
+    encoded += smf.trailer
+    return bytes(encoded)
@@ -6,34 +6,32 @@ may mut ate the value before returning it.
 
 import os
 import click
-from magenta_rapids import environment, backends, mutators
+from magenta_rapids import durability, file_utilities
+from magenta_rapids.lazy import lazy_import
 
+# Only imported by the commands with an environment, to keep startup fast
+backends = lazy_import("magenta_rapids.backends")
+environment = lazy_import("magenta_rapids.environment")
+mutators = lazy_import("magenta_rapids.mutators")
 
-def validate_file_exists_in_environment(ctx, name, value):
-    if not os.path.isfile(value):
-        raise click.BadParameter(
-            f"File {value} does not exist in environment", ctx=ctx, param=name
-        )
-    return value
 
-
-def validate_file_does_not_exist_at_source(ctx, name, value):
-    if os.path.isfile(value):
+def validate_midi_sources_exist(ctx, name, value):
+    paths = file_utilities.expand_midi_sources(value, click.get_text_stream("stdin"))
+    if not paths:
         raise click.BadParameter(
-            f"File {value} already exists at source", ctx=ctx, param=name
+            f"No files found at source {value}", ctx=ctx, param=name
         )
-    return value
-
-
-def validate_file_exists_at_source(ctx, name, value):
-    if not os.path.isfile(value):
+    missing = [path for path in paths if not os.path.isfile(path)]
+    if missing:
         raise click.BadParameter(
-            f"File {value} does not exist at source", ctx=ctx, param=name
+            f"Files {', '.join(missing)} do not exist at source", ctx=ctx, param=name
         )
-    return value
+    return paths
 
 
 def validate_empty_directory_exists(ctx, name, value):
+    if file_utilities.is_object_storage_url(value):
+        return value
     if not os.path.isdir(value):
         raise click.BadParameter(
             f"Directory {value} does not exist", ctx=ctx, param=name
@@ -47,6 +45,8 @@ def validate_empty_directory_exists(ctx, name, value):
 
 
 def validate_magenta_rapids_environment_exists(ctx, name, value):
+    if file_utilities.is_object_storage_url(value):
+        return value
     if not os.path.isdir(value):
         raise click.BadParameter(
             f"Directory {value} does not exist", ctx=ctx, param=name
@@ -55,10 +55,18 @@ def validate_magenta_rapids_environment_exists(ctx, name, value):
 
 
 def construct_environment_from_path_and_backend(ctx, name, value):
-    if not os.path.isdir(value):
+    if not file_utilities.is_object_storage_url(value) and not os.path.isdir(value):
         raise click.BadParameter(
             f"Directory {value} does not exist", ctx=ctx, param=name
         )
     return environment.Environment(
-        backend=backends.LocalFileBackend(value), mutator=mutators.SimpleMutator()
+        backend=backends.open_backend(value), mutator=mutators.SimpleMutator()
     )
+
+
+def validate_durability(ctx, name, value):
+    try:
+        durability.parse(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error), ctx=ctx, param=name) from error
+    return value
@@ -0,0 +1,350 @@
+"""Long-running watch mode for Magenta Rapids. A `Watcher` keeps one process,
+with its imports, mutator caches and worker pool, alive between batches. It
+detects files arriving in the unprocessed directory of a `LocalFileBackend`,
+waits until they have stopped changing, and mutates them incrementally.
+
+Files are detected with inotify where the platform provides it and by
+periodically scanning the directory otherwise. Either way a detector only
+reports paths which may have changed; the watcher considers a file ready
+once its size and modification time have been stable for the debounce
+interval, so partially written files are never mutated.
+"""
+
+import concurrent.futures
+import ctypes
+import ctypes.util
+import os
+import signal
+import struct
+import sys
+import time
+import typing as t
+from magenta_rapids.lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+def _walk_files(directory: str) -> t.Iterator[str]:
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            yield os.path.join(root, filename)
+
+
+class PollingDetector:
+    """Detects changes by scanning the directory tree, reporting the files
+    whose size or modification time differ from the previous scan.
+    """
+
+    def __init__(self, directory: str):
+        self._directory = directory
+        self._signatures = {}
+
+    def changed(self) -> t.List[str]:
+        signatures = {}
+        for path in _walk_files(self._directory):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signatures[path] = (stat.st_size, stat.st_mtime_ns)
+        changed = [
+            path
+            for path, signature in signatures.items()
+            if self._signatures.get(path) != signature
+        ]
+        self._signatures = signatures
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyDetector:
+    """Detects changes with Linux inotify, watching every directory of the
+    tree, including shard directories created after it started.
+    """
+
+    def __init__(self, directory: str):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directory = directory
+        self._directories = {}
+        self._initial = self._watch_tree(directory)
+
+    @classmethod
+    def available(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"))
+        except OSError:
+            return False
+        return hasattr(libc, "inotify_init1")
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def _watch_tree(self, directory: str) -> t.List[str]:
+        """Watch `directory` and its subdirectories, and return the files
+        already in them, which may have arrived before the watch did.
+        """
+        files = []
+        for root, _, filenames in os.walk(directory):
+            descriptor = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(root), _WATCH_MASK
+            )
+            if descriptor < 0:
+                raise OSError(ctypes.get_errno(), f"cannot watch {root}")
+            self._directories[descriptor] = root
+            files.extend(os.path.join(root, filename) for filename in filenames)
+        return files
+
+    def changed(self) -> t.List[str]:
+        changed, self._initial = self._initial, []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped, so anything may have changed
+                    changed.extend(_walk_files(self._directory))
+                    continue
+                directory = self._directories.get(descriptor)
+                if directory is None or not name:
+                    continue
+                path = os.path.join(directory, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.extend(self._watch_tree(path))
+                else:
+                    changed.append(path)
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_detector(directory: str, polling: bool = False):
+    if not polling and InotifyDetector.available():
+        return InotifyDetector(directory)
+    return PollingDetector(directory)
+
+
+def _unwrap(error: Exception) -> Exception:
+    """The exception raised by the stage of `Environment.mutate` which
+    failed, rather than the group its task group wraps it in.
+    """
+    while isinstance(error, ExceptionGroup) and len(error.exceptions) == 1:
+        error = error.exceptions[0]
+    return error
+
+
+# pylint: disable=too-many-instance-attributes
+class Watcher:
+    """Mutates the files arriving in a local environment until stopped.
+    `debounce` is the number of seconds a file must stay unchanged before it
+    is mutated, and `poll_interval` the number of seconds between scans
+    when inotify is unavailable. `on_batch` is called with the filenames of
+    every batch once it has been mutated, and `on_error` with the filename
+    and exception of every file which could not be catalogued or mutated.
+    Such files are left unprocessed, and watching goes on.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        environment,
+        number_steps: int,
+        jobs: int = 1,
+        debounce: float = 0.2,
+        poll_interval: float = 0.5,
+        polling: bool = False,
+        on_batch: t.Optional[t.Callable[[t.List[str]], None]] = None,
+        on_error: t.Optional[t.Callable[[str, Exception], None]] = None,
+    ):
+        self._environment = environment
+        self._backend = environment.backend
+        self._number_steps = number_steps
+        self._jobs = jobs or os.cpu_count()
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._polling = polling
+        self._on_batch = on_batch
+        self._on_error = on_error
+        # Path to its last seen (size, mtime) and when it was first seen
+        self._pending: t.Dict[str, t.Tuple[tuple, float]] = {}
+        self._polling_detector = polling
+        self._stop = None
+
+    def stop(self):
+        """Stop watching once the batch in progress has been mutated."""
+        if self._stop is not None:
+            self._stop.set()
+
+    def _note_changes(self, paths: t.Iterable[str]):
+        now = time.monotonic()
+        for path in paths:
+            if not self._backend.is_stored_file(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self._pending.get(path)
+            if previous is None or previous[0] != signature:
+                self._pending[path] = (signature, now)
+
+    def _ready_paths(self) -> t.List[str]:
+        """Pending files which have not changed for the debounce interval.
+        Files are checked again, since inotify may not report every write.
+        """
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self._pending.items()):
+            if now - since < self._debounce:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                self._pending[path] = ((stat.st_size, stat.st_mtime_ns), now)
+                continue
+            del self._pending[path]
+            ready.append(path)
+        return ready
+
+    def _next_wakeup(self) -> float:
+        timeout = self._poll_interval if self._polling_detector else None
+        if self._pending:
+            now = time.monotonic()
+            debounce_timeout = max(
+                min(since for _, since in self._pending.values())
+                + self._debounce - now,
+                0.0,
+            )
+            timeout = (
+                debounce_timeout if timeout is None
+                else min(timeout, debounce_timeout)
+            )
+        return timeout
+
+    async def _mutate(self, executor, filenames=None) -> t.List[str]:
+        """Mutate `filenames`, or every stored file, and return those which
+        could not be mutated. A batch which fails is mutated again one file
+        at a time, so that a bad file neither stops the watcher nor holds
+        back the others.
+        """
+        try:
+            await self._environment.mutate(
+                self._number_steps, jobs=self._jobs, filenames=filenames,
+                executor=executor,
+            )
+            return []
+        except Exception:  # pylint: disable=broad-except
+            pass
+        if filenames is None:
+            filenames = [row["filename"] for row in self._backend.list_files()]
+        failed = []
+        for filename in filenames:
+            try:
+                # Files already mutated by the failed batch are up to date
+                await self._environment.mutate(
+                    self._number_steps, jobs=self._jobs, filenames=[filename],
+                    executor=executor,
+                )
+            except Exception as error:  # pylint: disable=broad-except
+                failed.append(filename)
+                if self._on_error is not None:
+                    self._on_error(filename, _unwrap(error))
+        return failed
+
+    async def _index(self, paths: t.List[str]) -> t.List[str]:
+        """Catalog the files at `paths` and return their filenames, leaving
+        out those removed or made unreadable since they were noticed.
+        """
+        filenames = []
+        for path in paths:
+            try:
+                filenames.append(
+                    await asyncio.to_thread(self._backend.index_file, path)
+                )
+            except OSError as error:
+                if self._on_error is not None:
+                    self._on_error(os.path.basename(path), error)
+        return filenames
+
+    async def run(self):
+        """Mutate every file which is not up to date, then every file which
+        arrives, until `stop` is called or the process receives SIGINT or
+        SIGTERM.
+        """
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+        changed = asyncio.Event()
+        detector = make_detector(self._backend.unprocessed_path, self._polling)
+        self._polling_detector = isinstance(detector, PollingDetector)
+        if not self._polling_detector:
+            loop.add_reader(detector.fileno(), changed.set)
+        executor = (
+            concurrent.futures.ProcessPoolExecutor(max_workers=self._jobs)
+            if self._jobs > 1 else None
+        )
+        try:
+            # Catch up with files which arrived while nothing was watching.
+            # Files found by the detector are also left pending, so that
+            # files copied in without `store` get catalogued.
+            self._note_changes(detector.changed())
+            await self._mutate(executor)
+            while not self._stop.is_set():
+                stop_task = asyncio.ensure_future(self._stop.wait())
+                changed_task = asyncio.ensure_future(changed.wait())
+                await asyncio.wait(
+                    (stop_task, changed_task),
+                    timeout=self._next_wakeup(),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                stop_task.cancel()
+                changed_task.cancel()
+                changed.clear()
+                self._note_changes(
+                    await asyncio.to_thread(detector.changed)
+                    if self._polling_detector else detector.changed()
+                )
+                filenames = await self._index(self._ready_paths())
+                if filenames:
+                    failed = set(await self._mutate(executor, filenames))
+                    mutated = [name for name in filenames if name not in failed]
+                    if mutated and self._on_batch is not None:
+                        self._on_batch(mutated)
+        finally:
+            if not self._polling_detector:
+                loop.remove_reader(detector.fileno())
+            detector.close()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signal_number)
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
@@ -0,0 +1,192 @@
+"""In-process stand-in for an S3-compatible service, implementing the calls
+used by `magenta_rapids.s3` over keep-alive HTTP/1.1. Requests must carry a
+Signature Version 4 `Authorization` header, which is not verified.
+"""
+
+import collections
+import http.server
+import threading
+import time
+import urllib.parse
+import uuid
+from xml.etree import ElementTree
+
+NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+# pylint: disable=too-many-instance-attributes
+class FakeS3Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        """Each object read waits `latency` seconds before answering."""
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.buckets = collections.defaultdict(dict)
+        self.uploads = {}
+        self.requests = collections.Counter()
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures = 0
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        ).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Content-Length" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        self._respond(
+            status,
+            f"<Error><Code>{code}</Code><Message>{code}</Message></Error>".encode(),
+        )
+
+    def _handle(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urllib.parse.urlsplit(self.path)
+        bucket_name, _, key = (
+            urllib.parse.unquote(url.path).lstrip("/").partition("/")
+        )
+        query = {
+            name: values[0]
+            for name, values in urllib.parse.parse_qs(
+                url.query, keep_blank_values=True
+            ).items()
+        }
+        with self.server.lock:
+            self.server.requests[self.command] += 1
+            if self.server.failures:
+                self.server.failures -= 1
+                self._error(503, "SlowDown")
+                return
+        if not self.headers.get("Authorization", "").startswith(
+            "AWS4-HMAC-SHA256 Credential="
+        ):
+            self._error(403, "AccessDenied")
+            return
+        bucket = self.server.buckets[bucket_name]
+        if not key:
+            self._list(bucket, query)
+        elif self.command == "POST" and "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.server.uploads[upload_id] = {}
+            self._respond(
+                200,
+                f'<InitiateMultipartUploadResult xmlns="{NAMESPACE}">'
+                f"<UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>".encode(),
+            )
+        elif "uploadId" in query:
+            self._upload(bucket, key, query, body)
+        elif self.command in ("GET", "HEAD"):
+            time.sleep(self.server.latency)
+            if key not in bucket:
+                self._error(404, "NoSuchKey")
+            else:
+                self._respond(
+                    200, bucket[key], {"Content-Length": str(len(bucket[key]))}
+                )
+        elif self.command == "PUT":
+            bucket[key] = body
+            self._respond(200, headers={"ETag": f'"{uuid.uuid4().hex}"'})
+        elif self.command == "DELETE":
+            bucket.pop(key, None)
+            self._respond(204)
+
+    def _list(self, bucket, query):
+        keys = sorted(
+            key for key in bucket if key.startswith(query.get("prefix", ""))
+        )
+        if "continuation-token" in query:
+            keys = [key for key in keys if key > query["continuation-token"]]
+        page = keys[: int(query.get("max-keys", 1000))]
+        truncated = len(page) < len(keys)
+        self._respond(
+            200,
+            (
+                f'<ListBucketResult xmlns="{NAMESPACE}">'
+                + "".join(
+                    f"<Contents><Key>{key}</Key><Size>{len(bucket[key])}</Size>"
+                    "</Contents>"
+                    for key in page
+                )
+                + f"<IsTruncated>{str(truncated).lower()}</IsTruncated>"
+                + (
+                    f"<NextContinuationToken>{page[-1]}</NextContinuationToken>"
+                    if truncated
+                    else ""
+                )
+                + "</ListBucketResult>"
+            ).encode(),
+        )
+
+    def _upload(self, bucket, key, query, body):
+        parts = self.server.uploads.get(query["uploadId"])
+        if parts is None:
+            self._error(404, "NoSuchUpload")
+        elif self.command == "PUT":
+            etag = f'"{uuid.uuid4().hex}"'
+            parts[etag] = (int(query["partNumber"]), body)
+            self._respond(200, headers={"ETag": etag})
+        elif self.command == "POST":
+            completed = ElementTree.fromstring(body)
+            bucket[key] = b"".join(
+                parts[part.findtext("ETag")][1]
+                for part in sorted(
+                    completed.iter("Part"),
+                    key=lambda part: int(part.findtext("PartNumber")),
+                )
+            )
+            del self.server.uploads[query["uploadId"]]
+            self._respond(200, b"<CompleteMultipartUploadResult/>")
+        elif self.command == "DELETE":
+            del self.server.uploads[query["uploadId"]]
+            self._respond(204)
+
+    def _tracked(self):
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        try:
+            self._handle()
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _tracked
@@ -2,13 +2,22 @@
 """
 # pylint: disable=redefined-outer-name, unused-argument
 
+import asyncio
+import hashlib
+import io
 import os
 import tempfile
+import threading
 import pytest
 
 from magenta_rapids import backends
 
 
+EXAMPLE_FILE = os.path.join(
+    os.path.dirname(__file__), "example_files", "magenta-rapids-a-0.mid"
+)
+
+
 @pytest.fixture
 def local_file_backend():
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -19,3 +28,344 @@ def test_local_file_backend_initialization(local_file_backend):
     local_file_backend.initialize()
     assert os.path.exists(local_file_backend.processed_path)
     assert os.path.exists(local_file_backend.unprocessed_path)
+
+
+def test_local_file_backend_store_is_content_addressed(local_file_backend):
+    local_file_backend.initialize()
+    content = os.urandom(3 * backends.LocalFileBackend.STORE_CHUNK_SIZE // 2)
+    path = local_file_backend.store(io.BytesIO(content))
+    assert os.path.basename(path) == f"{hashlib.sha1(content).hexdigest()}.mid"
+    with open(path, "rb") as file_obj:
+        assert file_obj.read() == content
+    with pytest.raises(ValueError):
+        local_file_backend.store(io.BytesIO(content))
+    assert os.listdir(local_file_backend.unprocessed_path) == [os.path.basename(path)]
+
+
+@pytest.mark.parametrize("failing", ["catalog", "sidecar"])
+def test_local_file_backend_store_leaves_nothing_when_cataloguing_fails(
+    local_file_backend, monkeypatch, failing
+):
+    local_file_backend.initialize()
+    with open(EXAMPLE_FILE, "rb") as file_obj:
+        content = file_obj.read()
+
+    def _fail(*_):
+        raise OSError(f"cannot write the {failing}")
+
+    if failing == "catalog":
+        monkeypatch.setattr(local_file_backend, "_catalog_data", _fail)
+    else:
+        monkeypatch.setattr(backends.sidecar, "write", _fail)
+    with pytest.raises(OSError):
+        local_file_backend.store(io.BytesIO(content))
+    assert os.listdir(local_file_backend.unprocessed_path) == []
+    monkeypatch.undo()
+    path = local_file_backend.store(io.BytesIO(content))
+    assert sorted(os.listdir(local_file_backend.unprocessed_path)) == [
+        os.path.basename(path), os.path.basename(path) + ".cols",
+    ]
+    assert [row["filename"] for row in local_file_backend.list_files()] == [
+        os.path.basename(path)
+    ]
+
+
+def test_local_file_backend_store_reads_nothing_back(local_file_backend, monkeypatch):
+    local_file_backend.initialize(compression="zlib")
+
+    def _decompress(_):
+        raise AssertionError("stored file read back")
+
+    monkeypatch.setattr(local_file_backend, "_decompress", _decompress)
+    with open(EXAMPLE_FILE, "rb") as file_obj:
+        path = local_file_backend.store(file_obj)
+    assert local_file_backend.catalog.contains(os.path.basename(path))
+
+
+def test_local_file_backend_sharded_layout(local_file_backend):
+    local_file_backend.initialize(shard_depth=2)
+    content = b"MThd sharded"
+    digest = hashlib.sha1(content).hexdigest()
+    path = local_file_backend.store(io.BytesIO(content))
+    assert path == os.path.join(
+        local_file_backend.unprocessed_path, digest[:2], digest[2:4], f"{digest}.mid"
+    )
+    assert local_file_backend.contains(digest)
+
+    reopened = backends.LocalFileBackend(local_file_backend.path)
+    assert reopened.shard_depth == 2
+    reopened.save(io.BytesIO(b"processed"), f"{digest}.mid")
+    assert os.path.isfile(
+        os.path.join(
+            reopened.processed_path, digest[:2], digest[2:4], f"{digest}.mid"
+        )
+    )
+
+
+def test_local_file_backend_migrates_flat_layout(local_file_backend):
+    local_file_backend.initialize()
+    contents = [f"file {idx}".encode() for idx in range(5)]
+    for content in contents:
+        local_file_backend.store(io.BytesIO(content))
+    local_file_backend.migrate(shard_depth=1)
+
+    migrated = backends.LocalFileBackend(local_file_backend.path)
+    assert migrated.shard_depth == 1
+    for content in contents:
+        assert migrated.contains(hashlib.sha1(content).hexdigest())
+
+    async def _retrieve():
+        return sorted(
+            [file_obj.read() async for file_obj, _ in migrated.retrieve_all()]
+        )
+
+    assert asyncio.run(_retrieve()) == sorted(contents)
+    migrated.migrate(shard_depth=0)
+    assert len(os.listdir(migrated.unprocessed_path)) == len(contents)
+
+
+def test_local_file_backend_catalogs_stored_and_processed_files(local_file_backend):
+    local_file_backend.initialize()
+    with open(EXAMPLE_FILE, "rb") as file_obj:
+        path = local_file_backend.store(file_obj)
+    unparsable = os.path.basename(
+        local_file_backend.store(io.BytesIO(b"not a MIDI file"))
+    )
+    filename = os.path.basename(path)
+    local_file_backend.save(io.BytesIO(b"processed"), filename)
+
+    rows = {row["filename"]: row for row in local_file_backend.list_files()}
+    assert rows[filename]["processed"] == 1
+    assert rows[filename]["track_count"] == 1
+    assert rows[filename]["ticks_per_beat"] == 1024
+    assert rows[filename]["note_count"] > 0
+    assert rows[unparsable]["track_count"] is None
+    assert [
+        row["filename"] for row in local_file_backend.list_files(processed=False)
+    ] == [unparsable]
+    stats = local_file_backend.stats()
+    assert stats["files"] == 2 and stats["processed"] == 1
+
+    # Environments without a catalog are indexed from disk
+    local_file_backend.catalog.close()
+    os.remove(local_file_backend.catalog.path)
+    reopened = backends.LocalFileBackend(local_file_backend.path)
+    assert {
+        row["filename"]: row["processed"] for row in reopened.list_files()
+    } == {filename: 1, unparsable: 0}
+
+
+def test_local_file_backend_retrieve_all_reads_off_the_event_loop(tmp_path):
+    backend = backends.LocalFileBackend(str(tmp_path), io_concurrency=2, prefetch=3)
+    backend.initialize()
+    contents = {
+        os.path.basename(backend.store(io.BytesIO(f"file {idx}".encode()))): idx
+        for idx in range(10)
+    }
+    excluded = sorted(contents)[:4]
+    reader_threads = set()
+
+    def _exclude(filename):
+        reader_threads.add(threading.get_ident())
+        return filename in excluded
+
+    async def _retrieve():
+        retrieved = {}
+        async for file_obj, filename in backend.retrieve_all(exclude=_exclude):
+            retrieved[filename] = file_obj.read()
+            await backend.save_async(io.BytesIO(b"processed"), filename)
+        return retrieved
+
+    retrieved = asyncio.run(_retrieve())
+    assert sorted(retrieved) == sorted(contents)[4:]
+    assert threading.get_ident() not in reader_threads
+    assert backend.stats()["processed"] == 6
+
+
+def test_local_file_backend_fsck_reports_damaged_files(local_file_backend):
+    local_file_backend.initialize()
+    path = local_file_backend.store(io.BytesIO(b"stored"))
+    assert local_file_backend.fsck() == []
+    with open(path, "wb") as file_obj:
+        file_obj.write(b"tampered")
+    with open(os.path.join(local_file_backend.unprocessed_path, "extra.mid"), "wb"):
+        pass
+    assert local_file_backend.fsck() == [
+        f"{path} does not match the hash in its name",
+        "extra.mid is stored but not catalogued",
+    ]
+
+
+@pytest.fixture
+def pack_file_backend(tmp_path):
+    backend = backends.PackFileBackend(str(tmp_path), prefetch=3, pack_bytes=200)
+    backend.initialize()
+    yield backend
+    backend.close()
+
+
+def test_pack_file_backend_stores_retrieves_and_saves(pack_file_backend):
+    contents = {}
+    for idx in range(10):
+        data = f"file {idx}".encode() * 10
+        contents[pack_file_backend.store(io.BytesIO(data))] = data
+    with pytest.raises(ValueError):
+        pack_file_backend.store(io.BytesIO(contents[min(contents)]))
+    excluded = sorted(contents)[:4]
+
+    async def _retrieve(**kwargs):
+        retrieved = {}
+        async for file_obj, filename in pack_file_backend.retrieve_all(**kwargs):
+            retrieved[filename] = file_obj.read()
+            await pack_file_backend.save_async(io.BytesIO(b"processed"), filename)
+        return retrieved
+
+    retrieved = asyncio.run(_retrieve(exclude=lambda filename: filename in excluded))
+    assert retrieved == {
+        filename: data for filename, data in contents.items() if filename not in excluded
+    }
+    assert asyncio.run(_retrieve(filenames=excluded[:2] + ["0" * 40 + ".mid"])) == {
+        filename: contents[filename] for filename in excluded[:2]
+    }
+    assert pack_file_backend.stats()["processed"] == 8
+    assert pack_file_backend.retrieve_processed(excluded[0]) == b"processed"
+    assert pack_file_backend.contains(excluded[0].split(".")[0])
+
+    reopened = backends.open_backend(pack_file_backend.path)
+    assert isinstance(reopened, backends.PackFileBackend)
+    reopened.catalog.close()
+    os.remove(reopened.catalog.path)
+    reopened = backends.open_backend(pack_file_backend.path)
+    assert reopened.stats()["files"] == 10
+    assert reopened.stats()["processed"] == 8
+    assert reopened.fsck() == []
+    reopened.close()
+
+
+def test_pack_file_backend_compacts_superseded_outputs(pack_file_backend):
+    filename = pack_file_backend.store(io.BytesIO(b"stored"))
+    for idx in range(20):
+        pack_file_backend.save(io.BytesIO(bytes([idx]) * 50), filename)
+    sizes = pack_file_backend.compact()
+    assert sizes["processed"]["after"] < sizes["processed"]["before"] / 10
+    assert sizes["unprocessed"]["after"] == sizes["unprocessed"]["before"]
+    assert pack_file_backend.retrieve_processed(filename) == bytes([19]) * 50
+    assert pack_file_backend.fsck() == []
+
+
+@pytest.mark.parametrize(
+    "backend_class", [backends.LocalFileBackend, backends.PackFileBackend]
+)
+def test_compressed_backend_names_and_retrieves_uncompressed_contents(
+    tmp_path, backend_class
+):
+    backend = backend_class(str(tmp_path))
+    backend.initialize(compression="zlib:9")
+    assert str(backends.open_backend(str(tmp_path)).compression) == "zlib:9"
+    content = b"MThd compressible " * 1000
+    digest = hashlib.sha1(content).hexdigest()
+    backend.store(io.BytesIO(content))
+    assert backend.contains(digest)
+    with pytest.raises(ValueError):
+        backend.store(io.BytesIO(content))
+
+    async def _retrieve():
+        return [
+            (file_obj.read(), filename)
+            async for file_obj, filename in backend.retrieve_all()
+        ]
+
+    assert asyncio.run(_retrieve()) == [(content, f"{digest}.mid")]
+    backend.save(io.BytesIO(content[::-1]), f"{digest}.mid")
+    assert backend.retrieve_processed(f"{digest}.mid") == content[::-1]
+    on_disk = sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(backend.unprocessed_path)
+        for filename in filenames
+    )
+    assert on_disk < len(content) / 10
+    backend.reindex()
+    assert backend.stats()["files"] == 1
+    assert backend.fsck() == []
+
+
+@pytest.mark.parametrize("name", sorted(backends.BACKENDS))
+def test_retrieve_all_skips_reading_unneeded_contents(tmp_path, monkeypatch, name):
+    backend = backends.BACKENDS[name](str(tmp_path))
+    backend.initialize(compression="zlib")
+    contents = {}
+    for idx in range(6):
+        data = f"file {idx}".encode() * 10
+        contents[os.path.basename(backend.store(io.BytesIO(data)))] = data
+    decompressed = []
+    decompress = backend._decompress  # pylint: disable=protected-access
+    monkeypatch.setattr(
+        backend, "_decompress",
+        lambda data: decompressed.append(data) or decompress(data),
+    )
+    needed = set(sorted(contents)[::2])
+
+    async def _retrieve(**kwargs):
+        return {
+            filename: None if file_obj is None else file_obj.read()
+            async for file_obj, filename in backend.retrieve_all(
+                needs_contents=needed.__contains__, **kwargs
+            )
+        }
+
+    expected = {
+        filename: data if filename in needed else None
+        for filename, data in contents.items()
+    }
+    assert asyncio.run(_retrieve()) == expected
+    assert asyncio.run(_retrieve(filenames=sorted(contents))) == expected
+    assert len(decompressed) == 2 * len(needed)
+    if isinstance(backend, backends.PackFileBackend):
+        backend.close()
+
+
+def test_backend_rejects_unknown_compression(local_file_backend):
+    with pytest.raises(ValueError):
+        local_file_backend.initialize(compression="zlib:12")
+
+
+def test_in_memory_backend_stores_retrieves_and_snapshots(tmp_path):
+    backend = backends.InMemoryFileBackend(prefetch=2)
+    backend.initialize()
+    contents = {}
+    for idx in range(5):
+        data = f"file {idx}".encode()
+        contents[backend.store(io.BytesIO(data))] = data
+    first = min(contents)
+    assert first == f"{hashlib.sha1(contents[first]).hexdigest()}.mid"
+    with pytest.raises(ValueError):
+        backend.store(io.BytesIO(contents[first]))
+
+    async def _retrieve(**kwargs):
+        retrieved = {}
+        async for file_obj, filename in backend.retrieve_all(**kwargs):
+            retrieved[filename] = file_obj.read()
+            await backend.save_async(io.BytesIO(b"processed"), filename)
+        return retrieved
+
+    assert asyncio.run(_retrieve(exclude=lambda filename: filename == first)) == {
+        filename: data for filename, data in contents.items() if filename != first
+    }
+    backend.mark_up_to_date(first, {"key": 1})
+    assert not backend.is_up_to_date(first, {"key": 1})
+    backend.save(io.BytesIO(b"output"), first)
+    assert backend.is_up_to_date(first, {"key": 1})
+    assert backend.stats()["processed"] == 5
+    assert backend.fsck() == []
+
+    snapshot_path = str(tmp_path / "environment.zip")
+    backend.snapshot(snapshot_path)
+    assert os.listdir(tmp_path) == ["environment.zip"]
+    loaded = backends.InMemoryFileBackend()
+    loaded.load(snapshot_path)
+    assert loaded.contains(first.split(".")[0])
+    assert loaded.retrieve_processed(first) == b"output"
+    assert loaded.is_up_to_date(first, {"key": 1})
+    assert asyncio.run(_retrieve(filenames=[first])) == {first: contents[first]}
+    assert loaded.stats()["files"] == 5
+    assert loaded.list_files(processed=True)[0]["filename"] in contents
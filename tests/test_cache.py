@@ -0,0 +1,159 @@
+"""Tests for the Magenta Rapids mutation cache
+"""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import os
+import time
+from click.testing import CliRunner
+
+from magenta_rapids import backends, cache, environment, mutators
+from magenta_rapids.cli import cli
+from tests.utils import synthetic_midi
+
+
+def _mutated_files(root):
+    processed = {}
+    for directory, _, filenames in os.walk(os.path.join(root, "processed")):
+        for filename in filenames:
+            with open(os.path.join(directory, filename), "rb") as file_obj:
+                processed[filename] = file_obj.read()
+    return processed
+
+
+def test_results_are_found_in_memory_then_on_disk(tmp_path):
+    key = cache.cache_key("0" * 40, "mutator", 3)
+    first = cache.MutationCache(str(tmp_path))
+    assert first.get(key) is None
+    first.put(key, b"result")
+    assert first.get(key) == b"result"
+    # A new cache on the same directory, such as in a later run
+    second = cache.MutationCache(str(tmp_path))
+    assert second.get(key) == b"result"
+    assert second.get(key) == b"result"
+    assert first.stats() == cache.CacheStats(memory_hits=1, misses=1)
+    assert second.stats() == cache.CacheStats(memory_hits=1, disk_hits=1)
+    assert second.stats().hit_rate == 1.0
+
+
+def test_keys_depend_on_source_mutator_and_steps():
+    keys = {
+        cache.cache_key("a" * 40, "simple", 1),
+        cache.cache_key("b" * 40, "simple", 1),
+        cache.cache_key("a" * 40, "memoized", 1),
+        cache.cache_key("a" * 40, "simple", 2),
+    }
+    assert len(keys) == 4
+
+
+def test_both_tiers_are_bounded(tmp_path):
+    mutation_cache = cache.MutationCache(
+        str(tmp_path), memory_bytes=250, disk_bytes=500
+    )
+    for idx in range(10):
+        mutation_cache.put(str(idx) * 40, bytes(100))
+    stats = mutation_cache.stats()
+    assert stats.memory_evictions == 8
+    assert stats.disk_evictions > 0
+    assert cache.prune(str(tmp_path)).remaining_bytes <= 500
+    # The most recent results are kept
+    assert mutation_cache.get("9" * 40) is not None
+    assert mutation_cache.get("0" * 40) is None
+
+
+def test_prune_removes_old_then_least_recently_used_results(tmp_path):
+    mutation_cache = cache.MutationCache(str(tmp_path))
+    for idx in range(4):
+        mutation_cache.put(str(idx) * 40, bytes(10))
+    # pylint: disable=protected-access
+    old = time.time() - 10 * 86400
+    os.utime(mutation_cache._path("0" * 40), (old, old))
+    os.utime(mutation_cache._path("1" * 40), (old + 1, old + 1))
+    assert cache.prune(str(tmp_path), max_age=86400) == cache.PruneSummary(
+        removed=2, removed_bytes=20, remaining=2, remaining_bytes=20
+    )
+    mutation_cache.clear_memory()
+    assert mutation_cache.get("2" * 40) is not None
+    assert cache.prune(str(tmp_path), max_bytes=10).remaining == 1
+    assert mutation_cache.get("2" * 40) is not None
+
+
+def test_environments_share_results_through_the_cache(tmp_path):
+    mutation_cache = cache.MutationCache(str(tmp_path / "cache"))
+    environments = []
+    for name in ("first", "second"):
+        root = tmp_path / name
+        root.mkdir()
+        env = environment.Environment(
+            backend=backends.LocalFileBackend(str(root)),
+            mutator=mutators.SimpleMutator(),
+            mutation_cache=mutation_cache,
+        )
+        env.initialize()
+        for seed in range(3):
+            env.store(synthetic_midi(seed, number_events=20))
+        environments.append((env, str(root)))
+    for env, _ in environments:
+        asyncio.run(env.mutate(2))
+    assert mutation_cache.stats() == cache.CacheStats(memory_hits=3, misses=3)
+    assert _mutated_files(environments[0][1]) == _mutated_files(
+        environments[1][1]
+    )
+    assert len(_mutated_files(environments[1][1])) == 3
+
+
+def test_forced_runs_and_new_mutator_versions_skip_cached_results(
+    tmp_path, monkeypatch
+):
+    mutation_cache = cache.MutationCache(str(tmp_path / "cache"))
+    env = environment.Environment(
+        backend=backends.LocalFileBackend(str(tmp_path)),
+        mutator=mutators.SimpleMutator(),
+        mutation_cache=mutation_cache,
+    )
+    env.initialize()
+    filename = os.path.basename(env.store(synthetic_midi(0, number_events=20)))
+    key = cache.cache_key(filename.split(".")[0], env.mutator.identity, 2)
+    # Recorded by an earlier implementation of the mutator
+    mutation_cache.put(key, b"stale")
+    asyncio.run(env.mutate(2))
+    assert _mutated_files(str(tmp_path)) == {filename: b"stale"}
+    asyncio.run(env.mutate(2, force=True))
+    mutated = _mutated_files(str(tmp_path))[filename]
+    assert mutated != b"stale"
+    # The forced run replaced the stale result
+    assert mutation_cache.get(key) == mutated
+
+    monkeypatch.setattr(mutators.SimpleMutator, "VERSION", 2)
+    assert env.mutator.identity.endswith("SimpleMutator@2")
+    assert cache.cache_key(filename.split(".")[0], env.mutator.identity, 2) != key
+
+
+def test_cli_prunes_the_cache(tmp_path):
+    mutation_cache = cache.MutationCache(str(tmp_path))
+    for idx in range(3):
+        mutation_cache.put(str(idx) * 40, bytes(1000))
+    result = CliRunner().invoke(
+        cli, ["cache", "prune", "--cache_dir", str(tmp_path), "--max_mb", "0.002"],
+        catch_exceptions=False,
+    )
+    assert result.exit_code == 0
+    assert "Removed 1 result(s), 1000 bytes" in result.output
+
+
+def test_cli_only_caches_results_when_asked(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("MAGENTA_RAPIDS_CACHE_DIR", str(cache_dir))
+    environment_path = tmp_path / "environment"
+    environment_path.mkdir()
+    runner = CliRunner()
+    runner.invoke(cli, ["init", "-e", str(environment_path)], catch_exceptions=False)
+    backends.LocalFileBackend(str(environment_path)).store(synthetic_midi(0))
+    for arguments in ([], ["--force", "--cache"]):
+        result = runner.invoke(
+            cli, ["mutate", "-e", str(environment_path), *arguments],
+            catch_exceptions=False,
+        )
+        assert result.exit_code == 0
+        assert ("hit rate" in result.output) == bool(arguments)
+        assert cache_dir.exists() == bool(arguments)
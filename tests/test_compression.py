@@ -0,0 +1,35 @@
+"""Tests for Magenta Rapids compression
+"""
+
+import pytest
+
+from magenta_rapids import compression
+
+
+def test_parse_compression():
+    assert compression.parse("none") is None
+    assert compression.parse(None) is None
+    assert compression.parse("zlib") == compression.Compression("zlib", 6)
+    assert compression.parse("lzma:9") == compression.Compression("lzma", 9)
+    assert str(compression.parse("zlib:1")) == "zlib:1"
+    for value in ("gzip", "zlib:10", "lzma:fast", "zlib:"):
+        with pytest.raises(ValueError):
+            compression.parse(value)
+
+
+@pytest.mark.parametrize("codec", compression.CODECS)
+def test_compression_round_trips_incrementally(codec):
+    data = bytes(range(256)) * 100
+    for level in (0, 9):
+        setting = compression.Compression(codec, level)
+        compressor = setting.compressor()
+        compressed = b"".join(
+            compressor.compress(data[start:start + 1000])
+            for start in range(0, len(data), 1000)
+        ) + compressor.flush()
+        assert setting.decompress(compressed) == data
+        assert setting.decompress(setting.compress(data)) == data
+        with pytest.raises(ValueError):
+            setting.decompress(compressed[:len(compressed) // 2])
+        with pytest.raises(ValueError):
+            setting.decompress(data)
@@ -0,0 +1,95 @@
+"""Tests for Magenta Rapids atomic writes and durability policies
+"""
+# pylint: disable=redefined-outer-name
+
+import io
+import os
+import pytest
+
+from magenta_rapids import backends, durability
+from tests.utils import synthetic_midi
+
+
+@pytest.fixture
+def fsynced(monkeypatch):
+    """Paths of the files and directories flushed, in order."""
+    paths = []
+    real_fsync = os.fsync
+
+    def _fsync(fd):
+        paths.append(os.readlink(f"/proc/self/fd/{fd}"))
+        real_fsync(fd)
+
+    monkeypatch.setattr(durability.os, "fsync", _fsync)
+    return paths
+
+
+def test_parse_durability():
+    assert durability.parse(None) == durability.Durability("none")
+    assert durability.parse("file") == durability.Durability("file")
+    assert durability.parse("group") == durability.Durability("group", 64)
+    assert durability.parse("group:8") == durability.Durability("group", 8)
+    assert str(durability.parse("group:8")) == "group:8"
+    assert str(durability.parse("none")) == "none"
+    for value in ("always", "file:2", "group:0", "group:", "group:-1"):
+        with pytest.raises(ValueError):
+            durability.parse(value)
+
+
+@pytest.mark.parametrize("backend_class", [
+    backends.LocalFileBackend, backends.PackFileBackend,
+])
+def test_durability_policies_flush_writes(tmp_path, fsynced, backend_class):
+    counts = {}
+    for policy in ("none", "file", "group:4"):
+        root = tmp_path / policy
+        root.mkdir()
+        backend = backend_class(str(root), durability=policy)
+        backend.initialize()
+        backend.flush()
+        del fsynced[:]
+        for seed in range(6):
+            filename = os.path.basename(backend.store(synthetic_midi(seed)))
+            backend.save(io.BytesIO(b"output"), filename)
+            backend.mark_up_to_date(filename, {"seed": seed})
+        before_flush = len(fsynced)
+        backend.flush()
+        counts[policy] = (before_flush, len(fsynced))
+        if policy != "none":
+            # Outputs reach stable storage before the manifest, written
+            # last through a temporary file, records them
+            assert os.path.dirname(fsynced[-2]) == str(root)
+            assert fsynced[-1] == str(root)
+        if backend_class is backends.PackFileBackend:
+            backend.close()
+    assert counts["none"] == (0, 0)
+    per_write = 2 if backend_class is backends.LocalFileBackend else 3
+    # 12 writes, each with its directory
+    assert counts["file"] == (12 * per_write, 12 * per_write + 2)
+    # 3 groups of 4 writes, each with one fsync for each of the files they
+    # wrote to and for each of their 2 directories
+    assert counts["group:4"] == (18, 20)
+
+
+def test_interrupted_save_leaves_previous_output(tmp_path, monkeypatch):
+    backend = backends.LocalFileBackend(str(tmp_path), durability="file")
+    backend.initialize()
+    filename = os.path.basename(backend.store(synthetic_midi(0)))
+    backend.save(io.BytesIO(b"first"), filename)
+
+    def _crash(*_):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(backends.os, "replace", _crash)
+    with pytest.raises(KeyboardInterrupt):
+        backend.save(io.BytesIO(b"second"), filename)
+    monkeypatch.undo()
+    assert backend.retrieve_processed(filename) == b"first"
+    assert os.listdir(backend.processed_path) == [filename]
+    assert backend.fsck() == []
+
+    # What a killed process leaves behind
+    leftover = os.path.join(backend.processed_path, ".tmp-0123")
+    with open(leftover, "wb") as file_obj:
+        file_obj.write(b"sec")
+    assert backend.fsck() == [f"{leftover} was left by an interrupted write"]
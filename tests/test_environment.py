@@ -0,0 +1,215 @@
+"""Tests for Magenta Rapids environments
+"""
+# pylint: disable=redefined-outer-name, unused-argument, too-few-public-methods
+
+import asyncio
+import io
+import os
+import tempfile
+import pytest
+
+from magenta_rapids import backends, environment, mutators, sidecar
+from tests.utils import synthetic_midi
+
+
+def _read_processed(backend):
+    processed = {}
+    for filename in os.listdir(backend.processed_path):
+        with open(os.path.join(backend.processed_path, filename), "rb") as file_obj:
+            processed[filename] = file_obj.read()
+    return processed
+
+
+@pytest.fixture
+def make_environment():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        def _make(name, number_files=6):
+            root = os.path.join(tmpdir, name)
+            os.mkdir(root)
+            backend = backends.LocalFileBackend(root)
+            env = environment.Environment(
+                backend=backend, mutator=mutators.SimpleMutator()
+            )
+            env.initialize()
+            for seed in range(number_files):
+                env.store(synthetic_midi(seed, number_events=50))
+            return env, backend
+        yield _make
+
+
+def test_parallel_mutate_matches_serial_mutate(make_environment):
+    serial, serial_backend = make_environment("serial")
+    parallel, parallel_backend = make_environment("parallel")
+    asyncio.run(serial.mutate(4))
+    asyncio.run(parallel.mutate(4, jobs=2))
+    expected = _read_processed(serial_backend)
+    assert len(expected) == 6
+    assert _read_processed(parallel_backend) == expected
+
+
+class _RecordingBackend:
+    def __init__(self, number_files, log):
+        self._number_files = number_files
+        self._log = log
+
+    async def retrieve_all(self, exclude=None, filenames=None, needs_contents=None):
+        for idx in range(self._number_files):
+            if exclude is not None and exclude(idx):
+                continue
+            self._log.append(("read", idx))
+            yield io.BytesIO(str(idx).encode()), idx
+
+    def save(self, file, filename):
+        self._log.append(("save", filename))
+
+    async def save_async(self, file, filename):
+        self.save(file, filename)
+
+    def source_digest(self, filename):
+        return str(filename)
+
+    def is_up_to_date(self, filename, key):
+        return False
+
+    def mark_up_to_date(self, filename, key):
+        pass
+
+    def flush(self):
+        pass
+
+    def sidecar_source(self, filename):
+        return None
+
+
+class _RecordingMutator:
+    identity = "recording"
+
+    def __init__(self, log):
+        self._log = log
+
+    def mutate(self, file_object, number_steps):
+        self._log.append(("mutate", int(file_object.read())))
+        return io.BytesIO(b"")
+
+
+def test_mutate_pipeline_is_bounded_and_overlapped():
+    log = []
+    env = environment.Environment(
+        backend=_RecordingBackend(20, log), mutator=_RecordingMutator(log)
+    )
+    asyncio.run(env.mutate(1, read_queue_depth=1, write_queue_depth=1))
+    assert sorted(filename for stage, filename in log if stage == "save") == list(
+        range(20)
+    )
+    first_save = log.index(("save", 0))
+    assert first_save < log.index(("mutate", 19))
+    # No stage runs more than the queue depths ahead of the writer
+    assert log.index(("read", 6)) > first_save
+
+
+def test_mutate_skips_up_to_date_outputs(make_environment):
+    env, backend = make_environment("incremental", number_files=3)
+    asyncio.run(env.mutate(2))
+    processed = _read_processed(backend)
+    stale = sorted(processed)[0]
+    with open(os.path.join(backend.processed_path, stale), "wb") as file_obj:
+        file_obj.write(b"stale")
+    os.remove(os.path.join(backend.processed_path, sorted(processed)[1]))
+
+    # Reload the manifest from disk, as a fresh run would
+    env = environment.Environment(
+        backend=backends.LocalFileBackend(backend.path),
+        mutator=mutators.SimpleMutator(),
+    )
+    asyncio.run(env.mutate(2))
+    current = _read_processed(backend)
+    assert current[stale] == b"stale"
+    assert current == {**processed, stale: b"stale"}
+
+    asyncio.run(env.mutate(2, force=True))
+    assert _read_processed(backend) == processed
+
+    # A different number of steps makes every output stale
+    asyncio.run(env.mutate(3))
+    current = _read_processed(backend)
+    assert all(current[name] != output for name, output in processed.items())
+
+
+def test_store_many_reports_duplicates(make_environment, tmp_path):
+    env, backend = make_environment("bulk", number_files=1)
+    paths = []
+    for seed in (0, 1, 2, 1):
+        path = tmp_path / f"{len(paths)}.mid"
+        path.write_bytes(synthetic_midi(seed, number_events=50).read())
+        paths.append(str(path))
+    summary = env.store_many(paths, jobs=2)
+    assert sorted(summary.stored) == [paths[1], paths[2]]
+    assert sorted(summary.duplicates) == [paths[0], paths[3]]
+    stored = [
+        filename
+        for filename in os.listdir(backend.unprocessed_path)
+        if not filename.endswith(sidecar.SUFFIX)
+    ]
+    assert len(stored) == 3
+
+
+def test_pack_environment_mutates_like_local_environment(make_environment, tmp_path):
+    local, local_backend = make_environment("local")
+    pack_backend = backends.PackFileBackend(str(tmp_path))
+    pack = environment.Environment(
+        backend=pack_backend, mutator=mutators.SimpleMutator()
+    )
+    pack.initialize()
+    for seed in range(6):
+        pack.store(synthetic_midi(seed, number_events=50))
+    asyncio.run(local.mutate(3))
+    asyncio.run(pack.mutate(3, jobs=2))
+    assert {
+        filename: pack_backend.retrieve_processed(filename)
+        for filename in _read_processed(local_backend)
+    } == _read_processed(local_backend)
+
+
+def test_compressed_environment_mutates_like_uncompressed(make_environment, tmp_path):
+    plain, plain_backend = make_environment("plain")
+    compressed_backend = backends.LocalFileBackend(str(tmp_path))
+    compressed_backend.initialize(compression="lzma")
+    compressed = environment.Environment(
+        backend=compressed_backend, mutator=mutators.SimpleMutator()
+    )
+    for seed in range(6):
+        compressed.store(synthetic_midi(seed, number_events=50))
+    asyncio.run(plain.mutate(3))
+    asyncio.run(compressed.mutate(3, jobs=2))
+    expected = _read_processed(plain_backend)
+    assert {
+        filename: compressed_backend.retrieve_processed(filename)
+        for filename in expected
+    } == expected
+    assert _read_processed(compressed_backend) != expected
+
+
+def test_in_memory_environment_mutates_like_local_environment(
+    make_environment, monkeypatch
+):
+    local, local_backend = make_environment("local")
+    memory_backend = backends.InMemoryFileBackend()
+    memory = environment.Environment(
+        backend=memory_backend, mutator=mutators.SimpleMutator()
+    )
+    memory.initialize()
+    for seed in range(6):
+        memory.store(synthetic_midi(seed, number_events=50))
+    asyncio.run(local.mutate(3))
+    asyncio.run(memory.mutate(3, jobs=2))
+    expected = _read_processed(local_backend)
+    assert {
+        filename: memory_backend.retrieve_processed(filename)
+        for filename in expected
+    } == expected
+    saved = []
+    monkeypatch.setattr(
+        memory_backend, "save", lambda file, filename: saved.append(filename)
+    )
+    asyncio.run(memory.mutate(3))
+    assert not saved
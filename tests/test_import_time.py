@@ -0,0 +1,78 @@
+"""Import-time regression tests for the Magenta Rapids CLI. Each command runs
+in a fresh interpreter with `-X importtime`; commands which do not touch MIDI
+data or run event loops must not import the heavy modules, and everything
+they import must fit within a time budget.
+"""
+# pylint: disable=redefined-outer-name
+
+import os
+import subprocess
+import sys
+import pytest
+
+from tests.utils import synthetic_midi
+
+# Generous enough for slow CI hosts; the CLI itself takes around 50ms
+IMPORT_BUDGET_US = int(os.environ.get("MAGENTA_RAPIDS_IMPORT_BUDGET_MS", "200")) * 1000
+
+# `http` comes with the S3 client, which local environments never need
+FORBIDDEN_MODULES = ("mido", "numpy", "rtmidi", "asyncio", "http")
+
+
+def _import_times(arguments, cwd):
+    """Modules imported by the CLI after interpreter startup, mapped to
+    their cumulative import time in microseconds.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "magenta_rapids", *arguments],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        entries.append((name.rstrip(), int(cumulative)))
+    # Everything up to `site` is interpreter startup
+    startup_end = next(
+        idx for idx, (name, _) in enumerate(entries) if name == " site"
+    )
+    return entries[startup_end + 1:]
+
+
+@pytest.fixture
+def command_arguments(tmp_path):
+    environment_path = tmp_path / "environment"
+    environment_path.mkdir()
+    source_path = tmp_path / "source.mid"
+    source_path.write_bytes(synthetic_midi(0, number_events=10).read())
+    return {
+        "help": ["--help"],
+        "init": ["init", "-e", str(environment_path)],
+        "store": ["store", "-e", str(environment_path), "-f", str(source_path)],
+    }
+
+
+def test_commands_import_quickly(command_arguments):
+    repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # Runs in order, so `store` finds the environment created by `init`
+    for command, arguments in command_arguments.items():
+        entries = _import_times(arguments, repository_root)
+        imported = {name.strip() for name, _ in entries}
+        heavy = sorted(
+            name
+            for name in imported
+            if name.split(".")[0] in FORBIDDEN_MODULES
+        )
+        assert not heavy, f"{command} imports {heavy}"
+        total = sum(
+            cumulative
+            for name, cumulative in entries
+            if not name.startswith("  ")
+        )
+        assert total < IMPORT_BUDGET_US, (
+            f"{command} spends {total / 1000:.0f}ms importing modules"
+        )
@@ -0,0 +1,29 @@
+"""Tests for Magenta Rapids deferred imports
+"""
+
+import concurrent.futures
+import sys
+
+from magenta_rapids.lazy import lazy_import
+
+
+def test_lazy_modules_first_used_from_many_threads_execute_once(
+    tmp_path, monkeypatch
+):
+    executions = tmp_path / "executions"
+    # Slow enough to execute that every thread arrives while it runs
+    (tmp_path / "slow_module.py").write_text(
+        "import time\n"
+        f"with open({str(executions)!r}, 'a') as file_obj:\n"
+        "    file_obj.write('.')\n"
+        "time.sleep(0.2)\n"
+        "VALUE = 42\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    module = lazy_import("slow_module")
+    assert not executions.exists()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        values = list(executor.map(lambda _: module.VALUE, range(8)))
+    assert values == [42] * 8
+    assert executions.read_text() == "."
+    monkeypatch.delitem(sys.modules, "slow_module")
@@ -0,0 +1,96 @@
+"""Tests for Magenta Rapids metrics
+"""
+# pylint: disable=redefined-outer-name, unused-argument
+
+import asyncio
+import json
+import tempfile
+import pytest
+from click.testing import CliRunner
+
+from magenta_rapids import backends, environment, metrics, mutators
+from magenta_rapids.cli import cli
+from tests.utils import synthetic_midi
+
+
+@pytest.fixture
+def enabled_metrics():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing():
+    metrics.reset()
+    with metrics.timer("stage"):
+        metrics.count("counter")
+    assert metrics.summary() == {"stages": {}, "counters": {}}
+
+
+def test_summary_describes_every_stage(enabled_metrics):
+    for _ in range(3):
+        with metrics.timer("stage"):
+            metrics.count("counter", 2)
+    list(metrics.timed_iter("iteration", range(4)))
+    described = metrics.summary()
+    assert described["counters"] == {"counter": 6}
+    assert described["stages"]["stage"]["count"] == 3
+    assert sum(described["stages"]["stage"]["histogram"].values()) == 3
+    assert described["stages"]["iteration"]["count"] == 4
+
+
+def test_merge_adds_a_snapshot(enabled_metrics):
+    metrics.count("counter")
+    recorded = metrics.snapshot()
+    metrics.merge(recorded)
+    assert metrics.summary()["counters"] == {"counter": 2}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_mutate_records_stages_of_every_layer(enabled_metrics, jobs):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = environment.Environment(
+            backend=backends.LocalFileBackend(tmpdir),
+            mutator=mutators.SimpleMutator(),
+        )
+        env.initialize()
+        for seed in range(3):
+            env.store(synthetic_midi(seed, number_events=20))
+        metrics.reset()
+        asyncio.run(env.mutate(2, jobs=jobs))
+    described = metrics.summary()
+    for stage in (
+        "sidecar.load", "backend.save", "environment.mutate_file",
+        "mutator.alter", "mutator.encode",
+    ):
+        assert described["stages"][stage]["count"] == 3
+    # Every file is loaded from its sidecar, so none is read
+    assert "backend.read" not in described["stages"]
+    assert described["counters"]["environment.files_mutated"] == 3
+    assert described["counters"]["mutator.note_events"] == 3 * 3 * 40
+
+
+def test_cli_writes_metrics_and_profile(tmp_path):
+    runner = CliRunner()
+    environment_path = tmp_path / "environment"
+    environment_path.mkdir()
+    runner.invoke(cli, ["init", "-e", str(environment_path)], catch_exceptions=False)
+    try:
+        result = runner.invoke(
+            cli,
+            [
+                "--metrics-out", str(tmp_path / "metrics.json"),
+                "--cprofile-out", str(tmp_path / "reindex.prof"),
+                "reindex", "-e", str(environment_path),
+            ],
+            catch_exceptions=False,
+        )
+    finally:
+        metrics.disable()
+        metrics.reset()
+    assert result.exit_code == 0
+    with open(tmp_path / "metrics.json", encoding="utf-8") as file_obj:
+        assert set(json.load(file_obj)) == {"stages", "counters"}
+    assert (tmp_path / "reindex.prof").stat().st_size > 0
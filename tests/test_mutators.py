@@ -0,0 +1,124 @@
+"""Tests for Magenta Rapids mutators
+"""
+# pylint: disable=redefined-outer-name
+
+import io
+import os
+import mido
+import pytest
+
+from magenta_rapids import metrics, mutators
+from tests.utils import synthetic_midi
+
+EXAMPLE_FILE = os.path.join(
+    os.path.dirname(__file__), "example_files", "magenta-rapids-a-0.mid"
+)
+
+
+@pytest.fixture
+def example_file():
+    with open(EXAMPLE_FILE, "rb") as file_obj:
+        yield io.BytesIO(file_obj.read())
+
+
+@pytest.mark.parametrize("number_steps", [0, 1, 2, 5, 13])
+def test_vectorized_mutator_matches_simple_mutator(example_file, number_steps):
+    expected = mutators.SimpleMutator().mutate(example_file, number_steps)
+    actual = mutators.VectorizedMutator().mutate(example_file, number_steps)
+    assert actual.read() == expected.read()
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("number_steps", [1, 3, 8])
+def test_vectorized_mutator_matches_simple_mutator_on_synthetic_files(
+    seed, number_steps
+):
+    source = synthetic_midi(seed)
+    expected = mutators.SimpleMutator().mutate(source, number_steps)
+    actual = mutators.VectorizedMutator().mutate(source, number_steps)
+    assert actual.read() == expected.read()
+
+
+def test_vectorized_mutator_rejects_note_zero_like_simple_mutator():
+    file = mido.MidiFile()
+    file.tracks.append(
+        mido.MidiTrack([mido.Message("note_on", note=0, time=10)])
+    )
+    source = io.BytesIO()
+    file.save(file=source)
+    with pytest.raises(ZeroDivisionError):
+        mutators.SimpleMutator().mutate(source, 1)
+    with pytest.raises(ZeroDivisionError):
+        mutators.VectorizedMutator().mutate(source, 1)
+
+
+@pytest.mark.parametrize("number_steps", [0, 1, 13])
+def test_memoized_mutator_matches_simple_mutator(example_file, number_steps):
+    expected = mutators.SimpleMutator().mutate(example_file, number_steps)
+    actual = mutators.MemoizedMutator().mutate(example_file, number_steps)
+    assert actual.read() == expected.read()
+
+
+def test_memoized_mutator_counts_repeated_events(example_file):
+    mutator = mutators.MemoizedMutator()
+    mutator.mutate(example_file, 3)
+    misses = mutator.cache_info().misses
+    assert misses > 0
+    mutator.mutate(example_file, 3)
+    assert mutator.cache_info().misses == misses
+    assert mutator.cache_info().hits > 0
+
+
+def test_memoized_mutator_cache_is_bounded(example_file):
+    mutator = mutators.MemoizedMutator(cache_size=8)
+    mutator.mutate(example_file, 3)
+    assert mutator.cache_info().currsize == 8
+
+
+@pytest.mark.parametrize("number_steps", [0, 1, 4])
+def test_pipeline_matches_chained_mutators(example_file, number_steps):
+    expected = mutators.MemoizedMutator().mutate(
+        mutators.SimpleMutator().mutate(example_file, 2), number_steps
+    )
+    pipeline = mutators.parse_pipeline("simple:2,memoized")
+    assert pipeline.mutate(example_file, number_steps).read() == expected.read()
+
+
+def test_pipeline_decodes_and_encodes_once(example_file):
+    metrics.reset()
+    metrics.enable()
+    try:
+        mutators.parse_pipeline("simple,vectorized,memoized").mutate(
+            example_file, 1
+        )
+        described = metrics.summary()
+    finally:
+        metrics.disable()
+        metrics.reset()
+    assert described["stages"]["mutator.decode"]["count"] == 1
+    assert described["stages"]["mutator.encode"]["count"] == 1
+
+
+def test_pipeline_mido_fallback_matches_chained_mutators(example_file):
+    mutator = mutators.SimpleMutator()
+    # pylint: disable=protected-access
+    expected = mutator._mutate_with_mido(
+        mutator._mutate_with_mido(example_file, 1), 3
+    )
+    example_file.seek(0)
+    pipeline = mutators.parse_pipeline("simple:1,vectorized:3")
+    actual = pipeline._mutate_with_mido(example_file, 0)
+    assert actual.read() == expected.read()
+
+
+@pytest.mark.parametrize("spec", ["simple,unknown", "simple:x", "simple:-1", ""])
+def test_parse_pipeline_rejects_invalid_specs(spec):
+    with pytest.raises(ValueError):
+        mutators.parse_pipeline(spec)
+
+
+def test_pipeline_identity_depends_on_its_stages():
+    assert (
+        mutators.parse_pipeline("simple:2,memoized").identity
+        != mutators.parse_pipeline("simple,memoized").identity
+    )
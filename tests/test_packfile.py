@@ -0,0 +1,91 @@
+"""Tests for Magenta Rapids pack files
+"""
+# pylint: disable=redefined-outer-name
+
+import hashlib
+import os
+import pytest
+
+from magenta_rapids import packfile
+
+
+def _name(data: bytes) -> str:
+    return f"{hashlib.sha1(data).hexdigest()}.mid"
+
+
+@pytest.fixture
+def pack_set(tmp_path):
+    packs = packfile.PackSet(str(tmp_path), pack_bytes=1000)
+    yield packs
+    packs.close()
+
+
+def test_appended_files_are_read_back_after_reopening(pack_set):
+    contents = [os.urandom(300) for _ in range(10)]
+    for data in contents:
+        pack_set.append(_name(data), data)
+    # Packs are rolled over once they hold `pack_bytes`
+    assert len(pack_set.pack_numbers()) > 1
+    reopened = packfile.PackSet(pack_set.directory)
+    assert [reopened.read(_name(data)) for data in contents] == contents
+    assert [name for name, _ in reopened.scan()] == [_name(data) for data in contents]
+    assert _name(contents[0]) in reopened
+    assert "0" * 40 + ".mid" not in reopened
+    reopened.close()
+
+
+def test_later_copies_supersede_earlier_ones_until_compacted(pack_set):
+    name = _name(b"source")
+    for idx in range(5):
+        pack_set.append(name, bytes([idx]) * 200)
+    pack_set.append(_name(b"other"), b"other")
+    with pytest.raises(FileExistsError):
+        pack_set.append(name, b"again", replace=False)
+    assert pack_set.read(name) == bytes([4]) * 200
+    report = pack_set.fsck()
+    assert report.problems == []
+    assert (report.records, report.live) == (6, 2)
+    assert report.dead_bytes > 800
+    before, after = pack_set.compact()
+    assert after < before
+    assert pack_set.fsck() == packfile.FsckReport([], 2, 2, 0)
+    assert dict(pack_set.scan()) == {name: bytes([4]) * 200, _name(b"other"): b"other"}
+
+
+def test_index_is_rebuilt_from_the_packs(pack_set):
+    contents = [os.urandom(100) for _ in range(3)]
+    for data in contents:
+        pack_set.append(_name(data), data)
+    pack_set.close()
+    # Lose the last index entry and part of the one before it
+    with open(pack_set.index_path, "r+b") as file_obj:
+        file_obj.truncate(os.path.getsize(pack_set.index_path) - 50)
+    damaged = packfile.PackSet(pack_set.directory)
+    assert len(damaged) == 1
+    assert len(damaged.fsck().problems) == 2
+    damaged.rebuild_index()
+    assert damaged.fsck().problems == []
+    assert [damaged.read(_name(data)) for data in contents] == contents
+    damaged.close()
+
+
+def test_fsck_reports_corrupt_and_truncated_records(pack_set):
+    contents = [os.urandom(100) for _ in range(3)]
+    for data in contents:
+        pack_set.append(_name(data), data)
+    pack_set.close()
+    location = pack_set.location(_name(contents[0]))
+    path = pack_set.pack_path(location.pack)
+    with open(path, "r+b") as file_obj:
+        file_obj.seek(location.offset)
+        file_obj.write(b"\0")
+        file_obj.truncate(os.path.getsize(path) - 10)
+    problems = packfile.PackSet(pack_set.directory).fsck().problems
+    assert any("checksum mismatch" in problem for problem in problems)
+    assert any("truncated record" in problem for problem in problems)
+    assert any("points at no record" in problem for problem in problems)
+
+
+def test_names_must_be_content_addresses(pack_set):
+    with pytest.raises(packfile.PackError):
+        pack_set.append("not-a-hash.mid", b"data")
@@ -0,0 +1,87 @@
+"""Tests for the Magenta Rapids playback engine
+"""
+
+import os
+import mido
+import pytest
+
+from magenta_rapids import playback
+
+EXAMPLE_FILE = os.path.join(
+    os.path.dirname(__file__), "example_files", "magenta-rapids-a-0.mid"
+)
+
+
+def test_schedule_matches_mido_playback_times():
+    midi_file = mido.MidiFile(EXAMPLE_FILE)
+    expected = []
+    now = 0.0
+    for message in midi_file:
+        now += message.time
+        if not message.is_meta:
+            expected.append((now, message.copy(time=0)))
+    schedule = playback.compile_schedule(midi_file)
+    actual = [
+        (batch.time, message) for batch in schedule for message in batch.messages
+    ]
+    assert [message for _, message in actual] == [
+        message for _, message in expected
+    ]
+    for (actual_time, _), (expected_time, _) in zip(actual, expected):
+        assert actual_time == pytest.approx(expected_time, abs=1e-6)
+
+
+def test_schedule_follows_tempo_changes_and_batches_simultaneous_messages():
+    midi_file = mido.MidiFile(ticks_per_beat=100)
+    midi_file.tracks.append(
+        mido.MidiTrack(
+            [
+                mido.Message("note_on", note=60, time=100),
+                mido.Message("note_on", note=64, time=0),
+                mido.MetaMessage("set_tempo", tempo=250000, time=100),
+                mido.Message("note_off", note=60, time=100),
+            ]
+        )
+    )
+    schedule = playback.compile_schedule(midi_file)
+    assert [batch.time for batch in schedule] == [0.5, 1.25]
+    assert [len(batch.messages) for batch in schedule] == [2, 1]
+
+
+def test_measured_playback_sends_every_message_on_time():
+    midi_file = mido.MidiFile(ticks_per_beat=1000)
+    track = mido.MidiTrack()
+    for idx in range(40):
+        track.append(mido.Message("note_on", note=60 + idx % 12, time=5))
+    midi_file.tracks.append(track)
+    schedule = playback.compile_schedule(midi_file)
+
+    port = playback.MockPort()
+    report = playback.play(schedule, port)
+    assert [message for _, message in port.sent] == [
+        message for batch in schedule for message in batch.messages
+    ]
+    assert len(report.latencies) == len(schedule)
+    summary = report.summary()
+    assert set(summary) == {"latency", "jitter"}
+    assert 0 <= summary["latency"]["p50"] < 0.05
+
+    # Sent times are relative to one start, so they never drift apart
+    first_sent = port.sent[0][0]
+    for (sent, _), batch in zip(port.sent, schedule):
+        assert sent - first_sent == pytest.approx(batch.time, abs=0.05)
+
+
+def test_stopped_playback_resets_the_port():
+    class _ResettablePort(playback.MockPort):
+        was_reset = False
+
+        def reset(self):
+            self.was_reset = True
+
+    port = _ResettablePort()
+    player = playback.Player(port)
+    player.start([playback.Batch(60.0, (mido.Message("note_on"),))])
+    player.stop()
+    assert port.was_reset
+    assert not port.sent
@@ -0,0 +1,98 @@
+"""Tests for the Magenta Rapids mutation server
+"""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import io
+import pytest
+
+from magenta_rapids import backends, environment, mutators, server
+from tests.utils import synthetic_midi
+
+
+@pytest.fixture
+def mutation_environment(tmp_path):
+    env = environment.Environment(
+        backend=backends.LocalFileBackend(str(tmp_path)),
+        mutator=mutators.SimpleMutator(),
+    )
+    env.initialize()
+    return env
+
+
+def _request(body, number_steps=1, extra_headers=""):
+    return (
+        f"POST /mutate?number_steps={number_steps} HTTP/1.1\r\n"
+        f"Content-Length: {len(body)}\r\n{extra_headers}\r\n"
+    ).encode() + body
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = next(
+        int(line.split(b":")[1])
+        for line in head.split(b"\r\n")
+        if line.lower().startswith(b"content-length")
+    )
+    return status, await reader.readexactly(length)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_pipelined_requests_are_answered_in_order(mutation_environment, jobs):
+    bodies = [synthetic_midi(seed, number_events=30).read() for seed in range(6)]
+    expected = [
+        mutators.SimpleMutator().mutate(io.BytesIO(body), steps).read()
+        for steps, body in enumerate(bodies)
+    ]
+
+    async def _run():
+        mutation_server = server.MutationServer(
+            mutation_environment, jobs=jobs, max_in_flight=2, max_pipeline=2
+        )
+        listening = await mutation_server.start(port=0)
+        port = listening.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            # Every request is written before any response is read
+            writer.write(
+                b"".join(_request(body, steps) for steps, body in enumerate(bodies))
+            )
+            responses = [await _read_response(reader) for _ in bodies]
+            writer.close()
+        finally:
+            await mutation_server.close()
+        return responses
+
+    responses = asyncio.run(_run())
+    assert responses == [(200, result) for result in expected]
+
+
+def test_unix_socket_and_errors(mutation_environment, tmp_path):
+    async def _run():
+        mutation_server = server.MutationServer(mutation_environment)
+        socket_path = str(tmp_path / "server.sock")
+        await mutation_server.start(unix_socket=socket_path)
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(b"GET /health HTTP/1.1\r\n\r\n")
+            health = await _read_response(reader)
+            writer.write(_request(b"not midi"))
+            invalid_file = await _read_response(reader)
+            writer.write(_request(b"", number_steps="x"))
+            invalid_steps = await _read_response(reader)
+            writer.write(b"GET /missing HTTP/1.1\r\nConnection: close\r\n\r\n")
+            missing = await _read_response(reader)
+            closed = await reader.read()
+            writer.close()
+        finally:
+            await mutation_server.close()
+        return health, invalid_file, invalid_steps, missing, closed
+
+    health, invalid_file, invalid_steps, missing, closed = asyncio.run(_run())
+    assert health == (200, b"ok\n")
+    assert invalid_file[0] == 422
+    assert invalid_steps[0] == 400
+    assert missing[0] == 404
+    assert closed == b""
+    assert not (tmp_path / "server.sock").exists()
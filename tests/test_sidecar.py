@@ -0,0 +1,141 @@
+"""Tests for Magenta Rapids columnar sidecars
+"""
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import io
+import json
+import os
+import struct
+import tempfile
+import pytest
+
+from magenta_rapids import backends, environment, mutators, sidecar, smf
+from tests.utils import synthetic_midi
+
+
+@pytest.fixture
+def stored_file():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "source.mid")
+        with open(path, "wb") as file_obj:
+            file_obj.write(synthetic_midi(0).read())
+        yield path
+
+
+def _decode(path):
+    with open(path, "rb") as file_obj:
+        return smf.decode(file_obj.read())
+
+
+def test_sidecar_round_trips_the_source_file(stored_file):
+    sidecar.write(_decode(stored_file), stored_file)
+    with open(stored_file, "rb") as file_obj:
+        assert smf.encode(sidecar.load(stored_file)) == file_obj.read()
+
+
+def test_missing_and_stale_sidecars_are_rejected(stored_file):
+    assert not sidecar.is_fresh(stored_file)
+    with pytest.raises(sidecar.SidecarError):
+        sidecar.load(stored_file)
+    sidecar.write(_decode(stored_file), stored_file)
+    assert sidecar.is_fresh(stored_file)
+    os.utime(stored_file, ns=(0, 0))
+    assert not sidecar.is_fresh(stored_file)
+    with pytest.raises(sidecar.SidecarError):
+        sidecar.load(stored_file)
+
+
+def test_sidecars_of_other_versions_are_rejected(stored_file):
+    sidecar.write(_decode(stored_file), stored_file)
+    with open(sidecar.path_for(stored_file), "r+b") as file_obj:
+        file_obj.seek(len(sidecar.MAGIC))
+        file_obj.write((sidecar.VERSION + 1).to_bytes(4, "little"))
+    assert not sidecar.is_fresh(stored_file)
+    with pytest.raises(sidecar.SidecarError):
+        sidecar.load(stored_file)
+
+
+def test_malformed_sidecar_headers_are_rejected(stored_file):
+    header = json.dumps({"chunks": []}).encode()
+    with open(sidecar.path_for(stored_file), "wb") as file_obj:
+        file_obj.write(
+            struct.pack("<4sII", sidecar.MAGIC, sidecar.VERSION, len(header))
+        )
+        file_obj.write(header)
+    assert not sidecar.is_fresh(stored_file)
+    with pytest.raises(sidecar.SidecarError):
+        sidecar.load(stored_file)
+
+
+def _variable_length(value):
+    encoded = [value & 0x7F]
+    while value := value >> 7:
+        encoded.append(0x80 | value & 0x7F)
+    return bytes(reversed(encoded))
+
+
+def test_files_with_too_many_ticks_are_stored_without_a_sidecar():
+    # Each delta-time fits in 64 bits, but not the absolute tick of the last
+    events = b"".join(
+        _variable_length(1 << 62) + bytes([0xB0, 7, value])
+        for value in (64, 65)
+    ) + b"\0\xff\x2f\0"
+    data = (
+        b"MThd" + struct.pack(">IHHH", 6, 0, 1, 96)
+        + b"MTrk" + struct.pack(">I", len(events)) + events
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backend = backends.LocalFileBackend(tmpdir)
+        env = environment.Environment(
+            backend=backend, mutator=mutators.SimpleMutator()
+        )
+        env.initialize()
+        contents = sorted(os.listdir(tmpdir))
+        with pytest.raises(sidecar.SidecarError):
+            sidecar.write(smf.decode(data), os.path.join(tmpdir, "source.mid"))
+        assert sorted(os.listdir(tmpdir)) == contents
+        path = env.store(io.BytesIO(data))
+        filename = os.path.basename(path)
+        assert os.listdir(backend.unprocessed_path) == [filename]
+        assert backend.sidecar_source(filename) is None
+        asyncio.run(env.mutate(1))
+        assert os.listdir(backend.processed_path) == [filename]
+
+
+@pytest.mark.parametrize(
+    "mutator",
+    [
+        mutators.SimpleMutator(),
+        mutators.VectorizedMutator(),
+        mutators.MemoizedMutator(),
+    ],
+)
+def test_mutating_a_sidecar_matches_mutating_the_file(stored_file, mutator):
+    sidecar.write(_decode(stored_file), stored_file)
+    with open(stored_file, "rb") as file_obj:
+        expected = mutator.mutate(file_obj, 3).read()
+    assert mutator.mutate_decoded(sidecar.load(stored_file), 3).read() == expected
+
+
+def test_backend_writes_and_rebuilds_sidecars():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backend = backends.LocalFileBackend(tmpdir)
+        env = environment.Environment(
+            backend=backend, mutator=mutators.SimpleMutator()
+        )
+        env.initialize()
+        path = env.store(synthetic_midi(1))
+        filename = os.path.basename(path)
+        assert sidecar.is_fresh(path)
+        assert [row["filename"] for row in env.list_files()] == [filename]
+
+        os.unlink(sidecar.path_for(path))
+        assert backend.sidecar_source(filename) == path
+        assert sidecar.is_fresh(path)
+
+        asyncio.run(env.mutate(2))
+        with open(path, "rb") as file_obj:
+            expected = mutators.SimpleMutator().mutate(file_obj, 2).read()
+        with open(os.path.join(backend.processed_path, filename), "rb") as file_obj:
+            assert file_obj.read() == expected
@@ -0,0 +1,92 @@
+"""Tests for the Standard MIDI File codec
+"""
+
+import io
+import os
+import mido
+import pytest
+
+from magenta_rapids import mutators, smf
+from tests.utils import synthetic_midi
+
+EXAMPLE_FILES_PATH = os.path.join(os.path.dirname(__file__), "example_files")
+EXAMPLE_FILES = sorted(
+    os.path.join(EXAMPLE_FILES_PATH, filename)
+    for filename in os.listdir(EXAMPLE_FILES_PATH)
+)
+
+
+def _messages(data):
+    return [
+        [message.dict() for message in track]
+        for track in mido.MidiFile(file=io.BytesIO(data)).tracks
+    ]
+
+
+@pytest.mark.parametrize("path", EXAMPLE_FILES)
+def test_round_trip_example_files(path):
+    with open(path, "rb") as file_obj:
+        data = file_obj.read()
+    decoded = smf.decode(data)
+    assert smf.encode(decoded) == data
+    assert decoded.ticks_per_beat == mido.MidiFile(path).ticks_per_beat
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_round_trip_running_status(seed):
+    # mido writes consecutive messages with the same status using running
+    # status, which the codec must preserve
+    data = synthetic_midi(seed, number_events=100).read()
+    decoded = smf.decode(data)
+    assert smf.encode(decoded) == data
+    notes = [
+        message
+        for message in mido.MidiFile(file=io.BytesIO(data)).tracks[0]
+        if message.type in ("note_on", "note_off")
+    ]
+    track = decoded.tracks[0]
+    assert [track.notes[idx] for idx in track.note_indices] == [
+        message.note for message in notes
+    ]
+    assert [track.deltas[idx] for idx in track.note_indices] == [
+        message.time for message in notes
+    ]
+
+
+def test_round_trip_non_track_chunks():
+    data = synthetic_midi(0, number_events=10).read()
+    data += b"XFIH" + (4).to_bytes(4, "big") + b"\x01\x02\x03\x04"
+    assert smf.encode(smf.decode(data)) == data
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"RIFF0000", b"MThd\x00\x00\x00\x06\x00\x00\x00\x01\x01\xe0MTrk\x00\x00\x00\x09"],
+)
+def test_decode_rejects_malformed_files(data):
+    with pytest.raises(smf.SMFError):
+        smf.decode(data)
+
+
+@pytest.mark.parametrize("path", EXAMPLE_FILES)
+@pytest.mark.parametrize("number_steps", [1, 13])
+def test_codec_and_mido_mutations_are_equivalent(path, number_steps):
+    mutator = mutators.SimpleMutator()
+    with open(path, "rb") as file_obj:
+        data = file_obj.read()
+    # pylint: disable=protected-access
+    expected = mutator._mutate_with_mido(io.BytesIO(data), number_steps).read()
+    actual = mutator.mutate(io.BytesIO(data), number_steps).read()
+    assert _messages(actual) == _messages(expected)
+
+
+@pytest.mark.parametrize("path", EXAMPLE_FILES)
+def test_outgrown_delta_times_fall_back_to_mido(path):
+    mutator = mutators.SimpleMutator()
+    with open(path, "rb") as file_obj:
+        mutated = mutator.mutate(file_obj, 100).read()
+    # Delta-times past 64 bits, which the codec leaves to `mido`
+    with pytest.raises(smf.SMFError):
+        smf.decode(mutated)
+    again = mutator.mutate(io.BytesIO(mutated), 1).read()
+    assert len(_messages(again)) == len(_messages(mutated))
@@ -0,0 +1,160 @@
+"""Tests for the Magenta Rapids watch mode
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import threading
+import time
+import pytest
+
+from magenta_rapids import backends, environment, mutators, watch
+from tests.utils import synthetic_midi
+
+
+@pytest.mark.parametrize(
+    "polling",
+    [
+        True,
+        pytest.param(
+            False,
+            marks=pytest.mark.skipif(
+                not watch.InotifyDetector.available(), reason="requires inotify"
+            ),
+        ),
+    ],
+)
+def test_watcher_mutates_files_as_they_arrive(tmp_path, polling):
+    backend = backends.LocalFileBackend(str(tmp_path))
+    env = environment.Environment(backend=backend, mutator=mutators.SimpleMutator())
+    env.initialize()
+    contents = [synthetic_midi(seed, number_events=20).read() for seed in range(3)]
+    env.store(io.BytesIO(contents[0]))
+    dropped_path = os.path.join(backend.unprocessed_path, "dropped.mid")
+
+    def _arrive():
+        time.sleep(0.2)
+        # Stored through another backend, like a separate `store` process
+        backends.LocalFileBackend(str(tmp_path)).store(io.BytesIO(contents[1]))
+        # Copied in without `store`, pausing for less than the debounce
+        # interval between writes
+        chunk_size = len(contents[2]) // 4 + 1
+        with open(dropped_path, "wb") as file_obj:
+            for start in range(0, len(contents[2]), chunk_size):
+                file_obj.write(contents[2][start:start + chunk_size])
+                file_obj.flush()
+                time.sleep(0.1)
+
+    def _stop_when_done(_):
+        if len(os.listdir(backend.processed_path)) == len(contents):
+            watcher.stop()
+
+    watcher = watch.Watcher(
+        env, 2, debounce=0.3, poll_interval=0.05, polling=polling,
+        on_batch=_stop_when_done,
+    )
+    arrivals = threading.Thread(target=_arrive)
+    arrivals.start()
+
+    async def _run():
+        await asyncio.wait_for(watcher.run(), timeout=20)
+
+    asyncio.run(_run())
+    arrivals.join()
+
+    filenames = [f"{hashlib.sha1(data).hexdigest()}.mid" for data in contents[:2]]
+    filenames.append("dropped.mid")
+    assert sorted(os.listdir(backend.processed_path)) == sorted(filenames)
+    for filename, data in zip(filenames, contents):
+        with open(os.path.join(backend.processed_path, filename), "rb") as file_obj:
+            assert file_obj.read() == (
+                mutators.SimpleMutator().mutate(io.BytesIO(data), 2).read()
+            )
+    assert "dropped.mid" in [row["filename"] for row in env.list_files()]
+
+
+def test_watcher_leaves_corrupt_files_unprocessed_and_keeps_watching(tmp_path):
+    backend = backends.LocalFileBackend(str(tmp_path))
+    env = environment.Environment(backend=backend, mutator=mutators.SimpleMutator())
+    env.initialize()
+    corrupt = b"MThd\x00\x00\x00\x06\x00\x01\x00\x01\x01\xe0MTrk\xff\xff\xff\xff"
+    env.store(io.BytesIO(corrupt))
+    good = synthetic_midi(0, number_events=20).read()
+    errors = []
+    batches = []
+
+    def _on_batch(filenames):
+        batches.append(filenames)
+        if "good.mid" in filenames:
+            watcher.stop()
+
+    watcher = watch.Watcher(
+        env, 2, debounce=0.1, poll_interval=0.05, polling=True,
+        on_batch=_on_batch,
+        on_error=lambda filename, error: errors.append(filename),
+    )
+
+    async def _run():
+        task = asyncio.ensure_future(watcher.run())
+        await asyncio.sleep(0.3)
+        # A corrupt file arriving with a good one, in the same batch
+        for filename, data in (("corrupt.mid", b"not MIDI"), ("good.mid", good)):
+            with open(
+                os.path.join(backend.unprocessed_path, filename), "wb"
+            ) as file_obj:
+                file_obj.write(data)
+        await asyncio.wait_for(task, timeout=20)
+
+    asyncio.run(_run())
+    # The stored file fails in the catch-up batch, and again once the
+    # detector, which reports every file at first, finds it settled
+    assert errors == [f"{hashlib.sha1(corrupt).hexdigest()}.mid"] * 2 + [
+        "corrupt.mid"
+    ]
+    assert batches == [["good.mid"]]
+    assert os.listdir(backend.processed_path) == ["good.mid"]
+
+
+def test_watcher_skips_files_that_vanish_before_they_are_catalogued(
+    tmp_path, monkeypatch
+):
+    backend = backends.LocalFileBackend(str(tmp_path))
+    env = environment.Environment(backend=backend, mutator=mutators.SimpleMutator())
+    env.initialize()
+    index_file = backend.index_file
+
+    def _index_file(path):
+        if os.path.basename(path) == "gone.mid":
+            # Removed between settling and being catalogued
+            raise FileNotFoundError(path)
+        return index_file(path)
+
+    monkeypatch.setattr(backend, "index_file", _index_file)
+    errors = []
+    batches = []
+
+    def _on_batch(filenames):
+        batches.append(filenames)
+        watcher.stop()
+
+    watcher = watch.Watcher(
+        env, 2, debounce=0.1, poll_interval=0.05, polling=True,
+        on_batch=_on_batch,
+        on_error=lambda filename, error: errors.append((filename, type(error))),
+    )
+
+    async def _run():
+        task = asyncio.ensure_future(watcher.run())
+        await asyncio.sleep(0.3)
+        for seed, filename in enumerate(("gone.mid", "good.mid")):
+            with open(
+                os.path.join(backend.unprocessed_path, filename), "wb"
+            ) as file_obj:
+                file_obj.write(synthetic_midi(seed, number_events=20).read())
+        await asyncio.wait_for(task, timeout=20)
+
+    asyncio.run(_run())
+    assert errors == [("gone.mid", FileNotFoundError)]
+    assert batches == [["good.mid"]]
+    assert os.listdir(backend.processed_path) == ["good.mid"]
@@ -0,0 +1,42 @@
+"""Helpers shared by the Magenta Rapids tests
+"""
+
+import io
+import os
+import random
+import mido
+
+
+def synthetic_midi(seed, number_tracks=3, number_events=200):
+    """Build a deterministic multi-track MIDI file in memory"""
+    rng = random.Random(seed)
+    file = mido.MidiFile(type=1, ticks_per_beat=480)
+    for channel in range(number_tracks):
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage("set_tempo", tempo=500000, time=0))
+        for _ in range(number_events):
+            note = rng.randint(1, 127)
+            track.append(
+                mido.Message(
+                    "note_on", channel=channel, note=note,
+                    velocity=rng.randint(0, 127), time=rng.randint(0, 2000),
+                )
+            )
+            if rng.random() < 0.1:
+                track.append(
+                    mido.Message(
+                        "control_change", channel=channel, control=7,
+                        value=rng.randint(0, 127), time=rng.randint(0, 50),
+                    )
+                )
+            track.append(
+                mido.Message(
+                    "note_off", channel=channel, note=note,
+                    velocity=64, time=rng.randint(0, 2000),
+                )
+            )
+        file.tracks.append(track)
+    buffer = io.BytesIO()
+    file.save(file=buffer)
+    buffer.seek(os.SEEK_SET)
+    return buffer